@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark: lector nativo de pcap vs tshark -T fields.
+
+Genera un pcapng sintético (``synth_pcap``) y mide el tiempo de extraer
+los campos básicos con ``pcap_reader.iter_headers`` y, si está instalado,
+con el mismo comando tshark que usa el ingestor.
+
+Uso:
+    python3 benchmarks/bench_pcap_reader.py --packets 200000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "wifi"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import pcap_reader  # noqa: E402
+import supabase_tshark_ingest as ingest  # noqa: E402
+from synth_pcap import write_pcapng  # noqa: E402
+
+# El ingestor convierte SIGINT en parada ordenada; aquí Ctrl+C debe abortar
+signal.signal(signal.SIGINT, signal.default_int_handler)
+
+
+def bench_native(path: Path) -> float:
+    start = time.perf_counter()
+    count = sum(1 for _ in pcap_reader.iter_headers(path))
+    elapsed = time.perf_counter() - start
+    return elapsed if count else float("nan")
+
+
+def bench_tshark(path: Path) -> float:
+    cfg = ingest.IngestConfig(
+        supabase_url="", supabase_api_key="", table="network_packets", batch_size=200,
+        mode="file", iface=None, pcap=path, limit=None, dry_run=False,
+    )
+    cmd = [arg for arg in ingest.build_tshark_cmd(cfg) if arg != "-l"]
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Benchmark lector nativo vs tshark")
+    p.add_argument("--packets", type=int, default=200_000)
+    p.add_argument("--pcap", help="Usa un pcap existente en vez del sintético")
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(args.pcap) if args.pcap else Path(tmp) / "synthetic.pcapng"
+        if not args.pcap:
+            write_pcapng(path, args.packets, payload_bytes=63)
+
+        result = {"pcap": str(path), "bytes": path.stat().st_size}
+        native = bench_native(path)
+        result["native_sec"] = round(native, 4)
+        if shutil.which("tshark"):
+            tshark = bench_tshark(path)
+            result["tshark_sec"] = round(tshark, 4)
+            result["speedup"] = round(tshark / native, 1)
+        else:
+            result["tshark_sec"] = None
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
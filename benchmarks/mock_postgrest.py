@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+PostgREST simulado para benchmarks y pruebas locales.
+
+Acepta ``POST /rest/v1/<tabla>`` (JSON, opcionalmente con gzip) y
+``POST /api/v2/write`` (line protocol de InfluxDB), responde 201/204 y
+registra por petición: tabla, filas, bytes, latencia y código. Permite
+inyectar retardo (``--delay-ms`` + ``--jitter-ms``) y una tasa de errores 500
+(``--error-rate``). ``GET /_stats`` devuelve el resumen en JSON.
+
+Uso como proceso:
+    python3 benchmarks/mock_postgrest.py --port 18000 --delay-ms 20 --error-rate 0.05
+
+Uso embebido:
+    with MockPostgrest(delay_ms=20) as mock:
+        ...  # SUPABASE_URL=mock.url
+        print(mock.stats())
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import http.server
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class MockPostgrest:
+    def __init__(
+        self,
+        port: int = 0,
+        host: str = "127.0.0.1",
+        delay_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.delay_ms = delay_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests: List[Dict[str, Any]] = []
+        mock = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self) -> None:
+                mock._handle_post(self)
+
+            def do_GET(self) -> None:
+                if self.path != "/_stats":
+                    self.send_error(404)
+                    return
+                body = json.dumps(mock.stats()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self._thread: Optional[threading.Thread] = None
+
+    def _handle_post(self, handler: http.server.BaseHTTPRequestHandler) -> None:
+        started = time.perf_counter()
+        raw = handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+        body = gzip.decompress(raw) if handler.headers.get("Content-Encoding") == "gzip" else raw
+        path = handler.path.split("?", 1)[0]
+
+        with self._lock:
+            fail = self._rng.random() < self.error_rate
+            delay = self.delay_ms + (self._rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+        rows = 0
+        if path.startswith("/rest/v1/"):
+            table = path[len("/rest/v1/"):]
+            try:
+                rows = len(json.loads(body))
+                status = 500 if fail else 201
+            except ValueError:
+                status = 400
+        elif path == "/api/v2/write":
+            table = "influx"
+            rows = body.count(b"\n") + 1 if body else 0
+            status = 500 if fail else 204
+        else:
+            table = path
+            status = 404
+
+        response = b"" if status < 300 else json.dumps({"message": "mock error"}).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Length", str(len(response)))
+        handler.end_headers()
+        handler.wfile.write(response)
+
+        with self._lock:
+            self.requests.append({
+                "table": table,
+                "status": status,
+                "rows": rows if status < 300 else 0,
+                "bytes": len(raw),
+                "latency_ms": (time.perf_counter() - started) * 1000,
+            })
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = list(self.requests)
+        tables: Dict[str, Dict[str, Any]] = {}
+        for req in requests:
+            t = tables.setdefault(req["table"], {"requests": 0, "rows": 0, "bytes": 0, "status": {}})
+            t["requests"] += 1
+            t["rows"] += req["rows"]
+            t["bytes"] += req["bytes"]
+            t["status"][str(req["status"])] = t["status"].get(str(req["status"]), 0) + 1
+        latencies = [r["latency_ms"] for r in requests]
+        sizes = [r["bytes"] for r in requests]
+        return {
+            "requests": len(requests),
+            "rows": sum(r["rows"] for r in requests),
+            "bytes": sum(sizes),
+            "request_bytes_p50": _percentile(sizes, 0.5),
+            "request_bytes_max": max(sizes) if sizes else None,
+            "latency_ms_p50": _percentile(latencies, 0.5),
+            "latency_ms_p95": _percentile(latencies, 0.95),
+            "tables": tables,
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests.clear()
+
+    def start(self) -> "MockPostgrest":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-postgrest", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockPostgrest":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="PostgREST simulado para benchmarks")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=18000)
+    p.add_argument("--delay-ms", type=float, default=0.0)
+    p.add_argument("--jitter-ms", type=float, default=0.0)
+    p.add_argument("--error-rate", type=float, default=0.0, help="Fracción de peticiones que responden 500")
+    args = p.parse_args()
+
+    mock = MockPostgrest(args.port, args.host, args.delay_ms, args.jitter_ms, args.error_rate)
+    print(f"[INFO] Mock PostgREST en {mock.url} (GET /_stats para el resumen)")
+    try:
+        mock._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(mock.stats()))
+
+
+if __name__ == "__main__":
+    main()
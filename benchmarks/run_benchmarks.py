@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Suite de benchmarks reproducible del ingestor.
+
+Genera un pcapng sintético (``synth_pcap``), levanta un PostgREST simulado
+(``mock_postgrest``) y mide cada etapa por separado y el pipeline completo:
+
+- ``decode_tshark``: tshark -T fields con los mismos campos que el ingestor
+  (si no está instalado, las líneas TSV se generan con el lector nativo y la
+  etapa se marca como omitida).
+- ``decode_native``: ``pcap_reader.iter_headers``.
+- ``to_record`` / ``columnar``: líneas TSV -> filas.
+- ``json_dumps`` / ``columnar_to_json``: serialización del cuerpo del POST.
+- ``post_batch``: POST secuenciales contra el mock (con --delay-ms/--error-rate).
+- ``end_to_end``: ``supabase_tshark_ingest.py --mode file`` contra el mock.
+
+El resultado es un único JSON (stdout o --output) para comparar ejecuciones.
+
+Uso:
+    python3 benchmarks/run_benchmarks.py --packets 100000 --payload-bytes 64 --output bench.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "wifi"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import columnar  # noqa: E402
+import pcap_reader  # noqa: E402
+import supabase_tshark_ingest as ingest  # noqa: E402
+from mock_postgrest import MockPostgrest  # noqa: E402
+from synth_pcap import DEFAULT_MIX, write_pcapng  # noqa: E402
+
+# El ingestor convierte SIGINT en parada ordenada; aquí Ctrl+C debe abortar
+signal.signal(signal.SIGINT, signal.default_int_handler)
+
+SOURCE = "bench"
+
+
+def _timed(fn: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """Mejor tiempo de ``repeat`` ejecuciones (y el resultado de la última)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return {"sec": best, "result": result}
+
+
+def _rate(count: int, seconds: float) -> Dict[str, Any]:
+    return {"sec": round(seconds, 4), "rows": count, "rows_per_sec": round(count / seconds) if seconds > 0 else None}
+
+
+def header_to_tsv(h: pcap_reader.PacketHeader) -> str:
+    """Línea con el mismo formato que ``build_tshark_cmd`` (13 columnas)."""
+    tcp = h.tcp_flags is not None
+    ports = ["", "", "", ""]
+    if h.src_port is not None:
+        ports = [str(h.src_port), "", str(h.dst_port), ""] if tcp else ["", str(h.src_port), "", str(h.dst_port)]
+    return "\t".join([
+        f"{h.epoch:.6f}", h.src_ip, h.dst_ip, ports[0], ports[1], ports[2], ports[3],
+        h.protocol, str(h.frame_len), "", str(h.frame_number),
+        f"0x{h.tcp_flags:04x}" if tcp else "", "" if h.dns_rcode is None else str(h.dns_rcode),
+    ]) + "\n"
+
+
+def tshark_lines(pcap: Path) -> Optional[List[str]]:
+    if not shutil.which("tshark"):
+        return None
+    cfg = bench_config("file", pcap)
+    cmd = [arg for arg in ingest.build_tshark_cmd(cfg) if arg != "-l"]
+    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    return out.decode("utf-8", errors="replace").splitlines(keepends=True)
+
+
+def bench_config(mode: str, pcap: Optional[Path], url: str = "", batch_size: int = 200) -> ingest.IngestConfig:
+    return ingest.IngestConfig(
+        supabase_url=url,
+        supabase_api_key="bench",
+        table="network_packets",
+        batch_size=batch_size,
+        mode=mode,
+        iface=None,
+        pcap=pcap,
+        limit=None,
+        dry_run=False,
+    )
+
+
+def bench_decode(pcap: Path, repeat: int) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    native = _timed(lambda: sum(1 for _ in pcap_reader.iter_headers(pcap)), repeat)
+    out["decode_native"] = _rate(native["result"], native["sec"])
+
+    if shutil.which("tshark"):
+        tshark = _timed(lambda: tshark_lines(pcap), 1)
+        lines = tshark["result"] or []
+        out["decode_tshark"] = _rate(len(lines), tshark["sec"])
+    else:
+        lines = [header_to_tsv(h) for h in pcap_reader.iter_headers(pcap)]
+        out["decode_tshark"] = {"skipped": "tshark no instalado; líneas TSV generadas con el lector nativo"}
+    out["_lines"] = lines
+    return out
+
+
+def bench_records(lines: List[str], batch_size: int, repeat: int) -> Dict[str, Any]:
+    chunks = [lines[i:i + batch_size] for i in range(0, len(lines), batch_size)]
+
+    def rows() -> List[List[Dict[str, Any]]]:
+        return [[r for r in (ingest.to_record(line.rstrip("\n").split("\t"), SOURCE) for line in chunk) if r] for chunk in chunks]
+
+    def blocks() -> List[columnar.ColumnBatch]:
+        formatter = columnar.IsoFormatter()
+        return [columnar.decode_lines(chunk, SOURCE, formatter) for chunk in chunks]
+
+    row_run = _timed(rows, repeat)
+    col_run = _timed(blocks, repeat)
+    row_batches, col_batches = row_run["result"], col_run["result"]
+
+    dumps = _timed(lambda: sum(len(json.dumps(b)) for b in row_batches), repeat)
+    to_json = _timed(lambda: sum(len(b.to_json()) for b in col_batches), repeat)
+    n_rows = sum(len(b) for b in row_batches)
+    return {
+        "to_record": _rate(n_rows, row_run["sec"]),
+        "columnar": _rate(sum(len(b) for b in col_batches), col_run["sec"]),
+        "json_dumps": {**_rate(n_rows, dumps["sec"]), "bytes": dumps["result"]},
+        "columnar_to_json": {**_rate(n_rows, to_json["sec"]), "bytes": to_json["result"]},
+        "_batches": col_batches,
+    }
+
+
+def bench_post(mock: MockPostgrest, batches: List[columnar.ColumnBatch]) -> Dict[str, Any]:
+    cfg = bench_config("file", None, url=mock.url)
+    mock.reset()
+    session = ingest.requests.Session()
+    errors = 0
+    started = time.perf_counter()
+    for batch in batches:
+        try:
+            ingest.post_batch(cfg, batch, session=session)
+        except RuntimeError:
+            errors += 1
+    elapsed = time.perf_counter() - started
+    session.close()
+    return {**_rate(sum(len(b) for b in batches), elapsed), "failed_batches": errors, "mock": mock.stats()}
+
+
+def bench_end_to_end(mock: MockPostgrest, pcap: Path, reader: str, batch_size: int, workers: int, tmp: Path) -> Dict[str, Any]:
+    mock.reset()
+    state_dir = tmp / f"state-{reader}"
+    cmd = [
+        sys.executable, str(ROOT / "wifi" / "supabase_tshark_ingest.py"),
+        "--mode", "file", "--pcap", str(pcap), "--reader", reader,
+        "--batch-size", str(batch_size), "--workers", str(workers), "--state-dir", str(state_dir),
+    ]
+    env = dict(os.environ, SUPABASE_URL=mock.url, SUPABASE_API_KEY="bench")
+    started = time.perf_counter()
+    proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=str(tmp))
+    elapsed = time.perf_counter() - started
+    stats = mock.stats()
+    result = {**_rate(stats["rows"], elapsed), "returncode": proc.returncode, "mock": stats}
+    if proc.returncode != 0:
+        result["output_tail"] = proc.stdout.decode("utf-8", errors="replace").splitlines()[-5:]
+    return result
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Benchmarks por etapa y extremo a extremo del ingestor")
+    p.add_argument("--packets", type=int, default=50_000)
+    p.add_argument("--mix", default=DEFAULT_MIX, help="Mezcla de protocolos para el pcap sintético")
+    p.add_argument("--payload-bytes", type=int, default=0, help="Payload máximo por paquete (0 = sin payload)")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--pcap", help="Usa un pcap existente en vez del sintético")
+    p.add_argument("--batch-size", type=int, default=200)
+    p.add_argument("--workers", type=int, default=2, help="Workers del ingestor en la prueba extremo a extremo")
+    p.add_argument("--repeat", type=int, default=3, help="Repeticiones de las etapas en memoria (se toma la mejor)")
+    p.add_argument("--delay-ms", type=float, default=0.0, help="Retardo inyectado por el mock en cada POST")
+    p.add_argument("--jitter-ms", type=float, default=0.0)
+    p.add_argument("--error-rate", type=float, default=0.0, help="Fracción de POST que el mock responde con 500")
+    p.add_argument("--skip-e2e", action="store_true", help="Omite la prueba extremo a extremo")
+    p.add_argument("--output", help="Fichero JSON de salida (por defecto stdout)")
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_name:
+        tmp = Path(tmp_name)
+        if args.pcap:
+            pcap = Path(args.pcap)
+        else:
+            pcap = tmp / "synthetic.pcapng"
+            write_pcapng(pcap, args.packets, args.mix, args.payload_bytes, args.seed)
+
+        result: Dict[str, Any] = {
+            "params": {
+                "pcap": args.pcap, "packets": args.packets, "mix": args.mix, "payload_bytes": args.payload_bytes,
+                "seed": args.seed, "batch_size": args.batch_size, "delay_ms": args.delay_ms,
+                "error_rate": args.error_rate, "pcap_bytes": pcap.stat().st_size,
+            },
+            "env": {"python": platform.python_version(), "platform": platform.platform(), "tshark": bool(shutil.which("tshark"))},
+        }
+
+        stages = bench_decode(pcap, args.repeat)
+        lines = stages.pop("_lines")
+        stages.update(bench_records(lines, args.batch_size, args.repeat))
+        batches = stages.pop("_batches")
+
+        with MockPostgrest(delay_ms=args.delay_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate, seed=args.seed) as mock:
+            stages["post_batch"] = bench_post(mock, batches)
+            result["stages"] = stages
+            if not args.skip_e2e:
+                readers = ["native", "tshark"] if shutil.which("tshark") else ["native"]
+                result["end_to_end"] = {
+                    reader: bench_end_to_end(mock, pcap, reader, args.batch_size, args.workers, tmp) for reader in readers
+                }
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+        print(f"[OK] Resultados en {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
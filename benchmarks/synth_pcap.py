@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Generador de pcapng sintéticos para los benchmarks.
+
+Tráfico Ethernet con mezcla configurable de TCP, UDP e ICMP sobre IPv4 y
+TCP/UDP sobre IPv6, con o sin payload. La salida es determinista para una
+misma semilla, así que dos ejecuciones del benchmark leen exactamente los
+mismos bytes.
+
+Uso:
+    python3 benchmarks/synth_pcap.py out.pcapng --packets 200000 --mix tcp=50,udp=30,icmp=10,ipv6=10 --payload-bytes 64
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import struct
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+DEFAULT_MIX = "tcp=50,udp=30,icmp=10,ipv6=10"
+PROTOCOLS = ("tcp", "udp", "icmp", "ipv6")
+TCP_FLAGS = (0x002, 0x012, 0x010, 0x018, 0x011, 0x004)
+ETH_HEADER = b"\x00\x11\x22\x33\x44\x55\x66\x77\x88\x99\xaa\xbb"
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """``tcp=50,udp=30`` -> pesos normalizados; error si hay protocolos desconocidos."""
+    mix: Dict[str, float] = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip().lower()
+        if name not in PROTOCOLS:
+            raise ValueError(f"protocolo desconocido en --mix: {name} (válidos: {', '.join(PROTOCOLS)})")
+        mix[name] = float(weight or 1)
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError("--mix sin pesos positivos")
+    return {name: weight / total for name, weight in mix.items()}
+
+
+def _block(block_type: int, body: bytes) -> bytes:
+    body += b"\x00" * (-len(body) % 4)
+    total = len(body) + 12
+    return struct.pack("<II", block_type, total) + body + struct.pack("<I", total)
+
+
+def _checksum(header: bytes) -> int:
+    total = sum(struct.unpack(f">{len(header) // 2}H", header))
+    while total > 0xFFFF:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def _ipv4(proto: int, src: bytes, dst: bytes, l4: bytes, ident: int) -> bytes:
+    header = struct.pack(">BBHHHBBH4s4s", 0x45, 0, 20 + len(l4), ident & 0xFFFF, 0, 64, proto, 0, src, dst)
+    return ETH_HEADER + b"\x08\x00" + header[:10] + struct.pack(">H", _checksum(header)) + header[12:] + l4
+
+
+def _ipv6(proto: int, src: bytes, dst: bytes, l4: bytes) -> bytes:
+    return ETH_HEADER + b"\x86\xdd" + struct.pack(">IHBB", 0x60000000, len(l4), proto, 64) + src + dst + l4
+
+
+def _tcp(sport: int, dport: int, seq: int, flags: int, payload: bytes) -> bytes:
+    return struct.pack(">HHIIBBHHH", sport, dport, seq & 0xFFFFFFFF, 0, 0x50, flags, 65535, 0, 0) + payload
+
+
+def _udp(sport: int, dport: int, payload: bytes) -> bytes:
+    return struct.pack(">HHHH", sport, dport, 8 + len(payload), 0) + payload
+
+
+def _icmp_echo(ident: int, seq: int, payload: bytes) -> bytes:
+    return struct.pack(">BBHHH", 8, 0, 0, ident & 0xFFFF, seq & 0xFFFF) + payload
+
+
+def build_frames(packets: int, mix: Dict[str, float], payload_bytes: int, seed: int, hosts: int = 50) -> List[bytes]:
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    clients: List[Tuple[bytes, bytes]] = [
+        (bytes([192, 168, 50, 20 + i % 200]), b"\xfd\x00" + b"\x00" * 12 + struct.pack(">H", 0x20 + i))
+        for i in range(hosts)
+    ]
+    servers: List[Tuple[bytes, bytes]] = [
+        (bytes([8, 8, i, 8]), b"\x20\x01\x0d\xb8" + b"\x00" * 10 + struct.pack(">H", i + 1))
+        for i in range(8)
+    ]
+    frames = []
+    for i in range(packets):
+        kind = rng.choices(names, weights)[0]
+        client4, client6 = rng.choice(clients)
+        server4, server6 = rng.choice(servers)
+        payload = bytes(rng.getrandbits(8) for _ in range(rng.randint(0, payload_bytes))) if payload_bytes else b""
+        sport = 40000 + rng.randrange(1000)
+        reply = rng.random() < 0.4  # parte del tráfico en sentido servidor -> cliente
+        if kind == "tcp":
+            l4 = _tcp(443 if reply else sport, sport if reply else 443, i, rng.choice(TCP_FLAGS), payload)
+            frames.append(_ipv4(6, server4 if reply else client4, client4 if reply else server4, l4, i))
+        elif kind == "udp":
+            l4 = _udp(9999 if reply else sport, sport if reply else 9999, payload)
+            frames.append(_ipv4(17, server4 if reply else client4, client4 if reply else server4, l4, i))
+        elif kind == "icmp":
+            frames.append(_ipv4(1, client4, server4, _icmp_echo(i, i, payload), i))
+        else:
+            if rng.random() < 0.5:
+                l4, proto = _tcp(sport, 443, i, rng.choice(TCP_FLAGS), payload), 6
+            else:
+                l4, proto = _udp(sport, 9999, payload), 17
+            frames.append(_ipv6(proto, client6, server6, l4))
+    return frames
+
+
+def write_pcapng(
+    path: Path,
+    packets: int,
+    mix: str = DEFAULT_MIX,
+    payload_bytes: int = 0,
+    seed: int = 1,
+    start_epoch: int = 1_760_000_000,
+    interval_us: int = 100,
+) -> int:
+    """Escribe el pcapng y devuelve su tamaño en bytes."""
+    shb = _block(0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1))
+    idb = _block(0x00000001, struct.pack("<HHI", 1, 0, 262144))
+    base_ts = start_epoch * 10 ** 6
+    with path.open("wb") as fh:
+        fh.write(shb + idb)
+        for i, frame in enumerate(build_frames(packets, parse_mix(mix), payload_bytes, seed)):
+            ts = base_ts + i * interval_us
+            epb = struct.pack("<IIIII", 0, ts >> 32, ts & 0xFFFFFFFF, len(frame), len(frame)) + frame
+            fh.write(_block(0x00000006, epb))
+    return path.stat().st_size
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Genera un pcapng sintético")
+    p.add_argument("output")
+    p.add_argument("--packets", type=int, default=100_000)
+    p.add_argument("--mix", default=DEFAULT_MIX, help=f"Pesos por protocolo (por defecto {DEFAULT_MIX})")
+    p.add_argument("--payload-bytes", type=int, default=0, help="Payload máximo por paquete (0 = sin payload)")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args()
+    size = write_pcapng(Path(args.output), args.packets, args.mix, args.payload_bytes, args.seed)
+    print(f"[OK] {args.output}: {args.packets} paquetes, {size} bytes")
+
+
+if __name__ == "__main__":
+    main()
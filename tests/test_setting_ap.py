@@ -0,0 +1,112 @@
+"""
+Pruebas de ``setting-ap.py --reconcile`` con el registro de --dry-run.
+
+No tocan el equipo: el estado se inyecta como ``HostState`` y los ficheros de
+configuración se redirigen a un directorio temporal.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+SCRIPT = Path(__file__).resolve().parent.parent / "wifi" / "setting-ap.py"
+
+
+def load_setting_ap():
+	spec = importlib.util.spec_from_file_location("setting_ap", SCRIPT)
+	module = importlib.util.module_from_spec(spec)
+	sys.modules[spec.name] = module
+	spec.loader.exec_module(module)
+	return module
+
+
+ap = load_setting_ap()
+
+
+@pytest.fixture
+def cfg(tmp_path, monkeypatch):
+	monkeypatch.setattr(ap, "HOSTAPD_CONF", tmp_path / "hostapd.conf")
+	monkeypatch.setattr(ap, "HOSTAPD_DEFAULT", tmp_path / "default-hostapd")
+	monkeypatch.setattr(ap, "DNSMASQ_AP_CONF", tmp_path / "ap.conf")
+	monkeypatch.setattr(ap, "SYSCTL_AP_CONF", tmp_path / "99-ap-forward.conf")
+	monkeypatch.setattr(ap, "DRY_RUN_LOG", [])
+	return ap.APConfig(
+		iface="wlan1",
+		uplink_iface="eth0",
+		ssid="LAB",
+		passphrase="ClaveSegura123",
+		channel=6,
+		country="ES",
+		ap_ip_cidr="192.168.50.1/24",
+		dhcp_start="192.168.50.20",
+		dhcp_end="192.168.50.200",
+		dhcp_lease="12h",
+		capture_dir=tmp_path / "pcaps",
+		capture_prefix="ap-capture",
+		capture_duration_sec=300,
+		capture_filesize_kb=102400,
+		capture_files=20,
+		capture_tool="dumpcap",
+		archive_dir=tmp_path / "archive",
+		archive_budget_gb=20.0,
+		dry_run=True,
+		no_services=False,
+	)
+
+
+def configured_host(cfg) -> "ap.HostState":
+	"""Escribe los ficheros y devuelve el estado de un equipo ya reconciliado."""
+	ap.HOSTAPD_CONF.write_text(ap.hostapd_conf(cfg), encoding="utf-8")
+	ap.DNSMASQ_AP_CONF.write_text(ap.dnsmasq_conf(cfg), encoding="utf-8")
+	ap.SYSCTL_AP_CONF.write_text("net.ipv4.ip_forward=1\n", encoding="utf-8")
+	return ap.HostState(
+		addrs={cfg.ap_ip_cidr},
+		link_up=True,
+		iptables={table: set(rules) for table, rules in ap.nat_rules(cfg).items()},
+		ip_forward=True,
+		active={u: "active" for u in ap.SERVICES},
+		enabled={u: "enabled" for u in ap.SERVICES},
+		capture_running=True,
+		archiver_running=True,
+	)
+
+
+def reconcile(cfg, state, monkeypatch):
+	monkeypatch.setattr(ap, "read_host_state", lambda _cfg: state)
+	ap.reconcile(cfg)
+	return [(cmd[0], text) for cmd, text in ap.DRY_RUN_LOG]
+
+
+def test_reconcile_configured_host_records_nothing(cfg, monkeypatch):
+	assert reconcile(cfg, configured_host(cfg), monkeypatch) == []
+
+
+def test_reconcile_adds_only_missing_rule(cfg, monkeypatch):
+	state = configured_host(cfg)
+	missing = ap.nat_rules(cfg)["filter"][1]
+	state.iptables["filter"].discard(missing)
+
+	assert reconcile(cfg, state, monkeypatch) == [
+		("iptables-restore", f"*filter\n{missing}\nCOMMIT\n"),
+	]
+
+
+def test_reconcile_fresh_host_starts_capture_after_services(cfg, monkeypatch):
+	calls = reconcile(cfg, ap.HostState(), monkeypatch)
+	tools = [tool for tool, _ in calls]
+
+	assert ("ip", f"addr replace {cfg.ap_ip_cidr} dev {cfg.iface}\nlink set {cfg.iface} up\n") in calls
+	restart = tools.index("systemctl", tools.index("systemctl") + 1)
+	assert tools.index("dumpcap") > restart
+	assert tools.index(sys.executable) > restart
+
+
+def test_configure_nat_matches_nat_rules(cfg, capsys):
+	ap.configure_nat(cfg)
+
+	added = [" ".join(cmd[3:]) for cmd, _ in ap.DRY_RUN_LOG]
+	assert added == [r for rules in ap.nat_rules(cfg).values() for r in rules]
@@ -0,0 +1,171 @@
+"""
+Índice incremental de cadenas de ataque (``attack_chain_id`` en network_packets).
+
+Cada cadena guarda un bitset de los pasos vistos (``sequence_number`` 1..N),
+el primer y último timestamp y las IPs de atacante y víctima. Cada fila se
+aplica en O(1) y devuelve un evento cuando cambia algo que interesa:
+
+- ``progress``: primer paquete de un paso todavía no visto
+- ``completed``: el bitset se llena (o la fila trae ``is_chain_complete``)
+- ``expired``: la cadena lleva ``ttl`` segundos sin paquetes sin completarse
+  (o se expulsa por ``max_chains``)
+
+El reloj es el de los propios paquetes, como las ventanas de Influx: una
+importación de datos antiguos caduca igual que el tráfico en vivo.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+class ChainState:
+    __slots__ = (
+        "chain_id", "name", "scenario", "total_steps", "steps", "first_ts", "last_ts",
+        "attacker_ip", "victim_ip", "technique", "packets", "completed",
+    )
+
+    def __init__(self, chain_id: str, total_steps: int, epoch: float) -> None:
+        self.chain_id = chain_id
+        self.name: Optional[str] = None
+        self.scenario: Optional[str] = None
+        self.total_steps = total_steps
+        self.steps = 0  # bit i-1 = paso i visto
+        self.first_ts = epoch
+        self.last_ts = epoch
+        self.attacker_ip: Optional[str] = None
+        self.victim_ip: Optional[str] = None
+        self.technique: Optional[str] = None
+        self.packets = 0
+        self.completed = False
+
+    def steps_seen(self) -> List[int]:
+        return [i + 1 for i in range(self.total_steps) if self.steps >> i & 1]
+
+    def missing_steps(self) -> List[int]:
+        return [i + 1 for i in range(self.total_steps) if not self.steps >> i & 1]
+
+
+def row_epoch(row: Dict[str, Any]) -> Optional[float]:
+    ts = row.get("timestamp")
+    if not ts:
+        return None
+    try:
+        return dt.datetime.fromisoformat(ts).timestamp()
+    except ValueError:
+        return None
+
+
+class ChainIndex:
+    """Cadenas activas en orden de última actividad (``OrderedDict``) para caducarlas en O(1)."""
+
+    def __init__(
+        self,
+        ttl: float = 3600.0,
+        max_chains: int = 100_000,
+        format_ts: Any = None,
+    ) -> None:
+        self.ttl = ttl
+        self.max_chains = max_chains
+        self._format_ts = format_ts or (lambda epoch: dt.datetime.fromtimestamp(epoch, tz=dt.timezone.utc).isoformat())
+        self.chains: "OrderedDict[str, ChainState]" = OrderedDict()
+        self.clock = float("-inf")
+        self.completed = 0
+        self.expired = 0
+        self.invalid = 0
+
+    def observe(self, row: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Aplica una fila; devuelve los eventos que produce (incluidas caducidades)."""
+        chain_id = row.get("attack_chain_id")
+        if not chain_id:
+            return []
+        epoch = row_epoch(row)
+        if epoch is None:
+            self.invalid += 1
+            return []
+        events: List[Dict[str, Any]] = []
+        if epoch > self.clock:
+            self.clock = epoch
+            events.extend(self.expire())
+
+        state = self.chains.get(chain_id)
+        if state is None:
+            total = row.get("total_steps")
+            if not total:
+                # Sin total_steps: la longitud de attack_sequence (sólo entonces se decodifica metadata)
+                meta = row.get("metadata") or {}
+                total = len(meta.get("attack_sequence") or ())
+            if not total:
+                self.invalid += 1
+                return events
+            state = self.chains[chain_id] = ChainState(chain_id, int(total), epoch)
+            state.name = row.get("attack_chain_name")
+            state.scenario = row.get("attack_scenario")
+            state.attacker_ip = row.get("attacker_ip")
+            state.victim_ip = row.get("victim_ip")
+            if len(self.chains) > self.max_chains:
+                _, oldest = self.chains.popitem(last=False)
+                if not oldest.completed:
+                    self.expired += 1
+                    events.append(self.event(oldest, "expired"))
+        else:
+            self.chains.move_to_end(chain_id)
+        state.packets += 1
+        state.first_ts = min(state.first_ts, epoch)
+        state.last_ts = max(state.last_ts, epoch)
+
+        seq = row.get("sequence_number")
+        if not isinstance(seq, int) or not 1 <= seq <= state.total_steps:
+            self.invalid += 1
+            return events
+        bit = 1 << (seq - 1)
+        if state.completed or state.steps & bit:
+            return events
+        state.steps |= bit
+        state.technique = row.get("mitre_technique_id")
+        if state.steps == (1 << state.total_steps) - 1 or row.get("is_chain_complete") is True:
+            state.completed = True
+            self.completed += 1
+            events.append(self.event(state, "completed"))
+        else:
+            events.append(self.event(state, "progress"))
+        return events
+
+    def expire(self) -> List[Dict[str, Any]]:
+        """Quita las cadenas sin actividad en ``ttl`` segundos (las más antiguas van primero)."""
+        events = []
+        limit = self.clock - self.ttl
+        while self.chains:
+            state = next(iter(self.chains.values()))
+            if state.last_ts >= limit:
+                break
+            del self.chains[state.chain_id]
+            if not state.completed:
+                self.expired += 1
+                events.append(self.event(state, "expired"))
+        return events
+
+    def event(self, state: ChainState, status: str) -> Dict[str, Any]:
+        seen = state.steps_seen()
+        return {
+            "chain_id": state.chain_id,
+            "chain_name": state.name,
+            "attack_scenario": state.scenario,
+            "status": status,
+            "steps_seen": seen,
+            "missing_steps": state.missing_steps(),
+            "total_steps": state.total_steps,
+            "progress": round(len(seen) / state.total_steps, 4),
+            "last_technique": state.technique,
+            "attacker_ip": state.attacker_ip,
+            "victim_ip": state.victim_ip,
+            "first_seen": self._format_ts(state.first_ts),
+            "last_seen": self._format_ts(state.last_ts),
+            "packets": state.packets,
+        }
+
+    def active(self) -> List[Dict[str, Any]]:
+        """Estado actual de las cadenas sin completar."""
+        return [self.event(s, "progress") for s in self.chains.values() if not s.completed]
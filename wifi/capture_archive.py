@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+"""
+Archivo comprimido del anillo de capturas con índice temporal por fichero.
+
+dumpcap rota ficheros en ``capture_dir`` y borra el más antiguo al llegar a
+``--capture-files``. El archivador comprime cada fichero en cuanto se cierra
+(varios a la vez en un pool de hilos: zlib libera el GIL), lo deja en
+``--archive-dir`` y borra los archivos más antiguos para no pasar de
+``--budget-gb``: la retención pasa a medirse en bytes comprimidos.
+
+Cada ``.gz`` es una serie de miembros gzip independientes: la cabecera del
+fichero y un miembro por segmento de ~``--segment-kb`` (``zcat`` lo sigue
+leyendo entero). El índice ``<fichero>.idx.json`` guarda primer/último
+timestamp, número de paquetes y, por segmento, su rango de tiempos, el
+primer frame y su offset en el original y en el ``.gz``. Con él,
+``supabase_tshark_ingest.py --mode file --from/--to`` descomprime sólo los
+segmentos que tocan el rango.
+
+Uso:
+  python3 capture_archive.py --capture-dir ~/ap-captures --archive-dir ~/ap-archive --budget-gb 50
+  python3 capture_archive.py --archive-dir ~/ap-archive --find 2026-10-18T14:05 2026-10-18T14:07
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import concurrent.futures
+import datetime as dt
+import gzip
+import json
+import mmap
+import os
+import signal
+import sys
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import pcap_reader
+import pcap_split
+from capture_ring import RING_RE, DirectoryWatcher, closed_ring_files
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".idx.json"
+ARCHIVE_SUFFIX = ".gz"
+# Orden de los campos de cada segmento en el índice (listas: el índice de un
+# fichero de 100 MB son ~100 segmentos)
+SEGMENT_FIELDS = ("min_ts", "max_ts", "first_frame", "frames", "offset", "length", "gz_offset", "gz_length")
+
+STOP = threading.Event()
+
+
+class Segment(NamedTuple):
+    min_ts: Optional[float]
+    max_ts: Optional[float]
+    first_frame: int  # frames del fichero anteriores al segmento
+    frames: int
+    offset: int  # en el fichero original
+    length: int
+    gz_offset: int  # en el .gz (0 si el índice es de un fichero sin comprimir)
+    gz_length: int
+
+
+def parse_time(value: str) -> float:
+    """Epoch o ISO 8601 (sin zona = hora local, como los nombres del anillo)."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return dt.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"fecha no válida: {value!r} (usa epoch o AAAA-MM-DDThh:mm[:ss])") from None
+
+
+def format_time(epoch: Optional[float]) -> str:
+    if epoch is None:
+        return "-"
+    return dt.datetime.fromtimestamp(epoch).isoformat(timespec="seconds")
+
+
+def index_path(path: Path) -> Path:
+    """``x.pcapng`` y ``x.pcapng.gz`` comparten ``x.pcapng.idx.json``."""
+    name = path.name[: -len(ARCHIVE_SUFFIX)] if path.name.endswith(ARCHIVE_SUFFIX) else path.name
+    return path.with_name(name + INDEX_SUFFIX)
+
+
+def load_index(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        with index_path(path).open("r", encoding="utf-8") as fh:
+            index = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    return index if index.get("version") == INDEX_VERSION else None
+
+
+def segments(index: Dict[str, Any]) -> List[Segment]:
+    return [Segment(*s) for s in index["segments"]]
+
+
+def _plan(buf: Any, segment_bytes: int) -> Tuple[Dict[str, Any], List[Tuple[int, int]]]:
+    """Índice de un pcap/pcapng en memoria y los rangos de bytes de cada miembro gzip."""
+    layout = pcap_split.packet_offsets(buf)
+    view = memoryview(buf)
+    epochs: List[Optional[float]] = []
+    try:
+        for frame in pcap_reader.iter_frames(view):
+            epochs.append(frame.epoch)
+            frame = None
+    finally:
+        view.release()
+
+    known = [e for e in epochs if e is not None]
+    index: Dict[str, Any] = {
+        "version": INDEX_VERSION,
+        "packets": len(epochs),
+        "first_ts": min(known) if known else None,
+        "last_ts": max(known) if known else None,
+        "seekable": layout is not None and len(layout[0]) - 1 == len(epochs),
+        "prefix": [],
+        "segment_fields": list(SEGMENT_FIELDS),
+        "segments": [],
+    }
+    if not index["seekable"]:
+        # p. ej. pcapng con varias secciones: un único segmento con todo
+        index["segments"].append(
+            list(Segment(index["first_ts"], index["last_ts"], 0, len(epochs), 0, len(buf), 0, 0))
+        )
+        return index, [(0, len(buf))]
+
+    offsets, prefix_blocks = layout
+    index["prefix"] = [[offset, base64.b64encode(block).decode("ascii")] for offset, block in prefix_blocks]
+    members = [(0, offsets[0])]  # cabecera: la concatenación de miembros reproduce el fichero
+    first = 0
+    last_epoch: Optional[float] = None
+    while first < len(epochs):
+        last = first
+        start = offsets[first]
+        while last < len(epochs) and offsets[last] - start < segment_bytes:
+            last += 1
+        times = []
+        for epoch in epochs[first:last]:
+            # SPB sin timestamp: hereda el del paquete anterior
+            last_epoch = epoch if epoch is not None else last_epoch
+            if last_epoch is not None:
+                times.append(last_epoch)
+        end = offsets[last]
+        index["segments"].append(
+            list(Segment(min(times) if times else None, max(times) if times else None, first, last - first, start, end - start, 0, 0))
+        )
+        members.append((start, end))
+        first = last
+    return index, members
+
+
+def build_index(path: Path, segment_bytes: int = 1 << 20) -> Dict[str, Any]:
+    """Índice de un fichero sin comprimir (segmentos apuntando al propio fichero)."""
+    with path.open("rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        index, _ = _plan(buf, segment_bytes)
+    index.update(source=path.name, archive=None, size=path.stat().st_size)
+    return index
+
+
+def write_json_atomic(path: Path, data: Dict[str, Any]) -> None:
+    tmp = path.with_name(path.name + ".part")
+    with tmp.open("w", encoding="utf-8") as fh:
+        json.dump(data, fh, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def archive_file(path: Path, archive_dir: Path, segment_bytes: int = 1 << 20, level: int = 6) -> Dict[str, Any]:
+    """Comprime ``path`` en ``archive_dir`` con su índice y borra el original."""
+    target = archive_dir / (path.name + ARCHIVE_SUFFIX)
+    part = target.with_name(target.name + ".part")
+    with path.open("rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        index, members = _plan(buf, segment_bytes)
+        gz_offset = 0
+        with part.open("wb") as out:
+            for i, (start, end) in enumerate(members):
+                blob = gzip.compress(buf[start:end], compresslevel=level, mtime=0)
+                out.write(blob)
+                if index["seekable"] and i == 0:
+                    index["header_gz_length"] = len(blob)
+                else:
+                    segment = index["segments"][i - 1 if index["seekable"] else 0]
+                    segment[6], segment[7] = gz_offset, len(blob)
+                gz_offset += len(blob)
+    index.update(source=path.name, archive=target.name, size=path.stat().st_size, gz_size=gz_offset)
+    os.replace(part, target)
+    write_json_atomic(index_path(target), index)
+    path.unlink()
+    return index
+
+
+def _range_bounds(index: Dict[str, Any], t_from: Optional[float], t_to: Optional[float]) -> Optional[Tuple[int, int]]:
+    """Primer y último segmento cuyo rango de tiempos toca [t_from, t_to]."""
+    hits = [
+        i for i, s in enumerate(segments(index))
+        if s.frames and (s.max_ts is None or t_from is None or s.max_ts >= t_from)
+        and (s.min_ts is None or t_to is None or s.min_ts <= t_to)
+    ]
+    return (hits[0], hits[-1]) if hits else None
+
+
+def _cut(data: bytes, t_from: Optional[float], t_to: Optional[float]) -> Tuple[List[int], List[Tuple[int, bytes]], int, int]:
+    """Offsets de paquetes, bloques de cabecera y tramo contiguo ``[first, end)`` de frames dentro de [t_from, t_to]."""
+    layout = pcap_split.packet_offsets(data)
+    if layout is None:
+        raise ValueError("segmento ilegible: el índice no corresponde al fichero")
+    offsets, prefix_blocks = layout
+    epochs = [frame.epoch for frame in pcap_reader.iter_frames(memoryview(data))]
+    first = next((i for i, e in enumerate(epochs) if e is None or t_from is None or e >= t_from), len(epochs))
+    last = next((i for i in range(len(epochs) - 1, -1, -1) if epochs[i] is None or t_to is None or epochs[i] <= t_to), -1)
+    return offsets, prefix_blocks, first, max(first, last + 1)
+
+
+class RangeStream:
+    """Frames de un pcap (o archivo .gz) entre ``t_from`` y ``t_to`` como un pcap en flujo.
+
+    Al iterar se obtienen los bytes de un pcap válido (cabecera y paquetes del
+    tramo) segmento a segmento: sólo se descomprime un segmento cada vez y
+    sólo se recortan el primero y el último. ``frame_offset`` es el número de
+    frames del original anteriores al tramo; ``frames`` y ``read_bytes`` se
+    completan al terminar de iterar.
+    """
+
+    def __init__(self, path: Path, index: Dict[str, Any], hits: List[Segment], t_from: Optional[float], t_to: Optional[float]) -> None:
+        self.path = path
+        self.index = index
+        self.t_from = t_from
+        self.t_to = t_to
+        self.frames = 0
+        self.read_bytes = 0
+        self._hits = hits
+        self._head = b""
+        self.frame_offset = 0
+
+    def _header(self, segment: Segment) -> bytes:
+        # Cabecera (SHB + IDBs) anterior al segmento, guardada en el índice
+        return b"".join(base64.b64decode(block) for offset, block in self.index["prefix"] if offset < segment.offset)
+
+    def _load(self, fh: Any, segment: Segment) -> bytes:
+        if self.index.get("archive") is None:
+            fh.seek(segment.offset)
+            data = fh.read(segment.length)
+            self.read_bytes += len(data)
+            return data
+        fh.seek(segment.gz_offset)
+        blob = fh.read(segment.gz_length)
+        self.read_bytes += len(blob)
+        try:
+            return gzip.decompress(blob)
+        except (OSError, EOFError, zlib.error) as exc:
+            raise ValueError(f"segmento corrupto en {self.path.name} (offset {segment.gz_offset}): {exc}") from None
+
+    def open(self) -> bool:
+        """Recorta el primer segmento con frames en el rango; False si no hay ninguno."""
+        if not self.index["seekable"]:
+            self.frame_offset = 0
+            return True
+        with self.path.open("rb") as fh:
+            while self._hits:
+                segment = self._hits.pop(0)
+                header = self._header(segment)
+                data = header + self._load(fh, segment)
+                offsets, prefix_blocks, first, end = _cut(data, self.t_from, self.t_to if not self._hits else None)
+                if first == end:
+                    continue
+                prefix = b"".join(block for offset, block in prefix_blocks if offset < offsets[first])
+                self._head = prefix + data[offsets[first]:offsets[end]]
+                self.frame_offset = segment.first_frame + first
+                self.frames = end - first
+                return True
+        return False
+
+    def __iter__(self) -> Iterator[bytes]:
+        if not self.index["seekable"]:
+            # No se puede cortar (p. ej. varias secciones): el fichero entero, sin recortar
+            yield from self._whole()
+            return
+        yield self._head
+        self._head = b""
+        with self.path.open("rb") as fh:
+            for i, segment in enumerate(self._hits):
+                data = self._load(fh, segment)
+                if i < len(self._hits) - 1 or self.t_to is None:
+                    self.frames += segment.frames
+                    yield data
+                    continue
+                header = self._header(segment)
+                offsets, _, _, end = _cut(header + data, None, self.t_to)
+                self.frames += end
+                yield data[: offsets[end] - len(header)]
+
+    def _whole(self) -> Iterator[bytes]:
+        opener = gzip.open if self.index.get("archive") else open
+        with opener(self.path, "rb") as fh:
+            while True:
+                block = fh.read(1 << 20)
+                if not block:
+                    break
+                yield block
+        self.read_bytes = self.path.stat().st_size
+        self.frames = self.index["packets"]
+
+
+def open_range(path: Path, t_from: Optional[float], t_to: Optional[float]) -> Optional[RangeStream]:
+    """Tramo de ``path`` entre ``t_from`` y ``t_to``; None si ningún frame cae en el rango.
+
+    ``path`` puede ser un ``.gz`` del archivo o un pcap sin comprimir; sin
+    índice en disco, el de un pcap se calcula al vuelo (un recorrido del
+    fichero, sin decodificar).
+    """
+    index = load_index(path)
+    if index is None:
+        if path.name.endswith(ARCHIVE_SUFFIX):
+            raise ValueError(f"{path.name} no tiene índice ({index_path(path).name})")
+        index = build_index(path)
+    bounds = _range_bounds(index, t_from, t_to)
+    if bounds is None:
+        return None
+    stream = RangeStream(path, index, segments(index)[bounds[0]:bounds[1] + 1], t_from, t_to)
+    return stream if stream.open() else None
+
+
+def find_archives(archive_dir: Path, t_from: Optional[float], t_to: Optional[float]) -> List[Tuple[Path, Dict[str, Any]]]:
+    """Archivos cuyo intervalo [first_ts, last_ts] toca el rango (sólo se leen los índices)."""
+    found = []
+    for idx in archive_dir.glob("*" + INDEX_SUFFIX):
+        try:
+            index = json.loads(idx.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        first_ts, last_ts = index.get("first_ts"), index.get("last_ts")
+        if first_ts is None or (t_to is not None and first_ts > t_to) or (t_from is not None and last_ts < t_from):
+            continue
+        found.append((archive_dir / (index.get("archive") or index["source"]), index))
+    return sorted(found, key=lambda item: item[1]["first_ts"])
+
+
+def archive_usage(archive_dir: Path) -> List[Tuple[tuple, int, Path]]:
+    """(orden, bytes, .gz) de cada archivo, del más antiguo al más reciente.
+
+    Se ordena por el nombre de rotación (como ``list_ring_files``) o, si no lo
+    tiene, por mtime: así no hace falta abrir miles de índices.
+    """
+    usage = []
+    for gz in archive_dir.glob("*" + ARCHIVE_SUFFIX):
+        try:
+            stat = gz.stat()
+            idx = index_path(gz)
+            size = stat.st_size + (idx.stat().st_size if idx.exists() else 0)
+        except FileNotFoundError:
+            continue
+        m = RING_RE.match(gz.name[: -len(ARCHIVE_SUFFIX)])
+        if m:
+            key = (m.group("stamp"), int(m.group("index")), gz.name)
+        else:
+            key = (time.strftime("%Y%m%d%H%M%S", time.localtime(stat.st_mtime)), 0, gz.name)
+        usage.append((key, size, gz))
+    return sorted(usage)
+
+
+def enforce_budget(archive_dir: Path, budget_bytes: int) -> List[Path]:
+    """Borra los archivos más antiguos hasta caber en ``budget_bytes`` (siempre queda el último)."""
+    usage = archive_usage(archive_dir)
+    total = sum(size for _, size, _ in usage)
+    removed = []
+    for _, size, gz in usage[:-1]:
+        if total <= budget_bytes:
+            break
+        gz.unlink(missing_ok=True)
+        index_path(gz).unlink(missing_ok=True)
+        total -= size
+        removed.append(gz)
+    return removed
+
+
+class ArchiveManager:
+    """Vigila ``capture_dir`` y archiva cada fichero cerrado en un pool de ``workers`` hilos."""
+
+    def __init__(
+        self,
+        capture_dir: Path,
+        archive_dir: Path,
+        budget_bytes: int,
+        workers: int = 2,
+        segment_bytes: int = 1 << 20,
+        level: int = 6,
+        min_age: float = 30.0,
+        idle_close: float = 120.0,
+    ) -> None:
+        self.capture_dir = capture_dir
+        self.archive_dir = archive_dir
+        self.budget_bytes = budget_bytes
+        self.workers = workers
+        self.segment_bytes = segment_bytes
+        self.level = level
+        self.min_age = min_age
+        self.idle_close = idle_close
+        self.inflight: Dict[Path, concurrent.futures.Future] = {}
+        self.failed: set = set()
+        self.archived = 0
+        self.raw_bytes = 0
+        self.gz_bytes = 0
+
+    def ready(self) -> List[Path]:
+        """Ficheros cerrados hace al menos ``min_age`` s (margen para que ``--mode tail`` acabe de leerlos)."""
+        now = time.time()
+        paths = []
+        for ring_file in closed_ring_files(self.capture_dir, self.idle_close):
+            try:
+                stat = ring_file.path.stat()
+            except FileNotFoundError:
+                continue  # dumpcap lo acaba de borrar
+            if now - stat.st_mtime < self.min_age or not stat.st_size:
+                continue
+            if ring_file.path not in self.inflight and ring_file.path not in self.failed:
+                paths.append(ring_file.path)
+        return paths
+
+    def collect(self, wait: bool = False) -> None:
+        done = [p for p, f in self.inflight.items() if wait or f.done()]
+        for path in done:
+            future = self.inflight.pop(path)
+            try:
+                index = future.result()
+            except FileNotFoundError:
+                continue  # el anillo lo borró antes de terminar
+            except (OSError, ValueError) as exc:
+                # Se deja en el anillo sin reintentar (dumpcap lo acabará rotando)
+                print(f"[WARN] No se pudo archivar {path.name}: {exc}")
+                self.failed.add(path)
+                continue
+            self.archived += 1
+            self.raw_bytes += index["size"]
+            self.gz_bytes += index["gz_size"]
+            ratio = index["gz_size"] / index["size"] if index["size"] else 0.0
+            print(
+                f"[OK] {index['archive']}: {index['packets']} paquetes "
+                f"{format_time(index['first_ts'])} -> {format_time(index['last_ts'])} "
+                f"({len(index['segments'])} segmentos, {ratio:.0%} del original)"
+            )
+        if done:
+            for gz in enforce_budget(self.archive_dir, self.budget_bytes):
+                print(f"[INFO] Retención: borrado {gz.name}")
+
+    def run(self, once: bool = False) -> None:
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        for part in self.archive_dir.glob("*.part"):
+            part.unlink()  # restos de una parada a medio escribir
+        watcher = DirectoryWatcher(self.capture_dir)
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="archive")
+        try:
+            while not STOP.is_set():
+                for path in self.ready():
+                    self.inflight[path] = pool.submit(archive_file, path, self.archive_dir, self.segment_bytes, self.level)
+                self.collect()
+                if once and not self.inflight:
+                    break
+                # inotify no avisa de que un fichero cumpla min_age: como mucho 5 s de espera
+                watcher.wait(1.0 if self.inflight else 5.0)
+        finally:
+            watcher.close()
+            self.collect(wait=True)
+            pool.shutdown(wait=True)
+        if self.raw_bytes:
+            print(
+                f"[INFO] {self.archived} ficheros archivados: {self.raw_bytes / 1e6:.1f} MB -> "
+                f"{self.gz_bytes / 1e6:.1f} MB"
+            )
+
+
+def print_matches(archive_dir: Path, t_from: Optional[float], t_to: Optional[float]) -> None:
+    matches = find_archives(archive_dir, t_from, t_to)
+    if not matches:
+        print("[INFO] Ningún archivo cubre ese rango")
+        return
+    for path, index in matches:
+        print(
+            f"{path}  {format_time(index['first_ts'])} -> {format_time(index['last_ts'])}  "
+            f"{index['packets']} paquetes"
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Comprime el anillo de capturas con índice temporal y retención por tamaño")
+    p.add_argument("--capture-dir", help="Directorio del anillo (el --capture-dir de setting-ap.py)")
+    p.add_argument("--archive-dir", required=True, help="Destino de los .gz y sus índices")
+    p.add_argument("--budget-gb", type=float, default=20.0, help="Espacio máximo del archivo (se borran los más antiguos)")
+    p.add_argument("--workers", type=int, default=2, help="Ficheros comprimiéndose a la vez")
+    p.add_argument("--segment-kb", type=int, default=1024, help="Tamaño (sin comprimir) de cada segmento indexado")
+    p.add_argument("--level", type=int, default=6, help="Nivel de compresión gzip (1-9)")
+    p.add_argument("--min-age", type=float, default=30.0, help="Segundos desde el cierre antes de archivar un fichero")
+    p.add_argument("--idle-close", type=float, default=120.0, help="Segundos sin cambios para dar por cerrado el último fichero del anillo")
+    p.add_argument("--once", action="store_true", help="Archiva los ficheros ya cerrados y sale")
+    p.add_argument("--find", nargs=2, metavar=("DESDE", "HASTA"), help="Lista los archivos que cubren el rango y sale")
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    archive_dir = Path(args.archive_dir).expanduser().resolve()
+    if args.find:
+        if not archive_dir.is_dir():
+            print(f"[ERROR] {archive_dir} no existe")
+            sys.exit(1)
+        try:
+            t_from, t_to = (parse_time(v) for v in args.find)
+        except ValueError as exc:
+            print(f"[ERROR] --find: {exc}")
+            sys.exit(1)
+        print_matches(archive_dir, t_from, t_to)
+        return
+
+    capture_dir = Path(args.capture_dir).expanduser().resolve() if args.capture_dir else None
+    if capture_dir is None or not capture_dir.is_dir():
+        print("[ERROR] --capture-dir no existe o no fue indicado")
+        sys.exit(1)
+    if capture_dir == archive_dir:
+        print("[ERROR] --archive-dir debe ser distinto de --capture-dir")
+        sys.exit(1)
+    if args.workers < 1 or args.segment_kb < 1 or args.budget_gb <= 0 or not 1 <= args.level <= 9:
+        print("[ERROR] --workers y --segment-kb deben ser >= 1, --budget-gb > 0 y --level entre 1 y 9")
+        sys.exit(1)
+
+    signal.signal(signal.SIGINT, lambda *_: STOP.set())
+    signal.signal(signal.SIGTERM, lambda *_: STOP.set())
+    manager = ArchiveManager(
+        capture_dir,
+        archive_dir,
+        budget_bytes=int(args.budget_gb * 1e9),
+        workers=args.workers,
+        segment_bytes=args.segment_kb * 1024,
+        level=args.level,
+        min_age=args.min_age,
+        idle_close=args.idle_close,
+    )
+    print(f"[INFO] Archivando {capture_dir} -> {archive_dir} (máx. {args.budget_gb:g} GB, {args.workers} hilos)")
+    manager.run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Utilidades para el anillo de PCAPs rotativos que genera setting-ap.py.
+
+tshark/dumpcap con ``-b`` nombran cada fichero como
+``<prefijo>_<índice 5 dígitos>_<AAAAMMDDhhmmss>.pcapng``. Aquí se listan en
+orden de rotación, se decide cuáles están cerrados y se vigila el directorio
+(inotify con fallback a polling) para detectar nuevas rotaciones.
+``RingTail`` sigue el fichero que la captura está escribiendo (modo tail).
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import re
+import select
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from pcap_reader import PacketHeader, PcapStream
+
+RING_RE = re.compile(r"^(?P<base>.+)_(?P<index>\d{5})_(?P<stamp>\d{14})\.(?P<ext>pcapng|pcap)$")
+CAPTURE_SUFFIXES = (".pcap", ".pcapng")
+
+
+@dataclass(frozen=True)
+class RingFile:
+    path: Path
+    base: str
+    index: int
+    stamp: str
+
+    @property
+    def sort_key(self) -> tuple:
+        return (self.stamp, self.index, self.path.name)
+
+
+def parse_ring_file(path: Path) -> RingFile:
+    m = RING_RE.match(path.name)
+    if m:
+        return RingFile(path, m.group("base"), int(m.group("index")), m.group("stamp"))
+    # Fichero suelto (sin sufijo de rotación): se ordena por mtime
+    stamp = time.strftime("%Y%m%d%H%M%S", time.localtime(path.stat().st_mtime))
+    return RingFile(path, path.stem, 0, stamp)
+
+
+def list_ring_files(directory: Path) -> List[RingFile]:
+    files = []
+    for p in directory.iterdir():
+        if p.is_file() and p.suffix in CAPTURE_SUFFIXES:
+            try:
+                files.append(parse_ring_file(p))
+            except FileNotFoundError:
+                continue  # el anillo lo acaba de borrar
+    return sorted(files, key=lambda f: f.sort_key)
+
+
+def closed_ring_files(directory: Path, idle_close_sec: float) -> List[RingFile]:
+    """Ficheros que ya no se están escribiendo.
+
+    En cada anillo (mismo prefijo) todos menos el más reciente están cerrados.
+    El más reciente sólo se da por cerrado si lleva ``idle_close_sec`` sin
+    modificarse (la captura se detuvo).
+    """
+    files = list_ring_files(directory)
+    newest: Dict[str, RingFile] = {}
+    for f in files:
+        newest[f.base] = f
+
+    now = time.time()
+    closed = []
+    for f in files:
+        if newest[f.base] is f:
+            try:
+                if now - f.path.stat().st_mtime < idle_close_sec:
+                    continue
+            except FileNotFoundError:
+                continue
+        closed.append(f)
+    return closed
+
+
+class _Inotify:
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+
+    def __init__(self, directory: Path) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(str(directory)), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, "inotify_add_watch")
+        self.fd = fd
+
+    def wait(self, timeout: float) -> bool:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class DirectoryWatcher:
+    """Espera cambios en un directorio: inotify si está disponible, si no polling."""
+
+    def __init__(self, directory: Path, poll_interval: float = 2.0) -> None:
+        self.poll_interval = poll_interval
+        self._inotify: Optional[_Inotify] = None
+        try:
+            self._inotify = _Inotify(directory)
+            print(f"[INFO] Vigilando {directory} con inotify")
+        except (OSError, AttributeError):
+            print(f"[INFO] inotify no disponible, polling cada {poll_interval}s en {directory}")
+
+    def wait(self, timeout: float) -> bool:
+        """Bloquea hasta un cambio o ``timeout``; True si puede haber ficheros nuevos."""
+        if self._inotify is not None:
+            return self._inotify.wait(timeout)
+        time.sleep(min(timeout, self.poll_interval))
+        return True
+
+    def close(self) -> None:
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+class RingTail:
+    """Sigue el anillo como ``tail -F``: lee los bloques que se añaden al fichero
+    en curso y pasa al siguiente cuando dumpcap rota.
+
+    Un fichero se abandona sólo cuando ya existe uno posterior del mismo anillo
+    y se ha leído hasta el final; si entonces queda un bloque a medias (captura
+    cortada) se descarta con aviso. Se empieza por ``start`` (o el fichero más
+    reciente) saltando ``start_after`` frames ya confirmados; con ``from_end``
+    sólo se emite lo que llegue nuevo.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        start: Optional[Path] = None,
+        start_after: int = 0,
+        from_end: bool = False,
+        poll_interval: float = 0.2,
+        chunk_bytes: int = 1 << 20,
+    ) -> None:
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.chunk_bytes = chunk_bytes
+        self.current: Optional[RingFile] = None
+        self._start = start
+        self._start_after = start_after
+        self._from_end = from_end
+        self._fh = None
+        self._stream: Optional[PcapStream] = None
+        self._offset = 0
+
+    def _newest(self) -> Optional[RingFile]:
+        files = list_ring_files(self.directory)
+        return files[-1] if files else None
+
+    def _next_file(self) -> Optional[RingFile]:
+        assert self.current is not None
+        later = [
+            f for f in list_ring_files(self.directory)
+            if f.base == self.current.base and f.sort_key > self.current.sort_key
+        ]
+        return later[0] if later else None
+
+    def _open(self, ring_file: RingFile, start_after: int = 0) -> None:
+        self.close()
+        self._fh = ring_file.path.open("rb")
+        self._stream = PcapStream(start_after=start_after)
+        self._offset = 0
+        self.current = ring_file
+        print(f"[INFO] Siguiendo {ring_file.path.name}")
+
+    def _read_chunk(self) -> Tuple[int, List[PacketHeader]]:
+        assert self._fh is not None and self._stream is not None
+        data = self._fh.read(self.chunk_bytes)
+        if not data:
+            return 0, []
+        self._offset += len(data)
+        return len(data), self._stream.feed(data)
+
+    def read(self, timeout: float) -> Tuple[Optional[Path], List[PacketHeader]]:
+        """(fichero, cabeceras nuevas); espera hasta ``timeout`` si no hay datos."""
+        deadline = time.monotonic() + timeout
+        while True:
+            if self._fh is None:
+                first = self._newest()
+                if self._start is not None and self._start.exists():
+                    first = parse_ring_file(self._start)
+                if first is not None:
+                    self._open(first, self._start_after)
+                    if self._from_end:
+                        # Se decodifica lo ya escrito sólo para saber dónde empieza lo nuevo
+                        while self._read_chunk()[0]:
+                            pass
+                        self._from_end = False
+            if self._fh is not None and self.current is not None:
+                path = self.current.path
+                size, headers = self._read_chunk()
+                if headers:
+                    return path, headers
+                if size:
+                    continue  # bloques sin paquetes IP (IDB, estadísticas...)
+                if os.fstat(self._fh.fileno()).st_size < self._offset:
+                    print(f"[WARN] {path.name} se truncó; se vuelve a leer desde el principio")
+                    self._open(self.current)
+                    continue
+                nxt = self._next_file()
+                if nxt is not None:
+                    # Ya existe el siguiente: lo que dumpcap escribiera antes de rotar
+                    # está en disco; si aún aparecen datos se siguen leyendo
+                    size, headers = self._read_chunk()
+                    if headers:
+                        return path, headers
+                    if size:
+                        continue
+                    assert self._stream is not None
+                    if self._stream.pending:
+                        print(f"[WARN] {path.name}: bloque incompleto al rotar ({self._stream.pending} bytes descartados)")
+                    self._open(nxt)
+                    continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return (self.current.path if self.current else None), []
+            time.sleep(min(self.poll_interval, remaining))
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
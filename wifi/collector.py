@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Collector central para despliegues con varios sensores (``--sink collector``).
+
+Cada sensor mantiene una conexión TCP persistente y envía lotes binarios
+(collector_proto.py). El collector añade ``metadata.sensor_id``, junta los
+lotes de todos los sensores en escrituras grandes a Supabase y confirma
+cada lote (ACK) sólo cuando sus filas están en la BD. Un lote ilegible o que
+Supabase rechaza (4xx salvo 408/429) recibe ``ERROR`` en vez de ACK y se
+descarta, sin frenar los lotes de los demás sensores.
+
+La cola hacia el escritor está acotada: si Supabase va lento, los hilos de
+conexión dejan de leer del socket y TCP frena a los sensores, que a su vez
+se paran al llenar su ventana de lotes sin confirmar.
+
+Uso:
+  SUPABASE_URL=... SUPABASE_API_KEY=... COLLECTOR_TOKEN=... \\
+    python3 collector.py --listen 0.0.0.0:7400
+"""
+
+from __future__ import annotations
+
+import argparse
+import hmac
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import collector_proto as proto
+import supabase_tshark_ingest as ingest
+from pg_partitions import add_partition_args, validate_partition_args
+
+
+class SensorHandler(socketserver.BaseRequestHandler):
+    """Una conexión de sensor: saludo, lotes a la cola y ACKs desde el escritor."""
+
+    server: "CollectorServer"
+
+    def setup(self) -> None:
+        self.sensor_id = ""
+        self._send_lock = threading.Lock()
+        self.alive = True
+
+    def send(self, kind: int, seq: int, body: bytes = b"") -> None:
+        with self._send_lock:
+            if not self.alive:
+                return
+            try:
+                self.request.sendall(proto.pack_frame(kind, seq, body))
+            except OSError:
+                self.alive = False  # el sensor reenviará lo no confirmado al reconectar
+
+    def handle(self) -> None:
+        sock: socket.socket = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        peer = f"{self.client_address[0]}:{self.client_address[1]}"
+        try:
+            kind, _, body = proto.read_frame(sock)
+            hello = json.loads(body) if kind == proto.HELLO else {}
+            if hello.get("version") != proto.PROTOCOL_VERSION:
+                self.send(proto.ERROR, 0, b"version de protocolo no soportada")
+                return
+            if not hmac.compare_digest(str(hello.get("token", "")).encode(), self.server.token.encode()):
+                print(f"[WARN] Token incorrecto desde {peer}")
+                self.send(proto.ERROR, 0, b"token incorrecto")
+                return
+            self.sensor_id = str(hello.get("sensor_id") or peer)
+            codec = next((c for c in proto.available_codecs() if c in hello.get("codecs", [])), None)
+            if codec is None:
+                self.send(proto.ERROR, 0, b"sin compresion comun")
+                return
+            self.send(proto.WELCOME, 0, json.dumps({"codec": codec}).encode("utf-8"))
+            print(f"[INFO] Sensor {self.sensor_id} conectado desde {peer} ({codec})")
+
+            # Sigue leyendo al parar: los lotes nuevos se ignoran, pero los ya
+            # encolados aún reciben su ACK por esta conexión
+            while True:
+                kind, seq, body = proto.read_frame(sock)
+                if kind != proto.BATCH:
+                    continue
+                self.server.bytes_received += proto.FRAME.size + len(body)
+                try:
+                    rows = proto.decode_block(proto.decompress(codec, body), self.server.formatter)
+                except proto.CODEC_ERRORS + (struct.error, IndexError, ValueError) as exc:
+                    print(f"[ERROR] Lote {seq} ilegible de {self.sensor_id}, descartado: {exc}")
+                    self.send(proto.ERROR, seq, f"lote ilegible: {exc}".encode("utf-8"))
+                    continue
+                for row in rows:
+                    row["metadata"]["sensor_id"] = self.sensor_id
+                self.server.enqueue((self, seq, rows))
+        except (ConnectionError, OSError):
+            pass
+        except (proto.ProtocolError, ValueError) as exc:
+            print(f"[WARN] Trama inválida de {self.sensor_id or peer}: {exc}")
+            self.send(proto.ERROR, 0, str(exc).encode("utf-8"))
+        finally:
+            with self._send_lock:
+                self.alive = False
+            if self.sensor_id:
+                print(f"[INFO] Sensor {self.sensor_id} desconectado")
+
+
+class CollectorServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: Tuple[str, int], token: str, max_queue: int) -> None:
+        super().__init__(address, SensorHandler)
+        self.token = token
+        self.formatter = ingest.columnar.IsoFormatter()
+        self.queue: "queue.Queue[Tuple[SensorHandler, int, List[Dict[str, Any]]]]" = queue.Queue(maxsize=max_queue)
+        self.bytes_received = 0
+
+    def enqueue(self, item: Tuple[SensorHandler, int, List[Dict[str, Any]]]) -> None:
+        while not ingest.STOP:
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+
+def row_shape(row: Dict[str, Any]) -> Tuple[str, ...]:
+    # PostgREST exige las mismas claves en todas las filas de un POST
+    return tuple(sorted(row))
+
+
+class BulkWriter:
+    """Junta lotes de todos los sensores y los escribe en bloques de ``bulk_rows``."""
+
+    def __init__(self, cfg: ingest.IngestConfig, server: CollectorServer, bulk_rows: int, linger: float) -> None:
+        self.cfg = cfg
+        self.server = server
+        self.bulk_rows = bulk_rows
+        self.linger = linger
+        self.written = 0
+        self.session = ingest.requests.Session()
+        # Con --partition-by el collector es quien crea las particiones de todos los sensores
+        self.partitions = ingest.build_partitions(cfg) if cfg.partition_by and not cfg.dry_run else None
+
+    def gather(self) -> List[Tuple[SensorHandler, int, List[Dict[str, Any]]]]:
+        items = []
+        rows = 0
+        deadline: Optional[float] = None
+        while rows < self.bulk_rows:
+            timeout = 0.5 if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.server.queue.get(timeout=timeout)
+            except queue.Empty:
+                if deadline is not None or ingest.STOP:
+                    break
+                continue
+            items.append(item)
+            rows += len(item[2])
+            if deadline is None:
+                deadline = time.monotonic() + self.linger
+        return items
+
+    def write(self, items: List[Tuple[SensorHandler, int, List[Dict[str, Any]]]]) -> Dict[int, BaseException]:
+        """Escribe los lotes de ``items``; devuelve los rechazados (posición -> error)."""
+        if self.partitions is not None:
+            try:
+                span = ingest.batch_epoch_range([row for _, _, batch in items for row in batch])
+                if span is not None:
+                    self.partitions.ensure(*span)
+                if self.partitions.maintain_due():
+                    self.partitions.maintain()
+            except self.partitions.errors as exc:
+                # Sin su partición, las filas van a la DEFAULT; se reintenta en el próximo bloque
+                print(f"[WARN] Particionado: {ingest.describe_error(exc)}")
+                self.partitions.close()
+        groups: Dict[Tuple[str, ...], List[Tuple[int, Dict[str, Any]]]] = {}
+        for pos, (_, _, batch) in enumerate(items):
+            for row in batch:
+                groups.setdefault(row_shape(row), []).append((pos, row))
+        rejected: Dict[int, BaseException] = {}
+        for group in groups.values():
+            for start in range(0, len(group), self.bulk_rows):
+                chunk = [(pos, row) for pos, row in group[start:start + self.bulk_rows] if pos not in rejected]
+                if not chunk:
+                    continue
+                exc = self.post([row for _, row in chunk])
+                if exc is None:
+                    continue
+                owners = sorted({pos for pos, _ in chunk})
+                if len(owners) == 1:
+                    rejected[owners[0]] = exc
+                    continue
+                # Bloque con lotes de varios sensores: se reenvía lote a lote para aislar el culpable
+                for owner in owners:
+                    exc = self.post([row for pos, row in chunk if pos == owner])
+                    if exc is not None:
+                        rejected[owner] = exc
+        return rejected
+
+    def post(self, rows: List[Dict[str, Any]]) -> Optional[BaseException]:
+        """Reintenta los fallos transitorios; devuelve el error si Supabase rechaza las filas."""
+        attempt = 0
+        while True:
+            try:
+                ingest.post_packets(self.cfg, rows, session=self.session)
+                return None
+            except Exception as exc:
+                if ingest.is_permanent_error(exc):
+                    return exc
+                if ingest.STOP:
+                    raise
+                delay = min(30.0, 0.5 * 2 ** attempt)
+                attempt += 1
+                print(f"[WARN] Escritura fallida ({exc}); reintento en {delay:.1f}s")
+                time.sleep(delay)
+
+    def run(self) -> None:
+        while True:
+            items = self.gather()
+            if not items:
+                if ingest.STOP:
+                    return
+                continue
+            try:
+                rejected = self.write(items)
+            except Exception as exc:
+                # Parada durante un reintento: sin ACK, los sensores reenviarán
+                print(f"[WARN] Lotes sin escribir al parar: {len(items)} ({exc})")
+                return
+            rows = 0
+            for pos, (handler, seq, batch) in enumerate(items):
+                exc = rejected.get(pos)
+                if exc is None:
+                    handler.send(proto.ACK, seq)
+                    rows += len(batch)
+                    continue
+                print(f"[ERROR] Lote {seq} de {handler.sensor_id} ({len(batch)} filas) rechazado por Supabase: {exc}")
+                handler.send(proto.ERROR, seq, f"rechazado por Supabase: {exc}".encode("utf-8"))
+            self.written += rows
+            sensors = len({handler.sensor_id for pos, (handler, _, _) in enumerate(items) if pos not in rejected})
+            print(f"[OK] {rows} filas de {sensors} sensores escritas en {self.cfg.table} (total {self.written})")
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Collector central: recibe lotes binarios de los sensores y los escribe en Supabase")
+    p.add_argument("--listen", default="0.0.0.0:7400", help="host:puerto de escucha")
+    p.add_argument("--table", default="network_packets")
+    p.add_argument("--bulk-rows", type=int, default=5000, help="Filas por escritura en Supabase")
+    p.add_argument("--linger-ms", type=int, default=500, help="Espera máxima para completar una escritura")
+    p.add_argument("--max-queue", type=int, default=256, help="Lotes recibidos pendientes de escribir antes de frenar a los sensores")
+    p.add_argument("--pg-dsn", default=os.getenv("PG_DSN"), help="DSN de Postgres para --partition-by (o variable PG_DSN)")
+    add_partition_args(p)
+    p.add_argument("--dry-run", action="store_true")
+    return p.parse_args()
+
+
+def main() -> None:
+    ingest.load_dotenv_if_exists()
+    args = parse_args()
+    supabase_url = os.getenv("SUPABASE_URL") or ""
+    supabase_key = os.getenv("SUPABASE_API_KEY") or ""
+    if not args.dry_run and (not supabase_url or not supabase_key):
+        print("[ERROR] Define SUPABASE_URL y SUPABASE_API_KEY en el entorno")
+        sys.exit(1)
+    host, _, port = args.listen.rpartition(":")
+    if not port.isdigit():
+        print("[ERROR] --listen debe ser host:puerto")
+        sys.exit(1)
+    if args.bulk_rows < 1 or args.max_queue < 1:
+        print("[ERROR] --bulk-rows y --max-queue deben ser >= 1")
+        sys.exit(1)
+    validate_partition_args(args)
+    token = os.getenv("COLLECTOR_TOKEN") or ""
+    if not token:
+        print("[WARN] COLLECTOR_TOKEN vacío: cualquier equipo que alcance el puerto puede enviar lotes")
+
+    cfg = ingest.IngestConfig(
+        supabase_url=supabase_url,
+        supabase_api_key=supabase_key,
+        table=args.table,
+        batch_size=args.bulk_rows,
+        mode="collector",
+        iface=None,
+        pcap=None,
+        limit=None,
+        dry_run=args.dry_run,
+        pg_dsn=args.pg_dsn,
+        partition_by=args.partition_by,
+        partition_premake=args.partition_premake,
+        partition_retention_days=args.partition_retention_days,
+        partition_retention_action=args.partition_retention_action,
+    )
+    server = CollectorServer((host.strip("[]") or "0.0.0.0", int(port)), token, args.max_queue)
+    writer = BulkWriter(cfg, server, args.bulk_rows, args.linger_ms / 1000.0)
+    threading.Thread(target=server.serve_forever, name="collector-accept", daemon=True).start()
+    print(f"[INFO] Collector escuchando en {args.listen} -> {args.table}")
+    try:
+        writer.run()
+    finally:
+        server.shutdown()
+        server.server_close()
+        if writer.partitions is not None:
+            writer.partitions.close()
+        print(f"[INFO] Recibidos {server.bytes_received} bytes; {writer.written} filas escritas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+"""
+Protocolo binario sensor -> collector (``--sink collector``) y cliente del sensor.
+
+Cada trama: ``!IBQ`` (longitud de lo que sigue, tipo, secuencia) + cuerpo.
+
+- ``HELLO`` (sensor): JSON ``{"version", "sensor_id", "token", "codecs"}``
+- ``WELCOME`` (collector): JSON ``{"codec"}`` elegido (zstd si ambos lo tienen)
+- ``BATCH`` (sensor): bloque de filas comprimido; ``seq`` creciente
+- ``ACK`` (collector): ``seq`` del lote ya escrito en Supabase
+- ``ERROR`` (collector): texto; con ``seq`` 0 rechaza la conexión y la
+  cierra, con el ``seq`` de un lote indica que ese lote no se escribirá
+  (ilegible o rechazado por Supabase) y el sensor se detiene con el error
+
+Un bloque lleva una tabla de cadenas (IPs, protocolos, source) y una
+estructura fija por fila (``ROW``); el payload va detrás de su fila (en
+binario si es hexadecimal) y los campos que no son los de ``to_record``
+(``id``, detección, ``--enrich``) en un JSON final sólo si existen.
+Comprimido, ocupa una fracción del JSON de PostgREST.
+
+El cliente mantiene una ventana de ``window`` lotes sin confirmar: ``send``
+se bloquea cuando está llena (control de flujo) y un hilo lector llama al
+callback de cada lote al recibir su ACK. Si la conexión cae, reconecta y
+reenvía lo no confirmado (entrega al menos una vez: con ``--dedup`` los
+repetidos se descartan por ``id``).
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import json
+import re
+import socket
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import columnar
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PROTOCOL_VERSION = 1
+FRAME = struct.Struct("!IBQ")
+ROW = struct.Struct("!dHHHHHBHIqhbI")
+COUNT = struct.Struct("!I")
+STRLEN = struct.Struct("!H")
+NO_PAYLOAD = 0xFFFFFFFF
+MAX_FRAME = 64 * 1024 * 1024
+# Bits de ``mask`` en ROW: puertos presentes y payload en hex guardado como bytes
+SRC_PORT, DST_PORT, HEX_PAYLOAD = 1, 2, 4
+_HEX = re.compile(r"(?:[0-9a-f]{2})+")
+
+HELLO, WELCOME, BATCH, ACK, ERROR = 1, 2, 3, 4, 5
+
+ROW_KEYS = ("timestamp", "src_ip", "dst_ip", "src_port", "dst_port", "protocol", "payload", "payload_size", "metadata")
+META_KEYS = ("source", "frame_number", "tcp_flags", "dns_rcode")
+
+
+class ProtocolError(RuntimeError):
+    pass
+
+
+# Cuerpo comprimido corrupto
+CODEC_ERRORS: Tuple[type, ...] = (zlib.error,) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def available_codecs() -> List[str]:
+    return (["zstd"] if zstandard is not None else []) + ["zlib"]
+
+
+def compress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def pack_frame(kind: int, seq: int, body: bytes = b"") -> bytes:
+    return FRAME.pack(FRAME.size - 4 + len(body), kind, seq) + body
+
+
+def read_frame(sock: socket.socket) -> Tuple[int, int, bytes]:
+    header = _read_exact(sock, FRAME.size)
+    length, kind, seq = FRAME.unpack(header)
+    if length < FRAME.size - 4 or length > MAX_FRAME:
+        raise ProtocolError(f"trama de {length} bytes")
+    return kind, seq, _read_exact(sock, length - (FRAME.size - 4))
+
+
+def _read_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("conexión cerrada")
+        buf += chunk
+    return bytes(buf)
+
+
+def _row_tuples(rows: Any) -> Tuple[List[Tuple[Any, ...]], Optional[List[Any]]]:
+    """(campos de ROW sin índices, extras por fila) de un ColumnBatch o lista de filas."""
+    if isinstance(rows, columnar.ColumnBatch):
+        core = [
+            (epoch, rows.source, src, dst, sport if mask & 1 else None, dport if mask & 2 else None,
+             proto, size, frame, flags, rcode, payload)
+            for epoch, src, dst, sport, dport, mask, proto, size, frame, flags, rcode, payload in zip(
+                rows.epoch, rows.src_ip, rows.dst_ip, rows.src_port, rows.dst_port, rows.port_mask,
+                rows.protocol, rows.size, rows.frame_number, rows.tcp_flags, rows.dns_rcode, rows.payload,
+            )
+        ]
+        optional = (rows.ids, rows.score, rows.meta_extra)
+        if all(column is None for column in optional):
+            return core, None
+        extras = []
+        for i in range(len(rows)):
+            top: Dict[str, Any] = {}
+            meta: Dict[str, Any] = dict(rows.meta_extra[i]) if rows.meta_extra is not None else {}
+            if rows.ids is not None:
+                top["id"] = rows.ids[i]
+            if rows.score is not None:
+                meta["anomaly_score"] = rows.score[i]
+                top["is_malicious"] = rows.technique[i] is not None  # type: ignore[index]
+                top["mitre_technique_id"] = rows.technique[i]  # type: ignore[index]
+                top["mitre_tactic"] = rows.tactic[i]  # type: ignore[index]
+            extras.append([top, meta])
+        return core, extras
+
+    core = []
+    extras = []
+    any_extra = False
+    for row in rows:
+        meta = row["metadata"]
+        core.append((
+            columnar_epoch(row["timestamp"]), meta.get("source", ""), row["src_ip"], row["dst_ip"],
+            row["src_port"], row["dst_port"], row["protocol"], row["payload_size"],
+            meta.get("frame_number"), meta.get("tcp_flags"), meta.get("dns_rcode"), row["payload"],
+        ))
+        top = {k: v for k, v in row.items() if k not in ROW_KEYS}
+        extra_meta = {k: v for k, v in meta.items() if k not in META_KEYS}
+        any_extra = any_extra or bool(top or extra_meta)
+        extras.append([top, extra_meta])
+    return core, extras if any_extra else None
+
+
+def columnar_epoch(timestamp: str) -> float:
+    return dt.datetime.fromisoformat(timestamp).timestamp()
+
+
+def encode_block(rows: Any) -> bytes:
+    """Filas (ColumnBatch o dicts de ``to_record``) -> bloque sin comprimir."""
+    core, extras = _row_tuples(rows)
+    strings: Dict[str, int] = {}
+
+    def idx(value: str) -> int:
+        i = strings.get(value)
+        if i is None:
+            i = strings[value] = len(strings)
+        return i
+
+    out: List[bytes] = []
+    pack = ROW.pack
+    for epoch, source, src, dst, sport, dport, proto, size, frame, flags, rcode, payload in core:
+        mask = (SRC_PORT if sport is not None else 0) | (DST_PORT if dport is not None else 0)
+        if payload is None:
+            data = b""
+        elif _HEX.fullmatch(payload):
+            data = bytes.fromhex(payload)
+            mask |= HEX_PAYLOAD
+        else:
+            data = payload.encode("utf-8")
+        out.append(pack(
+            epoch, idx(source), idx(src), idx(dst), sport or 0, dport or 0, mask, idx(proto), size,
+            frame if frame is not None else columnar.NO_FRAME,
+            flags if flags is not None else columnar.NO_FLAGS,
+            rcode if rcode is not None else columnar.NO_RCODE,
+            len(data) if payload is not None else NO_PAYLOAD,
+        ))
+        out.append(data)
+    if len(strings) > 0xFFFF:
+        raise ValueError("demasiadas cadenas distintas en un lote")
+
+    table = [COUNT.pack(len(strings)), COUNT.pack(len(core))]
+    for value in strings:
+        raw = value.encode("utf-8")
+        table.append(STRLEN.pack(len(raw)) + raw)
+    extra = json.dumps(extras).encode("utf-8") if extras is not None else b""
+    return b"".join(table) + b"".join(out) + COUNT.pack(len(extra)) + extra
+
+
+def decode_block(data: bytes, formatter: Optional[columnar.IsoFormatter] = None) -> List[Dict[str, Any]]:
+    """Bloque -> filas con la forma de ``to_record`` (+ extras)."""
+    fmt = (formatter or columnar.IsoFormatter()).format
+    view = memoryview(data)
+    (n_strings,) = COUNT.unpack_from(view, 0)
+    (n_rows,) = COUNT.unpack_from(view, 4)
+    pos = 8
+    strings = []
+    for _ in range(n_strings):
+        (length,) = STRLEN.unpack_from(view, pos)
+        pos += STRLEN.size
+        strings.append(bytes(view[pos:pos + length]).decode("utf-8"))
+        pos += length
+
+    rows: List[Dict[str, Any]] = []
+    unpack = ROW.unpack_from
+    for _ in range(n_rows):
+        epoch, source, src, dst, sport, dport, mask, proto, size, frame, flags, rcode, plen = unpack(view, pos)
+        pos += ROW.size
+        payload = None
+        if plen != NO_PAYLOAD:
+            raw = view[pos:pos + plen]
+            payload = raw.hex() if mask & HEX_PAYLOAD else bytes(raw).decode("utf-8")
+            pos += plen
+        rows.append({
+            "timestamp": fmt(epoch),
+            "src_ip": strings[src],
+            "dst_ip": strings[dst],
+            "src_port": sport if mask & SRC_PORT else None,
+            "dst_port": dport if mask & DST_PORT else None,
+            "protocol": strings[proto],
+            "payload": payload,
+            "payload_size": size,
+            "metadata": {
+                "source": strings[source],
+                "frame_number": frame if frame != columnar.NO_FRAME else None,
+                "tcp_flags": flags if flags != columnar.NO_FLAGS else None,
+                "dns_rcode": rcode if rcode != columnar.NO_RCODE else None,
+            },
+        })
+    (extra_len,) = COUNT.unpack_from(view, pos)
+    if extra_len:
+        extras = json.loads(bytes(view[pos + 4:pos + 4 + extra_len]))
+        for row, (top, meta) in zip(rows, extras):
+            row["metadata"].update(meta)
+            row.update(top)
+    return rows
+
+
+class CollectorClient:
+    """Conexión persistente del sensor con ventana de lotes sin confirmar."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        sensor_id: str,
+        token: str = "",
+        window: int = 64,
+        connect_timeout: float = 10.0,
+        should_stop: Callable[[], bool] = lambda: False,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.sensor_id = sensor_id
+        self.token = token
+        self.window = window
+        self.connect_timeout = connect_timeout
+        self._should_stop = should_stop
+        self.codec = "zlib"
+        self._cond = threading.Condition()
+        self._send_lock = threading.Lock()
+        # seq -> (trama, filas, callback, enviado en)
+        self._pending: Dict[int, Tuple[bytes, int, Optional[Callable[[], None]], float]] = {}
+        self._seq = 0
+        self._sock: Optional[socket.socket] = None
+        self._generation = 0
+        self._fatal: Optional[BaseException] = None
+        self.on_ack: Optional[Callable[[int, float], None]] = None
+        self.acked_rows = 0
+        self.sent_bytes = 0
+
+    def _connect(self, deadline: Optional[float] = None) -> None:
+        """Abre la conexión, saluda y reenvía lo pendiente. Con ``_cond`` tomado."""
+        attempt = 0
+        while True:
+            if self._should_stop() and not self._pending:
+                raise RuntimeError("parada solicitada")
+            sock = None
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                hello = {"version": PROTOCOL_VERSION, "sensor_id": self.sensor_id, "token": self.token, "codecs": available_codecs()}
+                sock.sendall(pack_frame(HELLO, 0, json.dumps(hello).encode("utf-8")))
+                kind, _, body = read_frame(sock)
+                if kind == ERROR:
+                    sock.close()
+                    raise ProtocolError(f"el collector rechazó la conexión: {body.decode('utf-8', 'replace')}")
+                if kind != WELCOME:
+                    sock.close()
+                    raise ProtocolError(f"respuesta inesperada {kind}")
+                self.codec = json.loads(body)["codec"]
+                sock.settimeout(None)
+                # Lo no confirmado de la conexión anterior, en orden
+                for seq in sorted(self._pending):
+                    sock.sendall(self._pending[seq][0])
+                break
+            except ProtocolError:
+                raise
+            except OSError as exc:
+                if sock is not None:
+                    sock.close()
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise RuntimeError(f"collector {self.host}:{self.port} no disponible: {exc}") from exc
+                delay = min(30.0, 0.5 * 2 ** attempt)
+                attempt += 1
+                print(f"[WARN] Collector {self.host}:{self.port} no disponible ({exc}); reintento en {delay:.1f}s")
+                self._cond.wait(delay)
+                if self._should_stop():
+                    raise RuntimeError("parada solicitada") from exc
+
+        self._sock = sock
+        self._generation += 1
+        threading.Thread(target=self._reader, args=(sock, self._generation), name="collector-acks", daemon=True).start()
+
+    def _reader(self, sock: socket.socket, generation: int) -> None:
+        try:
+            while True:
+                kind, seq, body = read_frame(sock)
+                if kind == ERROR:
+                    reason = body.decode("utf-8", "replace")
+                    raise ProtocolError(f"el collector descartó el lote {seq}: {reason}" if seq else reason)
+                if kind != ACK:
+                    continue
+                with self._cond:
+                    item = self._pending.pop(seq, None)
+                    self._cond.notify_all()
+                if item is None:
+                    continue  # ACK de un lote reenviado y ya confirmado
+                _, rows, on_done, sent_at = item
+                self.acked_rows += rows
+                if self.on_ack is not None:
+                    self.on_ack(rows, time.monotonic() - sent_at)
+                if on_done is not None:
+                    on_done()
+        except ProtocolError as exc:
+            with self._cond:
+                self._fatal = exc
+                self._cond.notify_all()
+        except (OSError, ConnectionError, struct.error):
+            pass
+        finally:
+            with self._cond:
+                if self._generation == generation:
+                    self._sock = None  # el próximo send/close reconecta
+                self._cond.notify_all()
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def send(self, block: bytes, rows: int, on_done: Optional[Callable[[], None]] = None) -> int:
+        """Comprime y envía un bloque; se bloquea si la ventana está llena. Devuelve bytes enviados."""
+        with self._cond:
+            while len(self._pending) >= self.window and self._fatal is None:
+                if self._sock is None:
+                    self._connect()
+                self._cond.wait(0.5)
+            if self._fatal is not None:
+                raise self._fatal
+            if self._sock is None:
+                self._connect()
+            self._seq += 1
+            frame = pack_frame(BATCH, self._seq, compress(self.codec, block))
+            self._pending[self._seq] = (frame, rows, on_done, time.monotonic())
+            sock = self._sock
+        try:
+            with self._send_lock:
+                assert sock is not None
+                sock.sendall(frame)
+        except OSError:
+            pass  # el lector verá la caída; se reenvía al reconectar
+        self.sent_bytes += len(frame)
+        return len(frame)
+
+    def close(self, timeout: float = 60.0) -> None:
+        """Espera las confirmaciones pendientes (reconectando si hace falta)."""
+        deadline = time.monotonic() + timeout
+        try:
+            with self._cond:
+                while self._pending and self._fatal is None:
+                    if time.monotonic() >= deadline:
+                        raise RuntimeError(f"{len(self._pending)} lotes sin confirmar por el collector")
+                    if self._sock is None:
+                        self._connect(deadline)
+                    self._cond.wait(0.5)
+                if self._fatal is not None:
+                    raise self._fatal
+        finally:
+            sock, self._sock = self._sock, None
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                sock.close()
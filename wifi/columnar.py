@@ -0,0 +1,439 @@
+"""
+Decodificador columnar de bloques de líneas de tshark.
+
+En vez de construir un dict (con otro dict ``metadata`` dentro) por paquete,
+un bloque de líneas TSV se convierte en columnas:
+
+- ``array('d')`` para epoch, ``array('H')`` para puertos (+ máscara de nulos),
+  ``array('I')`` para tamaños, ``array('q')`` para frame.number y
+  ``array('h')`` para flags TCP y ``array('b')`` para el rcode DNS
+- IPs y protocolo como cadenas internadas (un objeto por valor distinto)
+
+El timestamp ISO se formatea una vez por segundo distinto (más el sufijo de
+microsegundos) y el JSON para PostgREST se escribe directamente desde las
+columnas, con la misma salida que ``json.dumps`` sobre las filas de
+``to_record``. ``rows()`` materializa los dicts cuando alguna etapa los
+necesita.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import json
+import math
+import sys
+import time
+from array import array
+from json.encoder import encode_basestring_ascii
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+NO_FRAME = -1
+NO_FLAGS = -1
+NO_RCODE = -1
+_SRC_PORT = 1
+_DST_PORT = 2
+_EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+_COLUMNS = (
+    "epoch", "src_ip", "dst_ip", "src_port", "dst_port", "port_mask",
+    "protocol", "size", "payload", "frame_number", "tcp_flags", "dns_rcode",
+)
+_OPTIONAL_COLUMNS = ("ids", "score", "technique", "tactic", "meta_extra")
+
+
+class IsoFormatter:
+    """epoch -> ISO 8601 UTC igual que ``datetime.isoformat()``, cacheando el segundo."""
+
+    def __init__(self, max_entries: int = 4096) -> None:
+        self._cache: Dict[int, str] = {}
+        self._max_entries = max_entries
+
+    def format(self, epoch: float) -> str:
+        # Mismo redondeo que datetime.fromtimestamp (half-even al microsegundo)
+        frac, whole = math.modf(epoch)
+        sec = int(whole)
+        us = round(frac * 1e6)
+        if us >= 1_000_000:
+            sec += 1
+            us -= 1_000_000
+        elif us < 0:
+            sec -= 1
+            us += 1_000_000
+        prefix = self._cache.get(sec)
+        if prefix is None:
+            if len(self._cache) >= self._max_entries:
+                self._cache.clear()
+            prefix = (_EPOCH + dt.timedelta(seconds=sec)).strftime("%Y-%m-%dT%H:%M:%S")
+            self._cache[sec] = prefix
+        if us:
+            return f"{prefix}.{us:06d}+00:00"
+        return prefix + "+00:00"
+
+
+# Columnas de network_packets en el orden de to_record (COPY ... FROM STDIN)
+COPY_COLUMNS = ("timestamp", "src_ip", "dst_ip", "src_port", "dst_port", "protocol", "payload", "payload_size", "metadata")
+COPY_NULL = "\\N"
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def copy_escape(value: str) -> str:
+    """Escapa un valor para el formato texto de COPY."""
+    return value.translate(_COPY_ESCAPES)
+
+
+def _first(value: str) -> str:
+    # tshark puede devolver "a,b" con varias ocurrencias
+    if "," in value:
+        value = value.split(",", 1)[0]
+    return value.strip()
+
+
+def _flags(value: str) -> int:
+    v = _first(value)
+    if not v:
+        return NO_FLAGS
+    try:
+        return int(v, 16) if v[:2].lower() == "0x" else int(v)
+    except ValueError:
+        return NO_FLAGS
+
+
+def _rcode(value: str) -> int:
+    v = _first(value)
+    return int(v) if v.isdigit() and int(v) <= 0x7F else NO_RCODE
+
+
+def _port(tcp: str, udp: str) -> int:
+    p = _first(tcp) or _first(udp)
+    if not p:
+        return -1
+    try:
+        return int(p)
+    except ValueError:
+        return -1
+
+
+class ColumnBatch:
+    """Lote de paquetes en columnas; ``len`` y slicing como una lista de filas."""
+
+    __slots__ = (
+        "source", "epoch", "src_ip", "dst_ip", "src_port", "dst_port", "port_mask",
+        "protocol", "size", "payload", "frame_number", "tcp_flags", "dns_rcode", "ids",
+        "score", "technique", "tactic", "meta_extra", "_formatter",
+    )
+
+    def __init__(self, source: str, formatter: Optional[IsoFormatter] = None) -> None:
+        self.source = source
+        self.epoch = array("d")
+        self.src_ip: List[str] = []
+        self.dst_ip: List[str] = []
+        self.src_port = array("H")
+        self.dst_port = array("H")
+        self.port_mask = bytearray()
+        self.protocol: List[str] = []
+        self.size = array("I")
+        self.payload: List[Optional[str]] = []
+        self.frame_number = array("q")
+        self.tcp_flags = array("h")
+        self.dns_rcode = array("b")
+        # ``id`` asignado en el cliente (p. ej. para enlazar embeddings); None = lo pone la BD
+        self.ids: Optional[List[str]] = None
+        # Veredicto de --detect: anomaly_score, mitre_technique_id y mitre_tactic (None = sin detección)
+        self.score: Optional[array] = None
+        self.technique: Optional[List[Optional[str]]] = None
+        self.tactic: Optional[List[Optional[str]]] = None
+        # Campos extra de metadata por fila (p. ej. --enrich); filas iguales comparten el dict
+        self.meta_extra: Optional[List[Dict[str, Any]]] = None
+        self._formatter = formatter or IsoFormatter()
+
+    def __len__(self) -> int:
+        return len(self.epoch)
+
+    def __getitem__(self, index: slice) -> "ColumnBatch":
+        if not isinstance(index, slice):
+            raise TypeError("ColumnBatch sólo admite slicing")
+        out = ColumnBatch(self.source, self._formatter)
+        for name in _COLUMNS:
+            setattr(out, name, getattr(self, name)[index])
+        for name in _OPTIONAL_COLUMNS:
+            column = getattr(self, name)
+            if column is not None:
+                setattr(out, name, column[index])
+        return out
+
+    def take(self, indices: List[int]) -> "ColumnBatch":
+        """Nuevo lote sólo con las filas ``indices`` (en ese orden)."""
+        out = ColumnBatch(self.source, self._formatter)
+        for name in _COLUMNS:
+            column = getattr(self, name)
+            picked = [column[i] for i in indices]
+            if isinstance(column, array):
+                picked = array(column.typecode, picked)
+            elif isinstance(column, bytearray):
+                picked = bytearray(picked)
+            setattr(out, name, picked)
+        for name in _OPTIONAL_COLUMNS:
+            column = getattr(self, name)
+            if column is not None:
+                picked = [column[i] for i in indices]
+                setattr(out, name, array(column.typecode, picked) if isinstance(column, array) else picked)
+        return out
+
+    def set_detection(self, verdicts: List[Tuple[float, Optional[str], Optional[str]]]) -> None:
+        """(anomaly_score, técnica, táctica) por fila, en orden."""
+        self.score = array("d", (v[0] for v in verdicts))
+        self.technique = [v[1] for v in verdicts]
+        self.tactic = [v[2] for v in verdicts]
+
+    def last_frame(self) -> Optional[int]:
+        if not self.frame_number or self.frame_number[-1] == NO_FRAME:
+            return None
+        return self.frame_number[-1]
+
+    def shift_frames(self, offset: int) -> None:
+        """Suma ``offset`` a los ``frame_number`` (tramos decodificados por separado)."""
+        self.frame_number = array("q", (f + offset if f != NO_FRAME else f for f in self.frame_number))
+
+    def packets(self) -> Iterator[Tuple[float, str, Optional[int], str, Optional[int], str, int, Optional[int]]]:
+        """(epoch, src_ip, src_port, dst_ip, dst_port, protocol, size, tcp_flags) por paquete."""
+        for epoch, src, dst, sport, dport, mask, proto, size, flags in zip(
+            self.epoch, self.src_ip, self.dst_ip, self.src_port, self.dst_port,
+            self.port_mask, self.protocol, self.size, self.tcp_flags,
+        ):
+            yield (
+                epoch,
+                src,
+                sport if mask & _SRC_PORT else None,
+                dst,
+                dport if mask & _DST_PORT else None,
+                proto,
+                size,
+                flags if flags != NO_FLAGS else None,
+            )
+
+    def timestamps(self) -> List[str]:
+        fmt = self._formatter.format
+        return [fmt(e) for e in self.epoch]
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """Materializa las filas con la forma exacta de ``to_record``."""
+        out = []
+        source = self.source
+        for i, ts in enumerate(self.timestamps()):
+            mask = self.port_mask[i]
+            frame = self.frame_number[i]
+            flags = self.tcp_flags[i]
+            rcode = self.dns_rcode[i]
+            row: Dict[str, Any] = {"id": self.ids[i]} if self.ids is not None else {}
+            row.update({
+                "timestamp": ts,
+                "src_ip": self.src_ip[i],
+                "dst_ip": self.dst_ip[i],
+                "src_port": self.src_port[i] if mask & _SRC_PORT else None,
+                "dst_port": self.dst_port[i] if mask & _DST_PORT else None,
+                "protocol": self.protocol[i],
+                "payload": self.payload[i],
+                "payload_size": self.size[i],
+                "metadata": {
+                    "source": source,
+                    "frame_number": frame if frame != NO_FRAME else None,
+                    "tcp_flags": flags if flags != NO_FLAGS else None,
+                    "dns_rcode": rcode if rcode != NO_RCODE else None,
+                },
+            })
+            if self.meta_extra is not None:
+                row["metadata"].update(self.meta_extra[i])
+            if self.score is not None:
+                row["metadata"]["anomaly_score"] = self.score[i]
+                row["is_malicious"] = self.technique[i] is not None  # type: ignore[index]
+                row["mitre_technique_id"] = self.technique[i]  # type: ignore[index]
+                row["mitre_tactic"] = self.tactic[i]  # type: ignore[index]
+            out.append(row)
+        return out
+
+    def to_json(self) -> str:
+        """Serializa a JSON sin crear dicts (idéntico a ``json.dumps(self.rows())``)."""
+        enc: Dict[str, str] = {}
+        for value in (*set(self.src_ip), *set(self.dst_ip), *set(self.protocol)):
+            if value not in enc:
+                enc[value] = encode_basestring_ascii(value)
+        template = (
+            '{"timestamp": "%s", "src_ip": %s, "dst_ip": %s, "src_port": %s, "dst_port": %s, '
+            '"protocol": %s, "payload": %s, "payload_size": %d, '
+            '"metadata": {"source": ' + encode_basestring_ascii(self.source).replace("%", "%%") + ', "frame_number": %s, "tcp_flags": %s, "dns_rcode": %s}}'
+        )
+        parts = [
+            template % (
+                ts,
+                enc[src],
+                enc[dst],
+                sport if mask & _SRC_PORT else "null",
+                dport if mask & _DST_PORT else "null",
+                enc[proto],
+                encode_basestring_ascii(payload) if payload is not None else "null",
+                size,
+                frame if frame != NO_FRAME else "null",
+                flags if flags != NO_FLAGS else "null",
+                rcode if rcode != NO_RCODE else "null",
+            )
+            for ts, src, dst, sport, dport, mask, proto, payload, size, frame, flags, rcode in zip(
+                self.timestamps(), self.src_ip, self.dst_ip, self.src_port, self.dst_port,
+                self.port_mask, self.protocol, self.payload, self.size, self.frame_number,
+                self.tcp_flags, self.dns_rcode,
+            )
+        ]
+        if self.meta_extra is not None:
+            extra = self._extra_fragments(lambda frag: frag)
+            parts = [part[:-2] + extra(fields) + "}}" for part, fields in zip(parts, self.meta_extra)]
+        if self.score is not None:
+            # Cierra metadata con anomaly_score y añade las columnas de la detección
+            parts = [
+                '%s, "anomaly_score": %r}, "is_malicious": %s, "mitre_technique_id": %s, "mitre_tactic": %s}' % (
+                    part[:-2], score,
+                    "false" if technique is None else "true",
+                    "null" if technique is None else encode_basestring_ascii(technique),
+                    "null" if tactic is None else encode_basestring_ascii(tactic),
+                )
+                for part, score, technique, tactic in zip(parts, self.score, self.technique, self.tactic)  # type: ignore[arg-type]
+            ]
+        if self.ids is not None:
+            parts = ['{"id": "%s", %s' % (row_id, part[1:]) for row_id, part in zip(self.ids, parts)]
+        return "[" + ", ".join(parts) + "]"
+
+
+    @staticmethod
+    def _extra_fragments(escape: Any) -> Any:
+        """``fields -> ', "k": v, ...'`` (JSON de json.dumps), codificado una vez por dict."""
+        cache: Dict[int, str] = {}
+
+        def fragment(fields: Dict[str, Any]) -> str:
+            frag = cache.get(id(fields))
+            if frag is None:
+                frag = cache[id(fields)] = escape(", " + json.dumps(fields)[1:-1]) if fields else ""
+            return frag
+
+        return fragment
+
+    def copy_columns(self) -> List[str]:
+        columns = (["id"] if self.ids is not None else []) + list(COPY_COLUMNS)
+        if self.score is not None:
+            columns += ["is_malicious", "mitre_technique_id", "mitre_tactic"]
+        return columns
+
+    def to_copy(self) -> str:
+        """Filas en formato texto de COPY (columnas de ``copy_columns``), sin crear dicts."""
+        enc: Dict[str, str] = {}
+        for value in (*set(self.src_ip), *set(self.dst_ip), *set(self.protocol)):
+            if value not in enc:
+                enc[value] = copy_escape(value)
+        template = (
+            "%s\t%s\t%s\t%s\t%s\t%s\t%s\t%d\t"
+            + copy_escape('{"source": ' + encode_basestring_ascii(self.source)).replace("%", "%%")
+            + ', "frame_number": %s, "tcp_flags": %s, "dns_rcode": %s}\n'
+        )
+        parts = [
+            template % (
+                ts,
+                enc[src],
+                enc[dst],
+                sport if mask & _SRC_PORT else COPY_NULL,
+                dport if mask & _DST_PORT else COPY_NULL,
+                enc[proto],
+                copy_escape(payload) if payload is not None else COPY_NULL,
+                size,
+                frame if frame != NO_FRAME else "null",
+                flags if flags != NO_FLAGS else "null",
+                rcode if rcode != NO_RCODE else "null",
+            )
+            for ts, src, dst, sport, dport, mask, proto, payload, size, frame, flags, rcode in zip(
+                self.timestamps(), self.src_ip, self.dst_ip, self.src_port, self.dst_port,
+                self.port_mask, self.protocol, self.payload, self.size, self.frame_number,
+                self.tcp_flags, self.dns_rcode,
+            )
+        ]
+        if self.meta_extra is not None:
+            extra = self._extra_fragments(copy_escape)
+            parts = [part[:-2] + extra(fields) + "}\n" for part, fields in zip(parts, self.meta_extra)]
+        if self.score is not None:
+            parts = [
+                "%s, \"anomaly_score\": %r}\t%s\t%s\t%s\n" % (
+                    part[:-2], score,
+                    "f" if technique is None else "t",
+                    COPY_NULL if technique is None else copy_escape(technique),
+                    COPY_NULL if tactic is None else copy_escape(tactic),
+                )
+                for part, score, technique, tactic in zip(parts, self.score, self.technique, self.tactic)  # type: ignore[arg-type]
+            ]
+        if self.ids is not None:
+            parts = [f"{row_id}\t{part}" for row_id, part in zip(self.ids, parts)]
+        return "".join(parts)
+
+
+def decode_lines(lines: Iterable[str], source: str, formatter: Optional[IsoFormatter] = None) -> ColumnBatch:
+    """Decodifica un bloque de líneas TSV (columnas de ``build_tshark_cmd``)."""
+    batch = ColumnBatch(source, formatter)
+    intern = sys.intern
+    epoch_col = batch.epoch.append
+    src_col = batch.src_ip.append
+    dst_col = batch.dst_ip.append
+    sport_col = batch.src_port.append
+    dport_col = batch.dst_port.append
+    mask_col = batch.port_mask.append
+    proto_col = batch.protocol.append
+    size_col = batch.size.append
+    payload_col = batch.payload.append
+    frame_col = batch.frame_number.append
+    flags_col = batch.tcp_flags.append
+    rcode_col = batch.dns_rcode.append
+    protocols: Dict[str, str] = {}
+
+    for line in lines:
+        parts = line.rstrip("\n").split("\t")
+        if len(parts) < 11:
+            continue
+        ts, src_ip, dst_ip, tcp_sp, udp_sp, tcp_dp, udp_dp, proto, frame_len, data_text, frame_number = parts[:11]
+
+        src_ip = _first(src_ip)
+        dst_ip = _first(dst_ip)
+        if not src_ip or not dst_ip:
+            continue  # network_packets exige src/dst no nulos
+
+        ts = ts.strip()
+        try:
+            epoch = float(ts) if ts else time.time()
+        except ValueError:
+            epoch = time.time()
+
+        sport = _port(tcp_sp, udp_sp)
+        dport = _port(tcp_dp, udp_dp)
+        mask = 0
+        if 0 <= sport <= 0xFFFF:
+            mask |= _SRC_PORT
+        else:
+            sport = 0
+        if 0 <= dport <= 0xFFFF:
+            mask |= _DST_PORT
+        else:
+            dport = 0
+
+        protocol = protocols.get(proto)
+        if protocol is None:
+            protocol = protocols[proto] = intern((proto.strip() or "UNKNOWN")[:20])
+
+        frame_len = frame_len.strip()
+        data_text = data_text.strip()
+        frame_number = frame_number.strip()
+
+        epoch_col(epoch)
+        src_col(intern(src_ip))
+        dst_col(intern(dst_ip))
+        sport_col(sport)
+        dport_col(dport)
+        mask_col(mask)
+        proto_col(protocol)
+        size_col(int(frame_len) if frame_len.isdigit() else 0)
+        payload_col(data_text or None)
+        frame_col(int(frame_number) if frame_number.isdigit() else NO_FRAME)
+        flags_col(_flags(parts[11]) if len(parts) > 11 else NO_FLAGS)
+        rcode_col(_rcode(parts[12]) if len(parts) > 12 else NO_RCODE)
+
+    return batch
@@ -0,0 +1,186 @@
+"""
+Deduplicación de paquetes entre ejecuciones.
+
+- ``packet_id``: UUID determinista (uuid5) a partir de la huella del paquete
+  (epoch al µs, IPs, puertos, longitud y hash del payload). Se usa como ``id``
+  de ``network_packets``, así que la clave primaria es la clave única del
+  ``resolution=ignore-duplicates`` de PostgREST.
+- ``RotatingBloom``: filtro de Bloom escalable en dos generaciones (la actual
+  y la anterior) persistido en disco; descarta en local lo ya enviado sin
+  guardar las claves. Al llenarse una generación la anterior se olvida y el
+  servidor queda como red de seguridad.
+
+La columna de protocolo no entra en la huella: depende de la disección
+(``TLSv1.2`` en tshark, ``TCP`` en el lector nativo).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import struct
+import threading
+import uuid
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+PACKET_NAMESPACE = uuid.UUID("6f1b8a52-3c0e-5d2a-9a47-2b1e0c9d7f10")
+FILE_MAGIC = b"UBUBLOOM1\n"
+
+
+def packet_id(
+    epoch: float,
+    src_ip: str,
+    src_port: Optional[int],
+    dst_ip: str,
+    dst_port: Optional[int],
+    frame_len: int,
+    payload: Optional[str],
+) -> uuid.UUID:
+    payload_hash = hashlib.blake2b(payload.encode("utf-8"), digest_size=8).hexdigest() if payload else ""
+    name = f"{epoch:.6f}|{src_ip}|{src_port}|{dst_ip}|{dst_port}|{frame_len}|{payload_hash}"
+    return uuid.uuid5(PACKET_NAMESPACE, name)
+
+
+def bloom_hashes(key: uuid.UUID) -> Tuple[int, int]:
+    """Dos hashes de 64 bits para el doble hashing (el UUID ya es un SHA-1)."""
+    h1, h2 = struct.unpack("<QQ", key.bytes)
+    return h1, h2 | 1
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.nbits = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.k = max(1, round(self.nbits / capacity * math.log(2)))
+        self.bits = bytearray((self.nbits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, h1: int, h2: int) -> List[int]:
+        n = self.nbits
+        return [(h1 + i * h2) % n for i in range(self.k)]
+
+    def __contains__(self, hashes: Tuple[int, int]) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(*hashes))
+
+    def add(self, hashes: Tuple[int, int]) -> None:
+        bits = self.bits
+        for p in self._positions(*hashes):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+class ScalableBloom:
+    """Filtros encadenados: al llenarse uno se añade otro el doble de grande y
+    con la mitad de error, de modo que el error total queda acotado."""
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filters: List[BloomFilter] = []
+        self.count = 0
+
+    def __contains__(self, hashes: Tuple[int, int]) -> bool:
+        return any(hashes in f for f in reversed(self.filters))
+
+    def add(self, hashes: Tuple[int, int]) -> None:
+        if not self.filters or self.filters[-1].count >= self.filters[-1].capacity:
+            level = len(self.filters)
+            self.filters.append(BloomFilter(self.capacity * 2 ** level, self.error_rate * 0.5 ** (level + 1)))
+        self.filters[-1].add(hashes)
+        self.count += 1
+
+    def nbytes(self) -> int:
+        return sum(len(f.bits) for f in self.filters)
+
+
+class RotatingBloom:
+    """Conjunto aproximado de claves vistas en las últimas ~``2 * window`` inserciones."""
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.001, window: int = 5_000_000) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.window = window
+        self.current = ScalableBloom(capacity, error_rate)
+        self.previous: Optional[ScalableBloom] = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: uuid.UUID) -> bool:
+        hashes = bloom_hashes(key)
+        with self._lock:
+            return hashes in self.current or (self.previous is not None and hashes in self.previous)
+
+    def add_many(self, keys: List[uuid.UUID]) -> None:
+        with self._lock:
+            for key in keys:
+                hashes = bloom_hashes(key)
+                if hashes in self.current:
+                    continue
+                if self.current.count >= self.window:
+                    self.previous = self.current
+                    self.current = ScalableBloom(self.capacity, self.error_rate)
+                self.current.add(hashes)
+
+    def nbytes(self) -> int:
+        return self.current.nbytes() + (self.previous.nbytes() if self.previous else 0)
+
+    def save(self, path: Path) -> None:
+        with self._lock:
+            generations = [g for g in (self.current, self.previous) if g is not None]
+            header = {
+                "capacity": self.capacity,
+                "error_rate": self.error_rate,
+                "window": self.window,
+                "generations": [
+                    {"count": g.count, "filters": [[f.capacity, f.error_rate, f.count] for f in g.filters]}
+                    for g in generations
+                ],
+            }
+            blobs = [bytes(f.bits) for g in generations for f in g.filters]
+        raw = json.dumps(header).encode("utf-8")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with tmp.open("wb") as fh:
+            fh.write(FILE_MAGIC + struct.pack("<I", len(raw)) + raw)
+            for blob in blobs:
+                fh.write(blob)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path, capacity: int, error_rate: float, window: int) -> "RotatingBloom":
+        """Carga el filtro guardado; uno vacío si no existe o tiene otros parámetros."""
+        bloom = cls(capacity, error_rate, window)
+        if not path.exists():
+            return bloom
+        try:
+            with path.open("rb") as fh:
+                if fh.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                    raise ValueError("cabecera desconocida")
+                (size,) = struct.unpack("<I", fh.read(4))
+                header = json.loads(fh.read(size))
+                if (header["capacity"], header["error_rate"]) != (capacity, error_rate):
+                    print(f"[WARN] {path} se creó con otra capacidad/error; se empieza un filtro nuevo")
+                    return bloom
+                generations = []
+                for spec in header["generations"]:
+                    gen = ScalableBloom(capacity, error_rate)
+                    gen.count = spec["count"]
+                    for f_capacity, f_error, f_count in spec["filters"]:
+                        f = BloomFilter(f_capacity, f_error)
+                        f.bits = bytearray(fh.read(len(f.bits)))
+                        f.count = f_count
+                        if len(f.bits) != (f.nbits + 7) // 8:
+                            raise ValueError("fichero truncado")
+                        gen.filters.append(f)
+                    generations.append(gen)
+        except (OSError, ValueError, KeyError, struct.error) as exc:
+            print(f"[WARN] Filtro de duplicados ilegible ({exc}); se empieza uno nuevo: {path}")
+            return bloom
+        if generations:
+            bloom.current = generations[0]
+            bloom.previous = generations[1] if len(generations) > 1 else None
+        return bloom
@@ -0,0 +1,334 @@
+"""
+Detección en streaming de escaneos y exfiltración con memoria acotada.
+
+Por IP de origen (tabla LRU de ``max_sources`` entradas) se mantienen:
+
+- HyperLogLog de puertos destino distintos -> T1046 (Network Service Scanning)
+- HyperLogLog de hosts internos distintos -> T1018 (Remote System Discovery)
+- tasa de paquetes con decaimiento exponencial a 10 s y 5 min (ráfagas)
+
+y, globalmente, un count-min sketch de bytes por par (origen interno, destino
+público) -> T1041 (Exfiltration Over C2 Channel).
+
+Las ventanas son deslizantes aproximadas: dos subventanas de ``window_sec``
+(actual y anterior); los HLL se unen y los bytes de la anterior se ponderan por
+la fracción que aún cae dentro de la ventana. Los escaneos sólo cuentan
+paquetes que abren conversación (SYN sin ACK, UDP hacia el puerto menor, ICMP),
+así que las respuestas de un servidor a puertos efímeros no los disparan.
+
+La memoria no depende del número de hosts: ~1.3 KB por origen vigilado más
+``2 * depth * width * 8`` bytes del sketch.
+"""
+
+from __future__ import annotations
+
+import functools
+import ipaddress
+import math
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+MASK64 = (1 << 64) - 1
+_INV_POW2 = [2.0 ** -r for r in range(65)]
+
+TACTICS = {
+    "T1046": "Discovery",
+    "T1018": "Discovery",
+    "T1041": "Exfiltration",
+}
+
+Packet = Tuple[float, str, Optional[int], str, Optional[int], str, int, Optional[int]]
+Verdict = Tuple[float, Optional[str]]
+
+
+def mix64(value: int) -> int:
+    """Finalizador de splitmix64: reparte bien incluso enteros consecutivos."""
+    z = (value + 0x9E3779B97F4A7C15) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+
+def hash64(value: object) -> int:
+    return mix64(hash(value) & MASK64)
+
+
+@functools.lru_cache(maxsize=4096)
+def is_internal(ip: str) -> bool:
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return addr.is_private or addr.is_link_local
+
+
+@functools.lru_cache(maxsize=4096)
+def is_public(ip: str) -> bool:
+    try:
+        return ipaddress.ip_address(ip).is_global
+    except ValueError:
+        return False
+
+
+class HyperLogLog:
+    """Cardinalidad aproximada en ``2 ** p`` bytes (error típico 1.04 / sqrt(2 ** p))."""
+
+    __slots__ = ("p", "registers")
+
+    def __init__(self, p: int = 8) -> None:
+        self.p = p
+        self.registers = bytearray(1 << p)
+
+    def add(self, h: int) -> None:
+        p = self.p
+        rest = h & ((1 << (64 - p)) - 1)
+        rank = (64 - p) - rest.bit_length() + 1
+        idx = h >> (64 - p)
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def clear(self) -> None:
+        self.registers = bytearray(len(self.registers))
+
+    def estimate(self, other: Optional["HyperLogLog"] = None) -> float:
+        """Cardinalidad de este HLL (unido a ``other`` si se indica)."""
+        regs = self.registers if other is None else bytes(map(max, self.registers, other.registers))
+        m = len(regs)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(map(_INV_POW2.__getitem__, regs))
+        zeros = regs.count(0)
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)  # linear counting para cardinalidades pequeñas
+        return raw
+
+
+class CountMinSketch:
+    """Sumas por clave con ``depth`` filas de ``width`` contadores (sólo sobreestima)."""
+
+    __slots__ = ("width", "depth", "rows")
+
+    def __init__(self, width: int = 2048, depth: int = 4) -> None:
+        self.width = width
+        self.depth = depth
+        self.rows = [array("d", bytes(8 * width)) for _ in range(depth)]
+
+    def _cells(self, h: int) -> Iterable[Tuple[array, int]]:
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        width = self.width
+        return ((row, (h1 + i * h2) % width) for i, row in enumerate(self.rows))
+
+    def add(self, h: int, amount: float) -> None:
+        for row, i in self._cells(h):
+            row[i] += amount
+
+    def query(self, h: int) -> float:
+        return min(row[i] for row, i in self._cells(h))
+
+    def clear(self) -> None:
+        self.rows = [array("d", bytes(8 * self.width)) for _ in range(self.depth)]
+
+
+class DecayingRate:
+    """Paquetes por segundo con decaimiento exponencial de constante ``tau``."""
+
+    __slots__ = ("tau", "value", "ts")
+
+    def __init__(self, tau: float) -> None:
+        self.tau = tau
+        self.value = 0.0
+        self.ts: Optional[float] = None
+
+    def add(self, ts: float, count: int) -> None:
+        if self.ts is not None and ts > self.ts:
+            self.value *= math.exp((self.ts - ts) / self.tau)
+        self.ts = ts if self.ts is None else max(self.ts, ts)
+        self.value += count / self.tau
+
+
+class SourceState:
+    __slots__ = ("first", "start", "ports", "prev_ports", "hosts", "prev_hosts", "fast", "slow", "n_ports", "n_hosts")
+
+    def __init__(self, start: float, p: int) -> None:
+        self.first = start
+        self.start = start
+        self.ports = HyperLogLog(p)
+        self.prev_ports = HyperLogLog(p)
+        self.hosts = HyperLogLog(p)
+        self.prev_hosts = HyperLogLog(p)
+        self.fast = DecayingRate(10.0)
+        self.slow = DecayingRate(300.0)
+        # Estimaciones de la ventana; se recalculan sólo cuando cambian los HLL
+        self.n_ports = 0.0
+        self.n_hosts = 0.0
+
+    def burst(self) -> float:
+        """Tasa reciente / tasa de fondo (1.0 = ritmo habitual)."""
+        age = (self.fast.ts or self.first) - self.first
+        if age < self.fast.tau or self.slow.value <= 0:
+            return 1.0
+        # Corrige el sesgo de arranque: ambas tasas empiezan en 0 al ver el origen
+        fast = self.fast.value / (1.0 - math.exp(-age / self.fast.tau))
+        slow = self.slow.value / (1.0 - math.exp(-age / self.slow.tau))
+        return fast / slow
+
+    def roll(self, ts: float, window: float) -> bool:
+        """Avanza la ventana hasta ``ts``; True si cambió."""
+        if ts < self.start + window:
+            return False
+        if ts < self.start + 2 * window:
+            self.ports, self.prev_ports = self.prev_ports, self.ports
+            self.hosts, self.prev_hosts = self.prev_hosts, self.hosts
+            self.ports.clear()
+            self.hosts.clear()
+            self.start += window
+        else:
+            for hll in (self.ports, self.prev_ports, self.hosts, self.prev_hosts):
+                hll.clear()
+            self.start = ts
+        return True
+
+
+class Detector:
+    """Puntúa cada paquete con (anomaly_score 0..1, técnica MITRE o None).
+
+    Un lote se procesa en dos pasadas: primero se actualiza el estado
+    agregado por origen y por par, después se puntúa cada fila con el estado
+    resultante (una evaluación por origen, no por paquete).
+    """
+
+    def __init__(
+        self,
+        window_sec: float = 60.0,
+        scan_ports: int = 100,
+        scan_hosts: int = 64,
+        exfil_bytes: float = 20 * 1024 * 1024,
+        burst_ratio: float = 20.0,
+        max_sources: int = 4096,
+        hll_precision: int = 8,
+        cms_width: int = 2048,
+        cms_depth: int = 4,
+    ) -> None:
+        self.window = window_sec
+        self.scan_ports = scan_ports
+        self.scan_hosts = scan_hosts
+        self.exfil_bytes = exfil_bytes
+        self.burst_ratio = burst_ratio
+        self.max_sources = max_sources
+        self.p = hll_precision
+        self._sources: "OrderedDict[str, SourceState]" = OrderedDict()
+        self._bytes = CountMinSketch(cms_width, cms_depth)
+        self._prev_bytes = CountMinSketch(cms_width, cms_depth)
+        self._bytes_start: Optional[float] = None
+        self.evicted = 0
+        self.flagged: Dict[str, int] = {}
+
+    def _roll_bytes(self, ts: float) -> None:
+        if self._bytes_start is None:
+            self._bytes_start = ts
+        elif ts >= self._bytes_start + 2 * self.window:
+            self._bytes.clear()
+            self._prev_bytes.clear()
+            self._bytes_start = ts
+        elif ts >= self._bytes_start + self.window:
+            self._bytes, self._prev_bytes = self._prev_bytes, self._bytes
+            self._bytes.clear()
+            self._bytes_start += self.window
+
+    def _state(self, src: str, ts: float) -> Tuple[SourceState, bool]:
+        state = self._sources.get(src)
+        if state is None:
+            state = self._sources[src] = SourceState(ts, self.p)
+            if len(self._sources) > self.max_sources:
+                self._sources.popitem(last=False)
+                self.evicted += 1
+            return state, False
+        self._sources.move_to_end(src)
+        return state, state.roll(ts, self.window)
+
+    def observe(self, packets: List[Packet]) -> List[Verdict]:
+        if not packets:
+            return []
+
+        # 1) agregados del lote
+        ports: Dict[str, Set[int]] = {}
+        hosts: Dict[str, Set[str]] = {}
+        counts: Dict[str, int] = {}
+        last_ts: Dict[str, float] = {}
+        pair_bytes: Dict[Tuple[str, str], int] = {}
+        for epoch, src, sport, dst, dport, _, size, flags in packets:
+            counts[src] = counts.get(src, 0) + 1
+            if epoch > last_ts.get(src, 0.0):
+                last_ts[src] = epoch
+            pair = (src, dst)
+            pair_bytes[pair] = pair_bytes.get(pair, 0) + size
+            if flags is not None:
+                opens = flags & 0x12 == 0x02  # SYN sin ACK
+            else:
+                opens = dport is None or sport is None or dport < sport
+            if opens:
+                if dport is not None:
+                    ports.setdefault(src, set()).add(dport)
+                hosts.setdefault(src, set()).add(dst)
+
+        # 2) estado por origen y sketch de bytes
+        batch_ts = max(last_ts.values())
+        self._roll_bytes(batch_ts)
+        source_score: Dict[str, Verdict] = {}
+        for src, count in counts.items():
+            ts = last_ts[src]
+            state, rolled = self._state(src, ts)
+            src_ports = ports.get(src)
+            if src_ports or rolled:
+                for port in src_ports or ():
+                    state.ports.add(hash64(port))
+                state.n_ports = state.ports.estimate(state.prev_ports)
+            src_hosts = hosts.get(src)
+            if src_hosts or rolled:
+                for dst in src_hosts or ():
+                    if is_internal(dst):
+                        state.hosts.add(hash64(dst))
+                state.n_hosts = state.hosts.estimate(state.prev_hosts)
+            state.fast.add(ts, count)
+            state.slow.add(ts, count)
+
+            burst = state.burst()
+            candidates = [
+                (state.n_ports / self.scan_ports, "T1046"),
+                (state.n_hosts / self.scan_hosts, "T1018"),
+                ((burst - 1.0) / (self.burst_ratio - 1.0), None),
+            ]
+            ratio, technique = max(candidates, key=lambda c: c[0])
+            source_score[src] = (ratio, technique if ratio >= 1.0 else None)
+
+        weight = 1.0 - (batch_ts - self._bytes_start) / self.window if self._bytes_start is not None else 0.0
+        pair_score: Dict[Tuple[str, str], float] = {}
+        for (src, dst), size in pair_bytes.items():
+            if not (is_internal(src) and is_public(dst)):
+                continue
+            h = hash64((src, dst))
+            self._bytes.add(h, size)
+            total = self._bytes.query(h) + max(0.0, weight) * self._prev_bytes.query(h)
+            pair_score[(src, dst)] = total / self.exfil_bytes
+
+        # 3) veredicto por paquete
+        by_pair: Dict[Tuple[str, str], Verdict] = {}
+        verdicts: List[Verdict] = []
+        for _, src, _, dst, _, _, _, _ in packets:
+            verdict = by_pair.get((src, dst))
+            if verdict is None:
+                ratio, technique = source_score[src]
+                exfil = pair_score.get((src, dst))
+                if exfil is not None and exfil > ratio:
+                    ratio, technique = exfil, "T1041" if exfil >= 1.0 else None
+                verdict = by_pair[(src, dst)] = (round(min(1.0, max(0.0, ratio)), 3), technique)
+            if verdict[1] is not None:
+                self.flagged[verdict[1]] = self.flagged.get(verdict[1], 0) + 1
+            verdicts.append(verdict)
+        return verdicts
+
+    def nbytes(self) -> int:
+        """Memoria aproximada de las estructuras (sin contar objetos de Python)."""
+        per_source = 4 * (1 << self.p)
+        sketch = 2 * self._bytes.depth * self._bytes.width * 8
+        return len(self._sources) * per_source + sketch
@@ -0,0 +1,187 @@
+"""
+Embeddings de paquetes para ``network_packet_embeddings`` (pasos 4 y 5 de
+``supa-influx.md``).
+
+- ``text_content`` se construye con campos estables del paquete (sin
+  timestamp ni frame.number, puertos efímeros agrupados y tamaño por tramos),
+  así el tráfico repetido produce exactamente el mismo texto.
+- ``EmbeddingCache`` evita recalcular: LRU en memoria + caché SQLite en disco,
+  ambos indexados por SHA-1 del texto y del modelo.
+- Los embedders son intercambiables: ``HashingEmbedder`` (sin dependencias,
+  feature hashing a 384 dimensiones) o ``SentenceTransformerEmbedder`` si está
+  instalado ``sentence-transformers``.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import sqlite3
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+DIMENSIONS = 384
+EPHEMERAL_PORT_MIN = 32768
+PAYLOAD_CHARS = 64
+
+TCP_FLAG_NAMES = ((0x002, "SYN"), (0x010, "ACK"), (0x008, "PSH"), (0x001, "FIN"), (0x004, "RST"), (0x020, "URG"))
+
+
+def _port_token(port: Optional[int]) -> str:
+    if port is None:
+        return "none"
+    return "ephemeral" if port >= EPHEMERAL_PORT_MIN else str(port)
+
+
+def _size_bucket(size: int) -> str:
+    if size <= 0:
+        return "0"
+    low = 1 << (size.bit_length() - 1)
+    return f"{low}-{low * 2 - 1}"
+
+
+def text_content(
+    protocol: str,
+    src_ip: str,
+    src_port: Optional[int],
+    dst_ip: str,
+    dst_port: Optional[int],
+    size: int,
+    tcp_flags: Optional[int] = None,
+    payload: Optional[str] = None,
+) -> str:
+    parts = [
+        f"protocol {protocol}",
+        f"src {src_ip} port {_port_token(src_port)}",
+        f"dst {dst_ip} port {_port_token(dst_port)}",
+        f"size {_size_bucket(size)}",
+    ]
+    if tcp_flags is not None:
+        parts.append("flags " + (" ".join(name for bit, name in TCP_FLAG_NAMES if tcp_flags & bit) or "none"))
+    if payload:
+        parts.append(f"payload {payload[:PAYLOAD_CHARS]}")
+    return " | ".join(parts)
+
+
+class HashingEmbedder:
+    """Feature hashing de tokens y trigramas; determinista y rápido en CPU."""
+
+    name = "hashing-v1"
+
+    def __init__(self, dimensions: int = DIMENSIONS) -> None:
+        self.dimensions = dimensions
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        return [self._embed_one(text) for text in texts]
+
+    def _embed_one(self, text: str) -> List[float]:
+        vec = [0.0] * self.dimensions
+        lowered = text.lower()
+        features = lowered.split()
+        features.extend(lowered[i:i + 3] for i in range(len(lowered) - 2))
+        for feature in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vec[h % self.dimensions] += 1.0 if h & 0x80000000 else -1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+
+class SentenceTransformerEmbedder:
+    """Modelo local de sentence-transformers (384-d con all-MiniLM-L6-v2)."""
+
+    def __init__(self, model: str, batch_size: int = 64) -> None:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as exc:
+            raise RuntimeError(
+                "Falta dependencia 'sentence-transformers'. Instala con: pip install sentence-transformers"
+            ) from exc
+        self.name = model
+        self.batch_size = batch_size
+        self._model = SentenceTransformer(model, device="cpu")
+        self.dimensions = self._model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        vectors = self._model.encode(list(texts), batch_size=self.batch_size, normalize_embeddings=True)
+        return [v.tolist() for v in vectors]
+
+
+def build_embedder(kind: str, model: str) -> object:
+    if kind == "sentence-transformers":
+        return SentenceTransformerEmbedder(model)
+    return HashingEmbedder()
+
+
+class EmbeddingCache:
+    """LRU en memoria delante de una caché SQLite opcional (vectores float32)."""
+
+    def __init__(self, max_entries: int, path: Optional[Path] = None) -> None:
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("pragma journal_mode=wal")
+            self._db.execute("create table if not exists embeddings (key text primary key, vector blob not null)")
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return hashlib.sha1(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        missing: List[str] = []
+        with self._lock:
+            for key in keys:
+                vec = self._memory.get(key)
+                if vec is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vec
+                else:
+                    missing.append(key)
+            if missing and self._db is not None:
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    marks = ",".join("?" * len(chunk))
+                    for key, blob in self._db.execute(f"select key, vector from embeddings where key in ({marks})", chunk):
+                        vec = array("f", blob).tolist()
+                        found[key] = vec
+                        self._remember(key, vec)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        with self._lock:
+            for key, vec in items.items():
+                self._remember(key, vec)
+            if self._db is not None and items:
+                self._db.executemany(
+                    "insert or replace into embeddings (key, vector) values (?, ?)",
+                    [(key, array("f", vec).tobytes()) for key, vec in items.items()],
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, vec: List[float]) -> None:
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def vector_literal(vec: Sequence[float]) -> str:
+    """Formato de entrada de pgvector (``'[v1,v2,...]'``)."""
+    return "[" + ",".join(f"{v:.6g}" for v in vec) + "]"
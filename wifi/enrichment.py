@@ -0,0 +1,211 @@
+"""
+Enriquecimiento de IPs con el DHCP de dnsmasq y la topología del AP.
+
+- ``LeaseTable``: IP -> (MAC, hostname, expiración) leída del fichero de leases
+  de dnsmasq (``<expira> <mac> <ip> <hostname|*> <client-id|*>`` por línea).
+  Se relee sólo si cambió (mtime/tamaño/inodo) y devuelve qué IPs cambiaron,
+  para invalidar únicamente esas entradas de la caché.
+- ``PrefixTrie``: trie binario de prefijos (IPv4 e IPv6) con el rol de cada
+  rango: ``gateway`` (IP del AP), ``ap_client`` (subred del AP), ``private``
+  (RFC 1918, ULA, link-local, CGNAT...), ``multicast``, ``broadcast`` y, si
+  nada coincide, ``public``.
+- ``Enricher``: une ambos detrás de una LRU por IP; un lease caducado antes
+  del paquete no se aplica (su IP puede ser ya de otro cliente). La dirección del paquete
+  (``out``/``in``/``local``/``transit``) sale de los roles de origen y destino
+  vistos desde el AP; multicast y broadcast (mDNS, SSDP, DHCP) no salen del
+  enlace y cuentan como ``local``.
+"""
+
+from __future__ import annotations
+
+import ipaddress
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+
+DEFAULT_LEASES = Path("/var/lib/misc/dnsmasq.leases")
+PRIVATE_PREFIXES = (
+    "10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16", "100.64.0.0/10", "169.254.0.0/16", "127.0.0.0/8",
+    "fc00::/7", "fe80::/10", "::1/128", "0.0.0.0/8", "::/128",
+)
+MULTICAST_PREFIXES = ("224.0.0.0/4", "ff00::/8")
+AP_SIDE = ("gateway", "ap_client")
+LINK_SCOPE = ("multicast", "broadcast")
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+class Lease(NamedTuple):
+    mac: str
+    hostname: Optional[str]
+    expires: int  # epoch; 0 = sin caducidad
+
+
+class LeaseTable:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.leases: Dict[str, Lease] = {}
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        self._warned = False
+
+    def refresh(self) -> Set[str]:
+        """Relee el fichero si cambió; devuelve las IPs añadidas, cambiadas o quitadas."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            stamp = None
+        else:
+            stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if stamp == self._stamp:
+            return set()
+        self._stamp = stamp
+
+        leases: Dict[str, Lease] = {}
+        if stamp is not None:
+            try:
+                text = self.path.read_text(encoding="utf-8", errors="replace")
+            except OSError as exc:
+                if not self._warned:
+                    print(f"[WARN] No se pudo leer {self.path}: {exc}")
+                    self._warned = True
+                return set()
+            for line in text.splitlines():
+                parts = line.split()
+                if len(parts) < 4 or not parts[0].isdigit():
+                    continue  # p. ej. la línea "duid" de DHCPv6
+                expires, mac, ip, hostname = parts[:4]
+                leases[ip] = Lease(mac.lower(), None if hostname == "*" else hostname, int(expires))
+
+        changed = {ip for ip in leases.keys() | self.leases.keys() if leases.get(ip) != self.leases.get(ip)}
+        self.leases = leases
+        return changed
+
+    def get(self, ip: str) -> Optional[Lease]:
+        return self.leases.get(ip)
+
+
+class PrefixTrie:
+    """Búsqueda del prefijo más largo bit a bit; un trie por versión de IP."""
+
+    def __init__(self) -> None:
+        # Nodo = [hijo0, hijo1, valor]
+        self._roots: Dict[int, List[Any]] = {4: [None, None, None], 6: [None, None, None]}
+
+    def insert(self, prefix: Union[str, Network], value: Any) -> None:
+        net = ipaddress.ip_network(prefix, strict=False)
+        bits = int(net.network_address)
+        width = net.max_prefixlen
+        node = self._roots[net.version]
+        for i in range(net.prefixlen):
+            bit = (bits >> (width - 1 - i)) & 1
+            child = node[bit]
+            if child is None:
+                child = node[bit] = [None, None, None]
+            node = child
+        node[2] = value
+
+    def lookup(self, ip: str) -> Any:
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        bits = int(addr)
+        width = addr.max_prefixlen
+        node: Optional[List[Any]] = self._roots[addr.version]
+        best = None
+        i = 0
+        while node is not None:
+            if node[2] is not None:
+                best = node[2]
+            if i == width:
+                break
+            node = node[(bits >> (width - 1 - i)) & 1]
+            i += 1
+        return best
+
+
+def build_trie(ap_ip: str) -> PrefixTrie:
+    """Roles de red vistos desde el AP (``ap_ip`` en CIDR, como en setting-ap.py)."""
+    trie = PrefixTrie()
+    for prefix in PRIVATE_PREFIXES:
+        trie.insert(prefix, "private")
+    for prefix in MULTICAST_PREFIXES:
+        trie.insert(prefix, "multicast")
+    trie.insert("255.255.255.255/32", "broadcast")
+    iface = ipaddress.ip_interface(ap_ip)
+    trie.insert(iface.network, "ap_client")
+    trie.insert(iface.ip.exploded + ("/32" if iface.version == 4 else "/128"), "gateway")
+    if iface.version == 4 and iface.network.prefixlen < 31:
+        trie.insert(f"{iface.network.broadcast_address}/32", "broadcast")
+    return trie
+
+
+def live_lease(lease: Optional[Lease], epoch: Optional[int]) -> Optional[Lease]:
+    """``lease`` si seguía vigente en ``epoch`` (segundos); 0 = sin caducidad."""
+    if lease is None or epoch is None or not lease.expires or lease.expires >= epoch:
+        return lease
+    return None
+
+
+def direction(src_role: str, dst_role: str) -> str:
+    if src_role in LINK_SCOPE or dst_role in LINK_SCOPE:
+        return "local"
+    src_ap = src_role in AP_SIDE
+    dst_ap = dst_role in AP_SIDE
+    if src_ap and dst_ap:
+        return "local"
+    if src_ap:
+        return "out"
+    if dst_ap:
+        return "in"
+    return "transit"
+
+
+class Enricher:
+    """Campos de ``metadata`` por par (src, dst) con coste O(1) amortizado."""
+
+    def __init__(self, leases: LeaseTable, trie: PrefixTrie, cache_size: int = 65536) -> None:
+        self.leases = leases
+        self.trie = trie
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Tuple[str, Optional[Lease]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def refresh(self) -> int:
+        """Aplica cambios del fichero de leases; devuelve cuántas IPs cambiaron."""
+        changed = self.leases.refresh()
+        for ip in changed:
+            self._cache.pop(ip, None)
+        return len(changed)
+
+    def ip_info(self, ip: str) -> Tuple[str, Optional[Lease]]:
+        info = self._cache.get(ip)
+        if info is not None:
+            self._cache.move_to_end(ip)
+            self.hits += 1
+            return info
+        self.misses += 1
+        info = (self.trie.lookup(ip) or "public", self.leases.get(ip))
+        self._cache[ip] = info
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return info
+
+    def fields(self, src_ip: str, dst_ip: str, epoch: Optional[int] = None) -> Dict[str, Any]:
+        """Roles, dirección y lease de cada extremo vigente en ``epoch`` (sin él, el actual)."""
+        src_role, src_lease = self.ip_info(src_ip)
+        dst_role, dst_lease = self.ip_info(dst_ip)
+        src_lease = live_lease(src_lease, epoch)
+        dst_lease = live_lease(dst_lease, epoch)
+        out: Dict[str, Any] = {"src_role": src_role, "dst_role": dst_role, "direction": direction(src_role, dst_role)}
+        if src_lease is not None:
+            out["src_mac"] = src_lease.mac
+            out["src_hostname"] = src_lease.hostname
+            out["src_lease_expires"] = src_lease.expires
+        if dst_lease is not None:
+            out["dst_mac"] = dst_lease.mac
+            out["dst_hostname"] = dst_lease.hostname
+            out["dst_lease_expires"] = dst_lease.expires
+        return out
@@ -0,0 +1,170 @@
+"""
+Agregación de paquetes en flujos bidireccionales (5-tupla).
+
+Cada flujo se identifica por la 5-tupla canónica (extremos ordenados +
+protocolo de transporte), así que ambos sentidos caen en la misma entrada. El
+sentido "fwd" es el de quien envió el primer paquete.
+
+Un flujo se emite (como fila para ``network_flows``) cuando:
+- lleva ``idle_timeout`` segundos sin paquetes (``end_reason = idle``),
+- supera ``active_timeout`` desde su inicio (``active``; el siguiente paquete
+  abre un flujo nuevo),
+- la tabla llega a ``max_flows`` y es el menos reciente (``evicted``),
+- o termina la ingesta (``flush``).
+
+Los tiempos son los de los paquetes (no el reloj), así que funciona igual en
+modo file que en live.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+TCP_FLAG_LETTERS = ((0x002, "S"), (0x010, "A"), (0x008, "P"), (0x001, "F"), (0x004, "R"), (0x020, "U"), (0x040, "E"), (0x080, "C"))
+TRANSPORTS = ("TCP", "UDP", "ICMP", "ICMPv6", "IGMP", "SCTP", "GRE", "ESP")
+
+Endpoint = Tuple[str, Optional[int]]
+FlowKey = Tuple[Endpoint, Endpoint, str]
+
+
+def flags_to_str(flags: int) -> str:
+    return "".join(letter for bit, letter in TCP_FLAG_LETTERS if flags & bit)
+
+
+def transport_of(protocol: str, src_port: Optional[int], tcp_flags: Optional[int]) -> str:
+    """Protocolo de transporte para la clave (la columna de tshark varía: TCP, TLSv1.3, HTTP...)."""
+    if tcp_flags is not None:
+        return "TCP"
+    if protocol in TRANSPORTS:
+        return protocol
+    return "UDP" if src_port is not None else protocol
+
+
+class Flow:
+    __slots__ = (
+        "src", "dst", "protocol", "app_protocol", "first_ts", "last_ts",
+        "packets_fwd", "bytes_fwd", "packets_rev", "bytes_rev", "flags_fwd", "flags_rev",
+    )
+
+    def __init__(self, src: Endpoint, dst: Endpoint, protocol: str, ts: float) -> None:
+        self.src = src
+        self.dst = dst
+        self.protocol = protocol
+        self.app_protocol: Optional[str] = None
+        self.first_ts = ts
+        self.last_ts = ts
+        self.packets_fwd = self.bytes_fwd = self.packets_rev = self.bytes_rev = 0
+        self.flags_fwd = self.flags_rev = 0
+
+
+class FlowTable:
+    """Tabla de flujos acotada en memoria, con expiración idle/active y LRU."""
+
+    def __init__(
+        self,
+        idle_timeout: float,
+        active_timeout: float,
+        max_flows: int,
+        format_ts: Callable[[float], str],
+        source: str,
+    ) -> None:
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.max_flows = max_flows
+        self._format_ts = format_ts
+        self.source = source
+        # Orden = último paquete visto: el primero es siempre el más inactivo
+        self._flows: "OrderedDict[FlowKey, Flow]" = OrderedDict()
+        self._expired: List[Dict[str, Any]] = []
+        self._clock = 0.0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._flows)
+
+    def add(
+        self,
+        ts: float,
+        src_ip: str,
+        src_port: Optional[int],
+        dst_ip: str,
+        dst_port: Optional[int],
+        protocol: str,
+        size: int,
+        tcp_flags: Optional[int],
+    ) -> None:
+        transport = transport_of(protocol, src_port, tcp_flags)
+        a: Endpoint = (src_ip, src_port)
+        b: Endpoint = (dst_ip, dst_port)
+        key: FlowKey = (a, b, transport) if (src_ip, src_port or 0) <= (dst_ip, dst_port or 0) else (b, a, transport)
+
+        if ts > self._clock:
+            self._clock = ts
+        flow = self._flows.get(key)
+        if flow is not None and ts - flow.first_ts >= self.active_timeout:
+            self._emit(self._flows.pop(key), "active")
+            flow = None
+        if flow is None:
+            flow = Flow(a, b, transport, ts)
+            self._flows[key] = flow
+            if len(self._flows) > self.max_flows:
+                _, oldest = self._flows.popitem(last=False)
+                self.evicted += 1
+                self._emit(oldest, "evicted")
+        else:
+            self._flows.move_to_end(key)
+
+        if ts > flow.last_ts:
+            flow.last_ts = ts
+        if protocol != transport:
+            flow.app_protocol = protocol
+        if a == flow.src:
+            flow.packets_fwd += 1
+            flow.bytes_fwd += size
+            flow.flags_fwd |= tcp_flags or 0
+        else:
+            flow.packets_rev += 1
+            flow.bytes_rev += size
+            flow.flags_rev |= tcp_flags or 0
+
+    def expire(self) -> None:
+        """Emite los flujos inactivos respecto al paquete más reciente visto."""
+        deadline = self._clock - self.idle_timeout
+        while self._flows:
+            key, flow = next(iter(self._flows.items()))
+            if flow.last_ts > deadline:
+                break
+            del self._flows[key]
+            self._emit(flow, "idle")
+
+    def flush(self) -> None:
+        while self._flows:
+            _, flow = self._flows.popitem(last=False)
+            self._emit(flow, "flush")
+
+    def drain(self) -> List[Dict[str, Any]]:
+        """Devuelve (y olvida) las filas de flujos ya cerrados."""
+        out, self._expired = self._expired, []
+        return out
+
+    def _emit(self, flow: Flow, reason: str) -> None:
+        self._expired.append({
+            "flow_start": self._format_ts(flow.first_ts),
+            "flow_end": self._format_ts(flow.last_ts),
+            "src_ip": flow.src[0],
+            "src_port": flow.src[1],
+            "dst_ip": flow.dst[0],
+            "dst_port": flow.dst[1],
+            "protocol": flow.protocol,
+            "app_protocol": flow.app_protocol,
+            "packets_fwd": flow.packets_fwd,
+            "bytes_fwd": flow.bytes_fwd,
+            "packets_rev": flow.packets_rev,
+            "bytes_rev": flow.bytes_rev,
+            "tcp_flags_fwd": flags_to_str(flow.flags_fwd) if flow.protocol == "TCP" else None,
+            "tcp_flags_rev": flags_to_str(flow.flags_rev) if flow.protocol == "TCP" else None,
+            "duration_sec": round(flow.last_ts - flow.first_ts, 6),
+            "end_reason": reason,
+            "metadata": {"source": self.source},
+        })
@@ -0,0 +1,147 @@
+"""
+Top talkers con memoria fija (Space-Saving ponderado por bytes).
+
+Por cada dimensión (``src_ip``, ``dst_ip``, ``dst_port``, ``protocol``) se
+guardan como mucho ``capacity`` contadores. Una clave nueva con la tabla llena
+sustituye a la de menos bytes y hereda su cuenta como error máximo, así que
+cualquier clave con más de ``total / capacity`` bytes está seguro en la tabla
+y su cuenta sobreestima como mucho en ``error``.
+
+Cada ``interval`` segundos (tiempo de los paquetes, igual que las ventanas de
+Influx) se emite una fila por dimensión con el top-K del intervalo y se
+reinician los contadores: consultar "quién usa el ancho de banda" es leer K
+elementos, no agrupar ``network_packets`` entera.
+"""
+
+from __future__ import annotations
+
+import heapq
+import math
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+DIMENSIONS = ("src_ip", "dst_ip", "dst_port", "protocol")
+
+Packet = Tuple[float, str, Optional[int], str, Optional[int], str, int, Optional[int]]
+
+
+class SpaceSaving:
+    """Heavy hitters por bytes; también cuenta paquetes (sin garantía de error)."""
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        # clave -> [bytes, error, paquetes]
+        self.counters: Dict[Any, List[int]] = {}
+        # (bytes, clave) con entradas obsoletas: se validan al sacar el mínimo
+        self._heap: List[Tuple[int, Any]] = []
+        self.total_bytes = 0
+        self.total_packets = 0
+
+    def add(self, key: Any, size: int, packets: int = 1) -> None:
+        self.total_bytes += size
+        self.total_packets += packets
+        counter = self.counters.get(key)
+        if counter is None:
+            error = 0
+            if len(self.counters) >= self.capacity:
+                error = self._evict()
+            counter = self.counters[key] = [error, error, 0]
+        counter[0] += size
+        counter[2] += packets
+        heapq.heappush(self._heap, (counter[0], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(c[0], k) for k, c in self.counters.items()]
+            heapq.heapify(self._heap)
+
+    def _evict(self) -> int:
+        while True:
+            count, key = heapq.heappop(self._heap)
+            counter = self.counters.get(key)
+            if counter is not None and counter[0] == count:
+                del self.counters[key]
+                return count
+
+    def top(self, k: int) -> List[Dict[str, Any]]:
+        ranked = heapq.nlargest(k, self.counters.items(), key=lambda item: item[1][0])
+        return [
+            {"key": key, "bytes": c[0], "packets": c[2], "error_bytes": c[1]}
+            for key, c in ranked
+        ]
+
+    def clear(self) -> None:
+        self.counters.clear()
+        self._heap.clear()
+        self.total_bytes = self.total_packets = 0
+
+
+class TopTalkers:
+    """Resúmenes por dimensión en intervalos fijos; ``drain()`` entrega las filas cerradas."""
+
+    def __init__(
+        self,
+        k: int,
+        interval: float,
+        format_ts: Callable[[float], str],
+        sensor_id: str = "",
+        capacity: Optional[int] = None,
+    ) -> None:
+        self.k = k
+        self.interval = interval
+        self.sensor_id = sensor_id
+        self._format_ts = format_ts
+        self.summaries = {dim: SpaceSaving(capacity or 10 * k) for dim in DIMENSIONS}
+        self._start: Optional[float] = None
+        self._ready: List[Dict[str, Any]] = []
+
+    def add_batch(self, packets: Iterable[Packet]) -> None:
+        # Se agrega primero por lote: una actualización por clave, no por paquete
+        pending: Dict[str, Dict[Any, List[int]]] = {dim: {} for dim in DIMENSIONS}
+        for epoch, src_ip, _, dst_ip, dst_port, protocol, size, _ in packets:
+            if self._start is None:
+                self._start = math.floor(epoch / self.interval) * self.interval
+            elif epoch >= self._start + self.interval:
+                self._merge(pending)
+                pending = {dim: {} for dim in DIMENSIONS}
+                self._close(epoch)
+            for dim, key in (("src_ip", src_ip), ("dst_ip", dst_ip), ("dst_port", dst_port), ("protocol", protocol)):
+                if key is None:
+                    continue
+                acc = pending[dim].get(key)
+                if acc is None:
+                    pending[dim][key] = [size, 1]
+                else:
+                    acc[0] += size
+                    acc[1] += 1
+        self._merge(pending)
+
+    def _merge(self, pending: Dict[str, Dict[Any, List[int]]]) -> None:
+        for dim, keys in pending.items():
+            add = self.summaries[dim].add
+            for key, (size, packets) in keys.items():
+                add(key, size, packets)
+
+    def _close(self, epoch: Optional[float] = None) -> None:
+        assert self._start is not None
+        end = self._start + self.interval
+        for dim, summary in self.summaries.items():
+            if not summary.total_packets:
+                continue
+            self._ready.append({
+                "window_start": self._format_ts(self._start),
+                "window_end": self._format_ts(end),
+                "sensor_id": self.sensor_id,
+                "dimension": dim,
+                "total_bytes": summary.total_bytes,
+                "total_packets": summary.total_packets,
+                "items": summary.top(self.k),
+            })
+            summary.clear()
+        # Intervalos sin tráfico no generan filas
+        self._start = end if epoch is None else math.floor(epoch / self.interval) * self.interval
+
+    def flush(self) -> None:
+        if self._start is not None:
+            self._close()
+
+    def drain(self) -> List[Dict[str, Any]]:
+        ready, self._ready = self._ready, []
+        return ready
@@ -0,0 +1,168 @@
+"""
+Métricas por ventana (``net_window_metrics``) hacia InfluxDB v2.
+
+Se alimenta del mismo flujo de paquetes que la ingesta a Supabase y agrega en
+memoria ventanas fijas (por defecto 5 s y 30 s) por protocolo:
+
+- fields: ``packets``, ``bytes``, ``flows`` (5-tuplas distintas),
+  ``malicious_count``, ``dns_nx`` (respuestas NXDOMAIN, rcode 3) y
+  ``anomaly_score`` (máximo de la ventana, sólo si alguna fila lo trae)
+- tags: ``sensor_id``, ``iface``, ``protocol`` y ``window`` (``5s``, ``30s``)
+
+El tiempo es el de los paquetes. La marca de agua es el paquete más reciente
+menos ``allowed_lateness``: una ventana se cierra (y se escribe) cuando su fin
+queda por detrás de la marca; lo que llegue después para una ventana ya
+escrita se cuenta en ``late`` y se descarta.
+
+La escritura usa line protocol comprimido con gzip contra ``/api/v2/write``.
+"""
+
+from __future__ import annotations
+
+import gzip
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+MEASUREMENT = "net_window_metrics"
+DNS_NXDOMAIN = 3
+
+FlowKey = Tuple[Tuple[str, int], Tuple[str, int]]
+
+
+def escape_tag(value: str) -> str:
+    """Escapa comas, espacios e iguales en claves/valores de tag."""
+    return value.replace("\\", "\\\\").replace(",", "\\,").replace(" ", "\\ ").replace("=", "\\=")
+
+
+class _Window:
+    __slots__ = ("packets", "bytes", "flows", "malicious", "dns_nx", "anomaly")
+
+    def __init__(self) -> None:
+        self.packets = 0
+        self.bytes = 0
+        self.flows: set = set()
+        self.malicious = 0
+        self.dns_nx = 0
+        self.anomaly: Optional[float] = None
+
+
+class WindowAggregator:
+    """Ventanas fijas por protocolo con marca de agua sobre el tiempo de los paquetes."""
+
+    def __init__(
+        self,
+        widths: Sequence[int],
+        allowed_lateness: float,
+        sensor_id: str,
+        iface: str,
+    ) -> None:
+        self.widths = tuple(widths)
+        self.allowed_lateness = allowed_lateness
+        self._tag_prefix = f"{MEASUREMENT},iface={escape_tag(iface)}"
+        self._sensor_tag = f"sensor_id={escape_tag(sensor_id)}"
+        # ancho -> inicio de ventana -> protocolo -> acumulado
+        self._open: Dict[int, Dict[int, Dict[str, _Window]]] = {w: {} for w in self.widths}
+        self._emitted_until: Dict[int, int] = {w: 0 for w in self.widths}
+        self._watermark = float("-inf")
+        self.late = 0
+
+    def add(
+        self,
+        ts: float,
+        protocol: str,
+        size: int,
+        src: Tuple[str, Optional[int]],
+        dst: Tuple[str, Optional[int]],
+        malicious: bool = False,
+        dns_rcode: Optional[int] = None,
+        anomaly_score: Optional[float] = None,
+    ) -> None:
+        watermark = ts - self.allowed_lateness
+        if watermark > self._watermark:
+            self._watermark = watermark
+        a = (src[0], src[1] or 0)
+        b = (dst[0], dst[1] or 0)
+        flow: FlowKey = (a, b) if a <= b else (b, a)
+
+        for width in self.widths:
+            start = int(ts // width) * width
+            if start < self._emitted_until[width]:
+                self.late += 1
+                continue
+            by_proto = self._open[width].get(start)
+            if by_proto is None:
+                by_proto = self._open[width][start] = {}
+            window = by_proto.get(protocol)
+            if window is None:
+                window = by_proto[protocol] = _Window()
+            window.packets += 1
+            window.bytes += size
+            window.flows.add(flow)
+            if malicious:
+                window.malicious += 1
+            if dns_rcode == DNS_NXDOMAIN:
+                window.dns_nx += 1
+            if anomaly_score is not None and (window.anomaly is None or anomaly_score > window.anomaly):
+                window.anomaly = anomaly_score
+
+    def close_ready(self) -> List[str]:
+        """Cierra las ventanas que ya quedaron por detrás de la marca de agua."""
+        return self._close(lambda start, width: start + width <= self._watermark)
+
+    def flush(self) -> List[str]:
+        return self._close(lambda start, width: True)
+
+    def _close(self, ready: Any) -> List[str]:
+        lines: List[str] = []
+        for width, starts in self._open.items():
+            for start in sorted(starts):
+                if not ready(start, width):
+                    break
+                for protocol, window in starts.pop(start).items():
+                    lines.append(self._line(width, start, protocol, window))
+                self._emitted_until[width] = max(self._emitted_until[width], start + width)
+        return lines
+
+    def _line(self, width: int, start: int, protocol: str, window: _Window) -> str:
+        fields = (
+            f"packets={window.packets}i,bytes={window.bytes}i,flows={len(window.flows)}i,"
+            f"malicious_count={window.malicious}i,dns_nx={window.dns_nx}i"
+        )
+        if window.anomaly is not None:
+            fields += f",anomaly_score={float(window.anomaly)!r}"
+        return (
+            f"{self._tag_prefix},protocol={escape_tag(protocol)},{self._sensor_tag},window={width}s "
+            f"{fields} {start}"
+        )
+
+
+class InfluxWriter:
+    """Cliente mínimo de la API de escritura de InfluxDB v2 (precisión en segundos)."""
+
+    def __init__(self, url: str, token: str, org: str, bucket: str, timeout: float = 10.0) -> None:
+        self.url = f"{url.rstrip('/')}/api/v2/write"
+        self.params = {"org": org, "bucket": bucket, "precision": "s"}
+        self.headers = {
+            "Authorization": f"Token {token}",
+            "Content-Type": "text/plain; charset=utf-8",
+            "Content-Encoding": "gzip",
+        }
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls) -> Optional["InfluxWriter"]:
+        """INFLUX_URL, INFLUX_TOKEN, INFLUX_ORG, INFLUX_BUCKET; None si falta alguna."""
+        values = [os.getenv(name) for name in ("INFLUX_URL", "INFLUX_TOKEN", "INFLUX_ORG", "INFLUX_BUCKET")]
+        if not all(values):
+            return None
+        url, token, org, bucket = values
+        return cls(url, token, org, bucket)
+
+    def write(self, session: Any, lines: List[str]) -> None:
+        if not lines:
+            return
+        body = gzip.compress("\n".join(lines).encode("utf-8"), compresslevel=5)
+        resp = session.post(self.url, params=self.params, headers=self.headers, data=body, timeout=self.timeout)
+        if resp.status_code >= 300:
+            print(f"[ERROR] InfluxDB write {resp.status_code}: {resp.text[:500]}")
+            raise RuntimeError("Error escribiendo en InfluxDB")
@@ -0,0 +1,131 @@
+"""
+Lectura incremental de exportaciones JSON de Supabase (``network_packets_rows.json``).
+
+Una exportación es un único array JSON; con ``json.load`` ocupa varias veces
+su tamaño en RAM. ``iter_array`` lee el fichero por bloques y decodifica un
+elemento cada vez con ``JSONDecoder.raw_decode``, así que la memoria depende
+del tamaño de una fila, no del fichero.
+
+En la exportación ``metadata`` viene como texto JSON. ``ExportRow`` lo guarda
+tal cual (``RawJSON``) y sólo lo decodifica al acceder a ``row["metadata"]``;
+al enviar a PostgREST, ``to_json`` lo incrusta sin decodificarlo.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, TextIO
+
+_WHITESPACE = " \t\n\r"
+_NON_WS = re.compile(r"[^ \t\n\r]")
+
+
+class RawJSON(str):
+    """Texto JSON aún sin decodificar."""
+
+
+class ExportRow(dict):
+    """Fila de la exportación con ``metadata`` decodificado bajo demanda."""
+
+    def __getitem__(self, key: str) -> Any:
+        value = dict.__getitem__(self, key)
+        if type(value) is RawJSON:
+            value = json.loads(value)
+            self[key] = value
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    def to_json(self) -> str:
+        raw = {k: v for k, v in self.items() if type(v) is RawJSON}
+        if not raw:
+            return json.dumps(self)
+        rest = json.dumps({k: v for k, v in self.items() if k not in raw})
+        spliced = ", ".join(f"{json.dumps(k)}: {v}" for k, v in raw.items())
+        return rest[:-1] + (", " if len(rest) > 2 else "") + spliced + "}"
+
+
+def encode_rows(rows: Iterable[Dict[str, Any]]) -> str:
+    return "[" + ", ".join(row.to_json() if isinstance(row, ExportRow) else json.dumps(row) for row in rows) + "]"
+
+
+def iter_array(fh: TextIO, chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """Elementos de un array JSON de nivel superior, uno a uno."""
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        chunk = fh.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    def skip_ws() -> None:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf) or not fill():
+                return
+
+    skip_ws()
+    if pos >= len(buf) or buf[pos] != "[":
+        raise ValueError("se esperaba un array JSON")
+    pos += 1
+    skip_ws()
+    if pos < len(buf) and buf[pos] == "]":
+        return
+    while True:
+        skip_ws()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof or not fill():
+                    raise
+                continue
+            if isinstance(value, (dict, list, str)) or eof:
+                break
+            # Un número puede estar cortado ("-2." de "-2.5"): sólo vale si
+            # detrás ya hay un separador o espacio
+            after = _NON_WS.search(buf, end)
+            if after is not None and (after.start() > end or buf[end] in ",]"):
+                break
+            if not fill():
+                break
+        pos = end
+        yield value
+        skip_ws()
+        if pos >= len(buf):
+            raise ValueError("array JSON sin cerrar")
+        if buf[pos] == "]":
+            return
+        if buf[pos] != ",":
+            raise ValueError(f"se esperaba ',' o ']' y hay {buf[pos]!r}")
+        pos += 1
+
+
+def iter_export(path: Path, exclude: Iterable[str] = (), chunk_size: int = 1 << 20) -> Iterator[ExportRow]:
+    """Filas de una exportación de ``network_packets``; ``exclude`` quita columnas (p. ej. ``idx``)."""
+    drop = tuple(exclude)
+    with path.open("r", encoding="utf-8") as fh:
+        for item in iter_array(fh, chunk_size):
+            if not isinstance(item, dict):
+                raise ValueError("la exportación debe ser un array de objetos")
+            row = ExportRow(item)
+            for key in drop:
+                row.pop(key, None)
+            meta = dict.get(row, "metadata")
+            if isinstance(meta, str):
+                row["metadata"] = RawJSON(meta)
+            yield row
+
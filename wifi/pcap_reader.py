@@ -0,0 +1,490 @@
+"""
+Lector nativo de pcap/pcapng (mmap + struct) para los campos básicos.
+
+Evita la disección completa de tshark cuando sólo se necesitan timestamp,
+IPs, puertos, protocolo de transporte, flags TCP, longitud y número de frame.
+
+Soporta:
+- pcap clásico (µs y ns, ambos endian) y pcapng (SHB/IDB/EPB/SPB/PB)
+- enlaces Ethernet (con VLAN), 802.11 (+radiotap) con LLC/SNAP, Linux SLL/SLL2,
+  raw IP y loopback BSD
+- IPv4/IPv6 (con cabeceras de extensión) y TCP/UDP
+
+La columna de protocolo es la de transporte (TCP, UDP, ICMP...); para la
+columna ``_ws.col.Protocol`` de tshark usar ``iter_tshark_protocols``. A
+diferencia del comando de tshark del ingestor (sólo ``ip.src``/``ip.dst``),
+aquí también se emiten paquetes IPv6.
+"""
+
+from __future__ import annotations
+
+import mmap
+import socket
+import struct
+import subprocess
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+# magic -> (endian, divisor de la fracción de segundo)
+PCAP_MAGICS = {
+    b"\xd4\xc3\xb2\xa1": ("<", 10 ** 6),
+    b"\xa1\xb2\xc3\xd4": (">", 10 ** 6),
+    b"\x4d\x3c\xb2\xa1": ("<", 10 ** 9),
+    b"\xa1\xb2\x3c\x4d": (">", 10 ** 9),
+}
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_PB = 0x00000002
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_IEEE802_11 = 105
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IEEE802_11_RADIOTAP = 127
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+
+IPV4_HEADER = struct.Struct(">B8xB2x4s4s")
+PORTS = struct.Struct(">HH")
+EPB_HEADER = {e: struct.Struct(e + "IIIII") for e in "<>"}
+BLOCK_HEADER = {e: struct.Struct(e + "II") for e in "<>"}
+
+IP_PROTOCOLS = {1: "ICMP", 2: "IGMP", 6: "TCP", 17: "UDP", 47: "GRE", 50: "ESP", 58: "ICMPv6", 132: "SCTP"}
+IPV6_EXT_HEADERS = (0, 43, 60)
+IPV6_FRAGMENT = 44
+DNS_PORT = 53
+
+
+class PacketHeader(NamedTuple):
+    epoch: Optional[float]
+    src_ip: str
+    dst_ip: str
+    src_port: Optional[int]
+    dst_port: Optional[int]
+    protocol: str
+    frame_len: int
+    frame_number: int
+    tcp_flags: Optional[int] = None
+    dns_rcode: Optional[int] = None
+
+
+class RawFrame(NamedTuple):
+    frame_number: int
+    linktype: int
+    epoch: Optional[float]
+    orig_len: int
+    data: memoryview
+
+
+class _Interface(NamedTuple):
+    linktype: int
+    snaplen: int
+    ts_div: int  # ticks por segundo (if_tsresol)
+    ts_offset: int
+
+
+DEFAULT_INTERFACE = _Interface(LINKTYPE_ETHERNET, 0, 10 ** 6, 0)
+
+
+def _pcapng_interface(buf: memoryview, endian: str, body: int, end: int) -> _Interface:
+    linktype, _reserved, snaplen = struct.unpack_from(endian + "HHI", buf, body)
+    ts_div = 10 ** 6
+    ts_offset = 0
+    pos = body + 8
+    while pos + 4 <= end:
+        code, length = struct.unpack_from(endian + "HH", buf, pos)
+        if code == 0:
+            break
+        value = pos + 4
+        if code == 9 and length >= 1:  # if_tsresol
+            res = buf[value]
+            ts_div = 2 ** (res & 0x7F) if res & 0x80 else 10 ** res
+        elif code == 14 and length >= 8:  # if_tsoffset
+            (ts_offset,) = struct.unpack_from(endian + "q", buf, value)
+        pos = value + ((length + 3) & ~3)
+    return _Interface(linktype, snaplen, ts_div, ts_offset)
+
+
+def _iter_pcap(buf: memoryview, start_after: int) -> Iterator[RawFrame]:
+    endian, ts_div = PCAP_MAGICS[bytes(buf[:4])]
+    (network,) = struct.unpack_from(endian + "I", buf, 20)
+    linktype = network & 0x0FFFFFFF
+    record = struct.Struct(endian + "IIII")
+    pos = 24
+    size = len(buf)
+    number = 0
+    while pos + 16 <= size:
+        ts_sec, ts_frac, incl_len, orig_len = record.unpack_from(buf, pos)
+        data_start = pos + 16
+        pos = data_start + incl_len
+        if pos > size:
+            return  # registro truncado (fichero aún escribiéndose o cortado)
+        number += 1
+        if number <= start_after:
+            continue
+        # División entera->float: mismo redondeo que frame.time_epoch de tshark
+        yield RawFrame(number, linktype, (ts_sec * ts_div + ts_frac) / ts_div, orig_len, buf[data_start:pos])
+
+
+def _iter_pcapng(buf: memoryview, start_after: int) -> Iterator[RawFrame]:
+    size = len(buf)
+    pos = 0
+    endian = "<"
+    interfaces: list = []
+    number = 0
+    block_header = BLOCK_HEADER[endian]
+    epb_header = EPB_HEADER[endian]
+    while pos + 12 <= size:
+        block_type, block_len = block_header.unpack_from(buf, pos)
+        if block_type == PCAPNG_SHB:
+            # El tipo SHB es capicúa: se lee igual en ambos endian
+            magic = struct.unpack_from("<I", buf, pos + 8)[0]
+            endian = "<" if magic == BYTE_ORDER_MAGIC else ">"
+            block_header = BLOCK_HEADER[endian]
+            epb_header = EPB_HEADER[endian]
+            interfaces = []
+            block_type, block_len = block_header.unpack_from(buf, pos)
+        if block_len < 12 or pos + block_len > size:
+            return  # bloque incompleto
+        body = pos + 8
+        end = pos + block_len - 4
+        pos += block_len
+
+        if block_type == PCAPNG_EPB:
+            number += 1
+            if number <= start_after:
+                continue
+            iface_id, ts_high, ts_low, cap_len, orig_len = epb_header.unpack_from(buf, body)
+            iface = interfaces[iface_id] if iface_id < len(interfaces) else DEFAULT_INTERFACE
+            epoch = ((ts_high << 32) | ts_low) / iface.ts_div + iface.ts_offset
+            data = body + 20
+            yield RawFrame(number, iface.linktype, epoch, orig_len, buf[data:data + cap_len])
+        elif block_type == PCAPNG_SPB:
+            number += 1
+            if number <= start_after:
+                continue
+            (orig_len,) = struct.unpack_from(endian + "I", buf, body)
+            iface = interfaces[0] if interfaces else DEFAULT_INTERFACE
+            cap_len = min(orig_len, end - body - 4, iface.snaplen or orig_len)
+            data = body + 4
+            # SPB no lleva timestamp
+            yield RawFrame(number, iface.linktype, None, orig_len, buf[data:data + cap_len])
+        elif block_type == PCAPNG_IDB:
+            interfaces.append(_pcapng_interface(buf, endian, body, end))
+        elif block_type == PCAPNG_PB:
+            number += 1
+            if number <= start_after:
+                continue
+            iface_id, _drops, ts_high, ts_low, cap_len, orig_len = struct.unpack_from(endian + "HHIIII", buf, body)
+            iface = interfaces[iface_id] if iface_id < len(interfaces) else DEFAULT_INTERFACE
+            epoch = ((ts_high << 32) | ts_low) / iface.ts_div + iface.ts_offset
+            data = body + 20
+            yield RawFrame(number, iface.linktype, epoch, orig_len, buf[data:data + cap_len])
+
+
+def iter_frames(buf: memoryview, start_after: int = 0) -> Iterator[RawFrame]:
+    """Itera los frames de un buffer pcap/pcapng, saltando ``start_after`` frames."""
+    if len(buf) < 24:
+        return iter(())
+    magic = bytes(buf[:4])
+    if magic in PCAP_MAGICS:
+        return _iter_pcap(buf, start_after)
+    if struct.unpack_from("<I", buf, 0)[0] == PCAPNG_SHB:
+        return _iter_pcapng(buf, start_after)
+    raise ValueError("Formato no reconocido (se espera pcap o pcapng)")
+
+
+def _link_to_network(linktype: int, data: memoryview) -> Tuple[int, int]:
+    """Devuelve (ethertype, offset de la cabecera de red) o (0, 0) si no es IP."""
+    n = len(data)
+    if linktype == LINKTYPE_ETHERNET:
+        if n < 14:
+            return 0, 0
+        off = 12
+        ethertype = (data[off] << 8) | data[off + 1]
+        while ethertype in ETHERTYPE_VLAN and n >= off + 6:
+            off += 4
+            ethertype = (data[off] << 8) | data[off + 1]
+        return ethertype, off + 2
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        if n < 1:
+            return 0, 0
+        version = data[0] >> 4
+        return (ETHERTYPE_IPV4 if version == 4 else ETHERTYPE_IPV6 if version == 6 else 0), 0
+    if linktype == LINKTYPE_LINUX_SLL:
+        return ((data[14] << 8) | data[15], 16) if n >= 16 else (0, 0)
+    if linktype == LINKTYPE_LINUX_SLL2:
+        return ((data[0] << 8) | data[1], 20) if n >= 20 else (0, 0)
+    if linktype == LINKTYPE_NULL:
+        if n < 4:
+            return 0, 0
+        family = struct.unpack_from("<I", data, 0)[0]
+        if family > 0xFFFF:
+            family = struct.unpack_from(">I", data, 0)[0]
+        if family == 2:
+            return ETHERTYPE_IPV4, 4
+        if family in (10, 24, 28, 30):
+            return ETHERTYPE_IPV6, 4
+        return 0, 0
+    if linktype in (LINKTYPE_IEEE802_11, LINKTYPE_IEEE802_11_RADIOTAP):
+        off = 0
+        if linktype == LINKTYPE_IEEE802_11_RADIOTAP:
+            if n < 4:
+                return 0, 0
+            off = data[2] | (data[3] << 8)
+        if n < off + 24:
+            return 0, 0
+        fc0, fc1 = data[off], data[off + 1]
+        if (fc0 >> 2) & 0x3 != 2 or fc1 & 0x40:
+            return 0, 0  # no es trama de datos o va cifrada
+        subtype = fc0 >> 4
+        hdr = 24
+        if fc1 & 0x03 == 0x03:
+            hdr += 6  # cuatro direcciones (WDS)
+        if subtype & 0x8:
+            hdr += 2  # QoS
+            if fc1 & 0x80:
+                hdr += 4  # HT control
+        if subtype & 0x4:
+            return 0, 0  # null data, sin cuerpo
+        llc = off + hdr
+        if n < llc + 8 or data[llc] != 0xAA or data[llc + 1] != 0xAA or data[llc + 2] != 0x03:
+            return 0, 0
+        return (data[llc + 6] << 8) | data[llc + 7], llc + 8
+    return 0, 0
+
+
+def decode_frame(frame: RawFrame) -> Optional[PacketHeader]:
+    """Extrae los campos básicos; None si el frame no lleva IP (como hace to_record)."""
+    data = frame.data
+    ethertype, off = _link_to_network(frame.linktype, data)
+    n = len(data)
+    sport = dport = flags = rcode = None
+
+    if ethertype == ETHERTYPE_IPV4:
+        if n < off + 20:
+            return None
+        vihl, proto, src_raw, dst_raw = IPV4_HEADER.unpack_from(data, off)
+        frag = ((data[off + 6] & 0x1F) << 8) | data[off + 7]
+        src = socket.inet_ntoa(src_raw)
+        dst = socket.inet_ntoa(dst_raw)
+        l4 = off + (vihl & 0x0F) * 4
+        proto_ok = not frag  # un fragmento no inicial no lleva cabecera de transporte
+    elif ethertype == ETHERTYPE_IPV6:
+        if n < off + 40:
+            return None
+        proto = data[off + 6]
+        src = socket.inet_ntop(socket.AF_INET6, data[off + 8:off + 24])
+        dst = socket.inet_ntop(socket.AF_INET6, data[off + 24:off + 40])
+        l4 = off + 40
+        proto_ok = True
+        while proto in IPV6_EXT_HEADERS or proto == IPV6_FRAGMENT:
+            if n < l4 + 8:
+                proto_ok = False
+                break
+            if proto == IPV6_FRAGMENT:
+                if ((data[l4 + 2] << 8) | data[l4 + 3]) & 0xFFF8:
+                    proto_ok = False
+                proto = data[l4]
+                l4 += 8
+            else:
+                proto, l4 = data[l4], l4 + (data[l4 + 1] + 1) * 8
+    else:
+        return None
+
+    if proto_ok and proto in (6, 17) and n >= l4 + 4:
+        sport, dport = PORTS.unpack_from(data, l4)
+        if proto == 6 and n >= l4 + 14:
+            flags = ((data[l4 + 12] & 0x01) << 8) | data[l4 + 13]
+        elif proto == 17 and sport == DNS_PORT and n >= l4 + 12 and data[l4 + 10] & 0x80:
+            # Respuesta DNS (QR=1): rcode en los 4 bits bajos del segundo byte de flags
+            rcode = data[l4 + 11] & 0x0F
+
+    protocol = IP_PROTOCOLS.get(proto, "IPv4" if ethertype == ETHERTYPE_IPV4 else "IPv6")
+    return PacketHeader(frame.epoch, src, dst, sport, dport, protocol, frame.orig_len, frame.frame_number, flags, rcode)
+
+
+def iter_headers(path: Path, start_after: int = 0) -> Iterator[PacketHeader]:
+    """Lee un pcap/pcapng con mmap y emite las cabeceras de los frames IP."""
+    with path.open("rb") as fh:
+        if path.stat().st_size == 0:
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            buf = memoryview(mm)
+            frames = iter_frames(buf, start_after)
+            try:
+                for frame in frames:
+                    header = decode_frame(frame)
+                    # No se retiene ninguna vista del mmap mientras el consumidor procesa
+                    frame = None
+                    if header is not None:
+                        yield header
+            finally:
+                close = getattr(frames, "close", None)
+                if close is not None:
+                    close()
+                frame = None
+                buf.release()
+
+
+class PcapStream:
+    """Decodificación incremental de un pcap/pcapng que se sigue escribiendo.
+
+    ``feed`` recibe los bytes nuevos del fichero y devuelve las cabeceras de
+    los frames completos; un bloque a medio escribir se guarda hasta la
+    siguiente llamada. Los números de frame siguen la numeración de tshark.
+    """
+
+    def __init__(self, start_after: int = 0) -> None:
+        self.start_after = start_after
+        self.frames = 0
+        self._rest = b""
+        self._format: Optional[str] = None
+        self._endian = "<"
+        self._interfaces: list = []
+        self._pcap_iface = DEFAULT_INTERFACE
+
+    @property
+    def pending(self) -> int:
+        """Bytes de un bloque incompleto a la espera de más datos."""
+        return len(self._rest)
+
+    def feed(self, data: bytes) -> List[PacketHeader]:
+        buf = self._rest + data if self._rest else data
+        if self._format is None:
+            if len(buf) < 24:
+                self._rest = buf
+                return []
+            self._start(buf)
+            buf = buf[24:] if self._format == "pcap" else buf
+        if self._format == "pcap":
+            frames, pos = self._parse_pcap(buf)
+        else:
+            frames, pos = self._parse_pcapng(buf)
+        self._rest = buf[pos:]
+        headers = []
+        for frame in frames:
+            header = decode_frame(frame)
+            if header is not None:
+                headers.append(header)
+        return headers
+
+    def _start(self, buf: bytes) -> None:
+        magic = buf[:4]
+        if magic in PCAP_MAGICS:
+            self._format = "pcap"
+            self._endian, ts_div = PCAP_MAGICS[magic]
+            (network,) = struct.unpack_from(self._endian + "I", buf, 20)
+            self._pcap_iface = _Interface(network & 0x0FFFFFFF, 0, ts_div, 0)
+        elif struct.unpack_from("<I", buf, 0)[0] == PCAPNG_SHB:
+            self._format = "pcapng"
+        else:
+            raise ValueError("Formato no reconocido (se espera pcap o pcapng)")
+
+    def _next_number(self) -> int:
+        self.frames += 1
+        return self.frames if self.frames > self.start_after else 0
+
+    def _parse_pcap(self, buf: bytes) -> Tuple[List[RawFrame], int]:
+        record = struct.Struct(self._endian + "IIII")
+        iface = self._pcap_iface
+        frames = []
+        pos = 0
+        while pos + 16 <= len(buf):
+            ts_sec, ts_frac, incl_len, orig_len = record.unpack_from(buf, pos)
+            if pos + 16 + incl_len > len(buf):
+                break
+            number = self._next_number()
+            if number:
+                epoch = (ts_sec * iface.ts_div + ts_frac) / iface.ts_div
+                frames.append(RawFrame(number, iface.linktype, epoch, orig_len, memoryview(buf)[pos + 16:pos + 16 + incl_len]))
+            pos += 16 + incl_len
+        return frames, pos
+
+    def _parse_pcapng(self, buf: bytes) -> Tuple[List[RawFrame], int]:
+        view = memoryview(buf)
+        frames = []
+        pos = 0
+        while pos + 12 <= len(buf):
+            block_type, block_len = BLOCK_HEADER[self._endian].unpack_from(buf, pos)
+            if block_type == PCAPNG_SHB:
+                magic = struct.unpack_from("<I", buf, pos + 8)[0]
+                self._endian = "<" if magic == BYTE_ORDER_MAGIC else ">"
+                self._interfaces = []
+                block_type, block_len = BLOCK_HEADER[self._endian].unpack_from(buf, pos)
+            if block_len < 12 or pos + block_len > len(buf):
+                break  # bloque incompleto: se espera al siguiente feed
+            body = pos + 8
+            end = pos + block_len - 4
+            pos += block_len
+
+            if block_type in (PCAPNG_EPB, PCAPNG_PB):
+                number = self._next_number()
+                if not number:
+                    continue
+                if block_type == PCAPNG_EPB:
+                    iface_id, ts_high, ts_low, cap_len, orig_len = EPB_HEADER[self._endian].unpack_from(buf, body)
+                else:
+                    iface_id, _drops, ts_high, ts_low, cap_len, orig_len = struct.unpack_from(self._endian + "HHIIII", buf, body)
+                iface = self._interfaces[iface_id] if iface_id < len(self._interfaces) else DEFAULT_INTERFACE
+                epoch = ((ts_high << 32) | ts_low) / iface.ts_div + iface.ts_offset
+                frames.append(RawFrame(number, iface.linktype, epoch, orig_len, view[body + 20:body + 20 + cap_len]))
+            elif block_type == PCAPNG_SPB:
+                number = self._next_number()
+                if not number:
+                    continue
+                (orig_len,) = struct.unpack_from(self._endian + "I", buf, body)
+                iface = self._interfaces[0] if self._interfaces else DEFAULT_INTERFACE
+                cap_len = min(orig_len, end - body - 4, iface.snaplen or orig_len)
+                frames.append(RawFrame(number, iface.linktype, None, orig_len, view[body + 4:body + 4 + cap_len]))
+            elif block_type == PCAPNG_IDB:
+                self._interfaces.append(_pcapng_interface(view, self._endian, body, end))
+        return frames, pos
+
+
+def iter_tshark_protocols(path: Path, start_after: int = 0) -> Iterator[Tuple[int, str]]:
+    """(frame.number, _ws.col.Protocol) vía tshark, para completar la columna de protocolo."""
+    cmd = ["tshark", "-n", "-r", str(path), "-T", "fields", "-E", "separator=\t", "-e", "frame.number", "-e", "_ws.col.Protocol"]
+    if start_after:
+        cmd += ["-Y", f"frame.number > {start_after}"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    assert proc.stdout is not None
+    try:
+        for line in proc.stdout:
+            number, _, proto = line.rstrip("\n").partition("\t")
+            if number.isdigit():
+                yield int(number), proto.strip()
+    finally:
+        if proc.poll() is None:
+            proc.terminate()
+        proc.wait()
+
+
+def with_tshark_protocols(headers: Iterator[PacketHeader], path: Path, start_after: int = 0) -> Iterator[PacketHeader]:
+    """Sustituye el protocolo de transporte por la columna de protocolo de tshark."""
+    protocols = iter_tshark_protocols(path, start_after)
+    pending: Dict[int, str] = {}
+    try:
+        for header in headers:
+            proto = pending.pop(header.frame_number, None)
+            while proto is None:
+                nxt = next(protocols, None)
+                if nxt is None:
+                    break
+                if nxt[0] == header.frame_number:
+                    proto = nxt[1]
+                elif nxt[0] > header.frame_number:
+                    pending[nxt[0]] = nxt[1]
+                    break
+            yield header._replace(protocol=proto) if proto else header
+    finally:
+        protocols.close()
@@ -0,0 +1,125 @@
+"""
+División de un pcap/pcapng grande en tramos de paquetes para decodificarlos
+en paralelo (un tshark por tramo).
+
+El fichero no se reescribe: cada tramo es la cabecera (pcap) o la SHB + IDBs
+vistas hasta ese punto (pcapng) seguida de un rango de bytes del original,
+cortado siempre en frontera de bloque. Cada tramo sabe cuántos frames le
+preceden, así que ``frame.number`` se recompone sumando ese desplazamiento.
+"""
+
+from __future__ import annotations
+
+import mmap
+import struct
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+from pcap_reader import BLOCK_HEADER, BYTE_ORDER_MAGIC, PCAP_MAGICS, PCAPNG_EPB, PCAPNG_IDB, PCAPNG_PB, PCAPNG_SHB, PCAPNG_SPB
+
+PACKET_BLOCKS = (PCAPNG_EPB, PCAPNG_SPB, PCAPNG_PB)
+
+
+class Chunk(NamedTuple):
+    frame_offset: int  # frames del fichero anteriores al tramo
+    frames: int
+    start: int
+    end: int
+    prefix: bytes
+
+
+def _packet_offsets_pcap(buf: mmap.mmap) -> List[int]:
+    endian, _ = PCAP_MAGICS[bytes(buf[:4])]
+    record = struct.Struct(endian + "I")
+    offsets = []
+    pos = 24
+    size = len(buf)
+    while pos + 16 <= size:
+        (incl_len,) = record.unpack_from(buf, pos + 8)
+        if pos + 16 + incl_len > size:
+            break
+        offsets.append(pos)
+        pos += 16 + incl_len
+    offsets.append(pos)
+    return offsets
+
+
+def _packet_offsets_pcapng(buf: mmap.mmap, prefix_blocks: List[Tuple[int, bytes]]) -> Optional[List[int]]:
+    """Offsets de los bloques de paquete (+ fin); la SHB y las IDB van a ``prefix_blocks``."""
+    size = len(buf)
+    pos = 0
+    offsets: List[int] = []
+    endian = "<"
+    while pos + 12 <= size:
+        block_type, block_len = BLOCK_HEADER[endian].unpack_from(buf, pos)
+        if block_type == PCAPNG_SHB:
+            if pos:
+                return None  # varias secciones: no se divide
+            magic = struct.unpack_from("<I", buf, 8)[0]
+            endian = "<" if magic == BYTE_ORDER_MAGIC else ">"
+            block_type, block_len = BLOCK_HEADER[endian].unpack_from(buf, pos)
+        if block_len < 12 or pos + block_len > size:
+            break
+        if block_type in PACKET_BLOCKS:
+            offsets.append(pos)
+        elif block_type in (PCAPNG_SHB, PCAPNG_IDB):
+            prefix_blocks.append((pos, bytes(buf[pos:pos + block_len])))
+        pos += block_len
+    offsets.append(pos)
+    return offsets
+
+
+def packet_offsets(buf: mmap.mmap) -> Optional[Tuple[List[int], List[Tuple[int, bytes]]]]:
+    """Offsets de cada paquete (+ fin de datos) y bloques de cabecera ``(offset, bytes)``.
+
+    None si el formato no se puede cortar en tramos (no es pcap/pcapng o es
+    un pcapng con varias secciones).
+    """
+    if len(buf) < 24:
+        return None
+    prefix_blocks: List[Tuple[int, bytes]] = []
+    if bytes(buf[:4]) in PCAP_MAGICS:
+        prefix_blocks.append((0, bytes(buf[:24])))
+        return _packet_offsets_pcap(buf), prefix_blocks
+    if struct.unpack_from("<I", buf, 0)[0] == PCAPNG_SHB:
+        offsets = _packet_offsets_pcapng(buf, prefix_blocks)
+        return None if offsets is None else (offsets, prefix_blocks)
+    return None
+
+
+def plan_chunks(path: Path, target_frames: int, min_chunks: int = 1, start_after: int = 0) -> Optional[List[Chunk]]:
+    """Tramos de ~``target_frames`` frames (al menos ``min_chunks``) tras ``start_after``.
+
+    Devuelve None si el formato no permite dividir (p. ej. pcapng con varias
+    secciones); el llamador debe leer el fichero de una pieza.
+    """
+    if path.stat().st_size < 24:
+        return None
+    with path.open("rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        layout = packet_offsets(buf)
+    if layout is None:
+        return None
+    offsets, prefix_blocks = layout
+
+    total = len(offsets) - 1
+    remaining = total - start_after
+    if remaining <= 0:
+        return []
+    count = max(min_chunks, -(-remaining // max(1, target_frames)))
+    per_chunk = -(-remaining // count)
+
+    chunks = []
+    for first in range(start_after, total, per_chunk):
+        last = min(first + per_chunk, total)
+        start, end = offsets[first], offsets[last]
+        # SHB + IDBs anteriores al tramo: las interfaces deben declararse antes de sus paquetes
+        prefix = b"".join(block for offset, block in prefix_blocks if offset < start)
+        chunks.append(Chunk(first, last - first, start, end, prefix))
+    return chunks
+
+
+def read_chunk(path: Path, chunk: Chunk) -> bytes:
+    """Bytes de un pcap válido con sólo los paquetes del tramo."""
+    with path.open("rb") as fh:
+        fh.seek(chunk.start)
+        return chunk.prefix + fh.read(chunk.end - chunk.start)
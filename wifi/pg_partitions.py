@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+"""
+Particionado por tiempo de ``network_packets`` (o la tabla de ``--table``)
+gestionado por el propio ingestor.
+
+``bootstrap`` convierte la tabla en una tabla particionada por rango de
+``timestamp`` en una sola transacción:
+
+- la tabla actual pasa a llamarse ``<tabla>_legacy`` y se engancha como
+  partición ``MINVALUE .. <día/hora siguiente a su último timestamp>``;
+- la nueva tabla copia columnas, defaults, checks, identity, permisos y
+  políticas RLS;
+- la clave primaria pasa a ser ``(id, timestamp)``, porque Postgres exige que
+  incluya la clave de partición;
+- las FK que apuntaban a la tabla (``network_packet_embeddings.packet_id``)
+  se eliminan, porque no pueden apuntar sólo a ``id``;
+- índice BRIN sobre ``timestamp`` (unos pocos KB por partición, en lugar de
+  un btree del tamaño de la tabla) y una partición ``DEFAULT`` para filas
+  sin partición.
+
+Si la tabla ya está particionada no se toca. ``ensure`` crea las
+particiones que cubren un rango de tiempos (más ``premake`` por delante)
+antes de enviar cada lote; ``maintain`` separa (``DETACH``) o borra las que
+quedan fuera de la ventana de retención.
+
+Uso (p. ej. desde cron, o para probar contra un Postgres local):
+  python3 pg_partitions.py --pg-dsn postgresql://postgres@localhost:5432/postgres \\
+    --partition-by day --partition-retention-days 30
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import os
+import re
+import sys
+import time
+from typing import Any, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from pg_sink import load_driver, quote_ident
+
+INTERVALS = {"day": dt.timedelta(days=1), "hour": dt.timedelta(hours=1)}
+PARTITION_KEY = "timestamp"
+# Máximo de particiones nuevas por lote: una fecha corrupta no debe crear miles de tablas
+MAX_NEW_PARTITIONS = 400
+MAINTAIN_EVERY_SEC = 600.0
+# Esperas de lock_timeout (10 s) antes de rendirse si otro proceso está convirtiendo la tabla
+CONVERT_ATTEMPTS = 6
+LOCK_NOT_AVAILABLE = "55P03"
+DUPLICATE_TABLE, UNIQUE_VIOLATION = "42P07", "23505"
+_BOUND_RE = re.compile(r"FROM \((?:MINVALUE|'([^']+)')\) TO \((?:MAXVALUE|'([^']+)')\)")
+
+
+class PartitionError(RuntimeError):
+    pass
+
+
+class Partition(NamedTuple):
+    name: str
+    start: Optional[dt.datetime]  # None = MINVALUE
+    end: Optional[dt.datetime]  # None = MAXVALUE
+    default: bool = False
+
+
+def floor_time(moment: dt.datetime, interval: str) -> dt.datetime:
+    moment = moment.astimezone(dt.timezone.utc)
+    if interval == "day":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def pg_literal(moment: dt.datetime) -> str:
+    return "'" + moment.strftime("%Y-%m-%d %H:%M:%S+00") + "'"
+
+
+def parse_bound(value: Optional[str]) -> Optional[dt.datetime]:
+    # Con la sesión en UTC, Postgres escribe '2026-10-18 00:00:00+00'
+    return dt.datetime.fromisoformat(value) if value else None
+
+
+def add_partition_args(p: argparse.ArgumentParser) -> None:
+    p.add_argument(
+        "--partition-by",
+        choices=["day", "hour"],
+        help="Particiona la tabla por rango de timestamp (requiere --pg-dsn; la convierte si aún no lo está)",
+    )
+    p.add_argument("--partition-premake", type=int, default=2, help="Particiones que se crean por delante de los datos")
+    p.add_argument(
+        "--partition-retention-days",
+        type=float,
+        default=0.0,
+        help="Particiones más antiguas que esto salen de la tabla (0 = sin retención)",
+    )
+    p.add_argument(
+        "--partition-retention-action",
+        choices=["detach", "drop"],
+        default="detach",
+        help="detach deja la partición como tabla suelta (se puede archivar); drop la borra",
+    )
+
+
+def validate_partition_args(args: argparse.Namespace) -> None:
+    if not args.partition_by:
+        return
+    if not args.pg_dsn and not getattr(args, "dry_run", False):
+        print("[ERROR] --partition-by requiere --pg-dsn o la variable PG_DSN (DDL directo a Postgres)")
+        sys.exit(1)
+    if args.partition_premake < 0 or args.partition_retention_days < 0:
+        print("[ERROR] --partition-premake y --partition-retention-days deben ser >= 0")
+        sys.exit(1)
+
+
+class PartitionManager:
+    """Crea y retira particiones; guarda en memoria las ya existentes."""
+
+    def __init__(
+        self,
+        dsn: str,
+        table: str,
+        interval: str = "day",
+        premake: int = 2,
+        retention_days: float = 0.0,
+        retention_action: str = "detach",
+        brin_pages_per_range: int = 32,
+    ) -> None:
+        self.dsn = dsn
+        self.schema, _, self.name = table.rpartition(".")
+        self.schema = self.schema or "public"
+        self.table = quote_ident(f"{self.schema}.{self.name}")
+        self.interval = interval
+        self.step = INTERVALS[interval]
+        self.premake = premake
+        self.retention = dt.timedelta(days=retention_days) if retention_days else None
+        self.retention_action = retention_action
+        self.brin_pages_per_range = brin_pages_per_range
+        self.driver_name, self._driver = load_driver()
+        # Lo que puede fallar al hablar con la BD: errores propios y del driver
+        self.errors: Tuple[type, ...] = (PartitionError, self._driver.Error)
+        self.conn: Any = None
+        self.starts: Set[dt.datetime] = set()
+        self.low_bound: Optional[dt.datetime] = None  # fin de la partición MINVALUE (legacy)
+        self.created = 0
+        self.removed = 0
+        self._maintained_at = 0.0
+
+    # -- conexión ---------------------------------------------------------
+
+    def connect(self) -> Any:
+        if self.conn is None:
+            conn = self._driver.connect(self.dsn)
+            conn.autocommit = True  # transacciones explícitas con BEGIN/COMMIT
+            self.conn = conn
+            self.execute("set time zone 'UTC'")
+            # Un DDL esperando tras una consulta larga bloquearía también los INSERT
+            self.execute("set lock_timeout = '10s'")
+        return self.conn
+
+    def execute(self, sql: str, params: Optional[Tuple[Any, ...]] = None) -> List[Tuple[Any, ...]]:
+        with self.connect().cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall() if cur.description else []
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def ident(self, name: str) -> str:
+        return quote_ident(f"{self.schema}.{name}")
+
+    # -- catálogo ---------------------------------------------------------
+
+    def relkind(self, name: str) -> Optional[str]:
+        rows = self.execute(
+            "select c.relkind from pg_class c join pg_namespace n on n.oid = c.relnamespace "
+            "where n.nspname = %s and c.relname = %s",
+            (self.schema, name),
+        )
+        return rows[0][0] if rows else None
+
+    def partitions(self) -> List[Partition]:
+        rows = self.execute(
+            "select c.relname, pg_get_expr(c.relpartbound, c.oid) from pg_inherits i "
+            "join pg_class c on c.oid = i.inhrelid where i.inhparent = %s::regclass order by 1",
+            (self.table,),
+        )
+        parts = []
+        for name, bound in rows:
+            if bound == "DEFAULT":
+                parts.append(Partition(name, None, None, default=True))
+                continue
+            m = _BOUND_RE.search(bound or "")
+            if m:
+                parts.append(Partition(name, parse_bound(m.group(1)), parse_bound(m.group(2))))
+        return parts
+
+    def refresh(self) -> List[Partition]:
+        parts = self.partitions()
+        self.starts = {p.start for p in parts if p.start is not None and p.end is not None}
+        self.low_bound = max((p.end for p in parts if p.start is None and p.end is not None), default=None)
+        return parts
+
+    # -- conversión -------------------------------------------------------
+
+    def bootstrap(self) -> None:
+        """Deja la tabla particionada (idempotente)."""
+        kind = self.relkind(self.name)
+        if kind is None:
+            raise PartitionError(f"no existe la tabla {self.schema}.{self.name}")
+        if kind == "p":
+            key = self.execute("select pg_get_partkeydef(%s::regclass)", (self.table,))[0][0]
+            if key.replace('"', "") != f"RANGE ({PARTITION_KEY})":
+                raise PartitionError(f"{self.name} ya está particionada con otra clave: {key}")
+            self.refresh()
+            return
+        if kind != "r":
+            raise PartitionError(f"{self.name} no es una tabla (relkind {kind!r})")
+        for attempt in range(1, CONVERT_ATTEMPTS + 1):
+            try:
+                self.convert()
+                break
+            except self._driver.Error as exc:
+                if sqlstate(exc) != LOCK_NOT_AVAILABLE or attempt == CONVERT_ATTEMPTS:
+                    raise
+                print(f"[WARN] {self.name} ocupada por otra sesión (p. ej. otra conversión); reintento {attempt}/{CONVERT_ATTEMPTS - 1}")
+        self.refresh()
+
+    def attach(self) -> None:
+        """Carga las particiones de una tabla que ya convirtió otro proceso (sin DDL)."""
+        if self.relkind(self.name) != "p":
+            raise PartitionError(f"{self.schema}.{self.name} no está particionada")
+        self.refresh()
+
+    def convert(self) -> None:
+        legacy = f"{self.name}_legacy"
+        started = time.perf_counter()
+        self.execute("begin")
+        try:
+            self.execute(f"lock table {self.table} in access exclusive mode")
+            # Otro proceso pudo convertirla mientras se esperaba el lock
+            if self.relkind(self.name) == "p":
+                self.execute("rollback")
+                print(f"[INFO] {self.name} ya la convirtió otro proceso")
+                return
+            if self.relkind(legacy) is not None:
+                raise PartitionError(f"ya existe {legacy}: revisa una conversión anterior a medias")
+            print(f"[INFO] Convirtiendo {self.schema}.{self.name} en tabla particionada por {PARTITION_KEY} ({self.interval})")
+            self._convert(legacy)
+            self.execute("commit")
+        except Exception:
+            self.execute("rollback")
+            raise
+        try:
+            self.execute("notify pgrst, 'reload schema'")  # PostgREST recarga su caché de esquema
+        except self._driver.Error:
+            pass
+        print(f"[OK] {self.name} particionada en {time.perf_counter() - started:.1f}s; datos previos en {legacy}")
+
+    def _convert(self, legacy: str) -> None:
+        old = self.table
+        oid = self.execute("select %s::regclass::oid", (old,))[0][0]
+        nulls, last = self.execute(
+            f"select count(*) filter (where {quote_ident(PARTITION_KEY)} is null), max({quote_ident(PARTITION_KEY)}) from {old}"
+        )[0]
+        if nulls:
+            raise PartitionError(f"{nulls} filas sin {PARTITION_KEY}: no caben en ninguna partición de rango")
+
+        # FK entrantes: no pueden apuntar a una tabla particionada sin la clave de partición
+        for (table, constraint) in self.execute(
+            "select conrelid::regclass::text, conname from pg_constraint where confrelid = %s and contype = 'f'", (oid,)
+        ):
+            print(f"[WARN] Se elimina la FK {constraint} de {table} (no puede referenciar sólo id)")
+            self.execute(f"alter table {table} drop constraint {quote_ident(constraint)}")
+        for (view,) in self.execute(
+            "select distinct r.ev_class::regclass::text from pg_depend d join pg_rewrite r on r.oid = d.objid "
+            "where d.refobjid = %s and r.ev_class <> %s",
+            (oid, oid),
+        ):
+            print(f"[WARN] La vista {view} seguirá leyendo sólo {legacy}: recréala sobre {self.name}")
+
+        pk = self.execute(
+            "select con.conname, array_agg(a.attname order by k.ord) from pg_constraint con "
+            "cross join unnest(con.conkey) with ordinality k(attnum, ord) "
+            "join pg_attribute a on a.attrelid = con.conrelid and a.attnum = k.attnum "
+            "where con.conrelid = %s and con.contype = 'p' group by con.conname",
+            (oid,),
+        )
+        sequences = self.execute(
+            "select a.attname, a.attidentity, pg_get_serial_sequence(%s, a.attname) from pg_attribute a "
+            "where a.attrelid = %s and a.attnum > 0 and not a.attisdropped "
+            "and pg_get_serial_sequence(%s, a.attname) is not null",
+            (old, oid, old),
+        )
+        grants = self.execute(
+            "select grantee, string_agg(privilege_type, ', ') from information_schema.role_table_grants "
+            "where table_schema = %s and table_name = %s "
+            "and grantee <> (select pg_get_userbyid(relowner) from pg_class where oid = %s) group by grantee",
+            (self.schema, self.name, oid),
+        )
+        rls = self.execute("select relrowsecurity, relforcerowsecurity from pg_class where oid = %s", (oid,))[0]
+        policies = self.execute(
+            "select policyname, permissive, roles, cmd, qual, with_check from pg_policies "
+            "where schemaname = %s and tablename = %s",
+            (self.schema, self.name),
+        )
+
+        self.execute(f"alter table {old} rename to {quote_ident(legacy)}")
+        legacy_table = self.ident(legacy)
+        if pk:
+            self.execute(f"alter table {legacy_table} drop constraint {quote_ident(pk[0][0])}")
+        self.execute(
+            f"create table {self.table} (like {legacy_table} including defaults including constraints "
+            f"including generated including identity including storage including comments) "
+            f"partition by range ({quote_ident(PARTITION_KEY)})"
+        )
+        if pk:
+            key_columns = list(pk[0][1])
+            if PARTITION_KEY not in key_columns:
+                key_columns.append(PARTITION_KEY)
+            self.execute(
+                f"alter table {self.table} add constraint {quote_ident(self.name + '_pkey')} "
+                f"primary key ({', '.join(quote_ident(c) for c in key_columns)})"
+            )
+        self.execute(
+            f"create index {quote_ident(self.name + '_ts_brin')} on {self.table} "
+            f"using brin ({quote_ident(PARTITION_KEY)}) with (pages_per_range = {int(self.brin_pages_per_range)})"
+        )
+
+        for column, identity, sequence in sequences:
+            if identity:
+                # identity: secuencia nueva, se continúa donde iba la antigua
+                self.execute(
+                    "select setval(pg_get_serial_sequence(%s, %s), nextval(%s::regclass), false)",
+                    (self.table, column, sequence),
+                )
+            else:
+                # serial: el default sigue usando la secuencia; que no se borre con legacy
+                self.execute(f"alter sequence {sequence} owned by {self.table}.{quote_ident(column)}")
+        for grantee, privileges in grants:
+            role = "public" if grantee == "PUBLIC" else quote_ident(grantee)
+            self.execute(f"grant {privileges} on {self.table} to {role}")
+        if rls[0]:
+            self.execute(f"alter table {self.table} enable row level security")
+        if rls[1]:
+            self.execute(f"alter table {self.table} force row level security")
+        for name, permissive, roles, cmd, qual, with_check in policies:
+            sql = f"create policy {quote_ident(name)} on {self.table} as {permissive} for {cmd} to "
+            sql += ", ".join("public" if r == "public" else quote_ident(r) for r in roles)
+            if qual:
+                sql += f" using ({qual})"
+            if with_check:
+                sql += f" with check ({with_check})"
+            self.execute(sql)
+
+        # Los datos previos quedan en una partición MINVALUE..(día/hora tras el último)
+        upper = floor_time(last, self.interval) + self.step if last else floor_time(dt.datetime.now(dt.timezone.utc), self.interval)
+        self.execute(
+            f"alter table {self.table} attach partition {legacy_table} for values from (minvalue) to ({pg_literal(upper)})"
+        )
+        self.execute(f"create table {self.ident(self.name + '_default')} partition of {self.table} default")
+
+    # -- mantenimiento ----------------------------------------------------
+
+    def partition_name(self, start: dt.datetime) -> str:
+        return f"{self.name}_p{start.strftime('%Y%m%d' if self.interval == 'day' else '%Y%m%d%H')}"
+
+    def covered(self, start: dt.datetime) -> bool:
+        return start in self.starts or (self.low_bound is not None and start < self.low_bound)
+
+    def ensure(self, first_epoch: float, last_epoch: float) -> int:
+        """Crea las particiones de [first_epoch, last_epoch] y ``premake`` más; devuelve las creadas."""
+        start = floor_time(dt.datetime.fromtimestamp(first_epoch, dt.timezone.utc), self.interval)
+        end = floor_time(dt.datetime.fromtimestamp(last_epoch, dt.timezone.utc), self.interval) + self.premake * self.step
+        missing = []
+        moment = start
+        while moment <= end:
+            if not self.covered(moment):
+                missing.append(moment)
+            moment += self.step
+        if len(missing) > MAX_NEW_PARTITIONS:
+            print(f"[WARN] El lote pediría {len(missing)} particiones ({start} -> {end}); se crean las {MAX_NEW_PARTITIONS} primeras")
+            missing = missing[:MAX_NEW_PARTITIONS]
+        created = 0
+        for moment in missing:
+            created += self.create(moment)
+        return created
+
+    def create(self, start: dt.datetime) -> int:
+        name = self.partition_name(start)
+        try:
+            self.execute(
+                f"create table if not exists {self.ident(name)} partition of {self.table} "
+                f"for values from ({pg_literal(start)}) to ({pg_literal(start + self.step)})"
+            )
+        except self._driver.Error as exc:
+            # Otro ingestor la creó a la vez, o la partición DEFAULT ya tiene filas de
+            # ese rango: las filas seguirán yendo allí
+            if sqlstate(exc) not in (DUPLICATE_TABLE, UNIQUE_VIOLATION):
+                print(f"[WARN] No se pudo crear {name}: {describe_error(exc)}")
+            self.refresh()
+            self.starts.add(start)
+            return 0
+        self.starts.add(start)
+        self.created += 1
+        print(f"[INFO] Partición {name} creada")
+        return 1
+
+    def expired(self, now: Optional[dt.datetime] = None) -> List[Partition]:
+        if self.retention is None:
+            return []
+        cutoff = (now or dt.datetime.now(dt.timezone.utc)) - self.retention
+        return [p for p in self.refresh() if not p.default and p.end is not None and p.end <= cutoff]
+
+    def maintain(self, now: Optional[dt.datetime] = None) -> int:
+        """Crea las próximas particiones y retira las que superan la retención."""
+        self._maintained_at = time.monotonic()
+        moment = (now or dt.datetime.now(dt.timezone.utc)).timestamp()
+        self.ensure(moment, moment)
+        removed = 0
+        for part in self.expired(now):
+            target = self.ident(part.name)
+            try:
+                if self.retention_action == "drop":
+                    self.execute(f"drop table {target}")
+                else:
+                    self.execute(f"alter table {self.table} detach partition {target}")
+            except self._driver.Error as exc:
+                # p. ej. una vista que depende de la partición: se reintenta en la próxima pasada
+                print(f"[WARN] Retención: no se pudo retirar {part.name}: {describe_error(exc)}")
+                continue
+            removed += 1
+            print(f"[INFO] Retención: {part.name} ({'borrada' if self.retention_action == 'drop' else 'separada'})")
+        if removed:
+            self.removed += removed
+            self.refresh()
+        return removed
+
+    def maintain_due(self) -> bool:
+        return self.retention is not None and time.monotonic() - self._maintained_at >= MAINTAIN_EVERY_SEC
+
+    def status(self) -> List[Tuple[str, str, str]]:
+        rows = []
+        for part in self.refresh():
+            if part.default:
+                rows.append((part.name, "DEFAULT", ""))
+            else:
+                rows.append((part.name, str(part.start or "MINVALUE"), str(part.end or "MAXVALUE")))
+        return rows
+
+
+def sqlstate(exc: BaseException) -> Optional[str]:
+    # psycopg expone ``sqlstate``; psycopg2, ``pgcode``
+    return getattr(exc, "sqlstate", None) or getattr(exc, "pgcode", None)
+
+
+def describe_error(exc: BaseException) -> str:
+    """Primera línea del error (los del driver traen DETAIL/HINT en varias líneas)."""
+    text = str(exc).strip()
+    return text.splitlines()[0] if text else type(exc).__name__
+
+
+def epoch_range(epochs: Iterable[Optional[float]]) -> Optional[Tuple[float, float]]:
+    low = high = None
+    for epoch in epochs:
+        if epoch is None:
+            continue
+        if low is None or epoch < low:
+            low = epoch
+        if high is None or epoch > high:
+            high = epoch
+    return None if low is None else (low, high)
+
+
+def manager_from_args(args: argparse.Namespace, table: str) -> PartitionManager:
+    return PartitionManager(
+        args.pg_dsn,
+        table,
+        interval=args.partition_by,
+        premake=args.partition_premake,
+        retention_days=args.partition_retention_days,
+        retention_action=args.partition_retention_action,
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Convierte network_packets en tabla particionada y mantiene sus particiones")
+    p.add_argument("--pg-dsn", default=os.getenv("PG_DSN"), help="DSN de Postgres (o variable PG_DSN)")
+    p.add_argument("--table", default="network_packets")
+    add_partition_args(p)
+    p.add_argument("--status", action="store_true", help="Sólo lista las particiones")
+    args = p.parse_args()
+    if not args.partition_by and not args.status:
+        args.partition_by = "day"
+    return args
+
+
+def main() -> None:
+    args = parse_args()
+    if not args.pg_dsn:
+        print("[ERROR] Indica --pg-dsn o la variable PG_DSN")
+        sys.exit(1)
+    validate_partition_args(args)
+    try:
+        manager = manager_from_args(args, args.table) if args.partition_by else PartitionManager(args.pg_dsn, args.table)
+    except RuntimeError as exc:
+        print(f"[ERROR] {exc}")
+        sys.exit(1)
+    try:
+        if not args.status:
+            manager.bootstrap()
+            manager.maintain()
+        for name, start, end in manager.status():
+            print(f"{name}\t{start}\t{end}")
+    except manager.errors as exc:
+        print(f"[ERROR] {describe_error(exc)}")
+        sys.exit(1)
+    finally:
+        manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Sink directo a Postgres con ``COPY ... FROM STDIN`` (alternativa a PostgREST).
+
+Para cargas históricas el JSON de PostgREST es el techo: se serializa en el
+cliente, PostgREST lo vuelve a parsear y lo convierte en INSERT. Aquí cada lote
+se escribe en formato texto de COPY (el servidor convierte a inet, jsonb,
+timestamptz... según el esquema) y se envía en una transacción por lote.
+
+Si el lote trae ``id`` asignado en el cliente (--dedup, embeddings), el COPY
+va a una tabla temporal y de ahí a la tabla con ``ON CONFLICT (id) DO
+NOTHING`` (``(id, timestamp)`` si está particionada): reenviar un lote ya
+insertado no aborta la transacción.
+
+Usa ``psycopg`` (3) o, si no está, ``psycopg2``.
+"""
+
+from __future__ import annotations
+
+import io
+import json
+from typing import Any, Iterable, List, Tuple
+
+from columnar import COPY_NULL, copy_escape
+
+
+def load_driver() -> Tuple[str, Any]:
+    try:
+        import psycopg
+
+        return "psycopg", psycopg
+    except ImportError:
+        pass
+    try:
+        import psycopg2
+
+        return "psycopg2", psycopg2
+    except ImportError:
+        raise RuntimeError(
+            "Falta dependencia 'psycopg'. Instala con: pip install 'psycopg[binary]' (o psycopg2-binary)"
+        ) from None
+
+
+def quote_ident(name: str) -> str:
+    """``esquema.tabla`` -> ``"esquema"."tabla"``."""
+    return ".".join('"' + part.replace('"', '""') + '"' for part in name.split("."))
+
+
+def primary_key(dsn: str, table: str) -> List[str]:
+    """Columnas de la clave primaria de ``table`` en orden (vacía si no tiene)."""
+    _, driver = load_driver()
+    conn = driver.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "select a.attname from pg_index i "
+                "join pg_attribute a on a.attrelid = i.indrelid and a.attnum = any(i.indkey) "
+                "where i.indrelid = %s::regclass and i.indisprimary "
+                "order by array_position(i.indkey::int2[], a.attnum)",
+                (quote_ident(table),),
+            )
+            return [row[0] for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def _copy_value(value: Any) -> str:
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (dict, list)):
+        return copy_escape(json.dumps(value))
+    return copy_escape(str(value))
+
+
+def rows_to_copy(rows: Any) -> Tuple[List[str], str]:
+    """(columnas, datos en formato texto de COPY) de un lote de filas o ColumnBatch."""
+    to_copy = getattr(rows, "to_copy", None)
+    if to_copy is not None:
+        return rows.copy_columns(), to_copy()
+    columns = list(rows[0])
+    lines = ["\t".join(_copy_value(row.get(col)) for col in columns) + "\n" for row in rows]
+    return columns, "".join(lines)
+
+
+class PgCopyWriter:
+    """Conexiones y COPY por lote; cada worker del uploader usa su propia conexión."""
+
+    def __init__(self, dsn: str, table: str, conflict: Iterable[str] = ("id",)) -> None:
+        self.dsn = dsn
+        self.table = quote_ident(table)
+        self.conflict = ", ".join(quote_ident(c) for c in conflict)
+        self.stage = quote_ident("_stage_" + table.split(".")[-1])
+        self.driver_name, self._driver = load_driver()
+
+    def connect(self) -> Any:
+        conn = self._driver.connect(self.dsn)
+        if self.driver_name == "psycopg":
+            conn.autocommit = False
+        return conn
+
+    def copy(self, conn: Any, rows: Any) -> int:
+        """Envía el lote en una transacción; devuelve los bytes escritos."""
+        if not rows:
+            return 0
+        columns, data = rows_to_copy(rows)
+        column_list = ", ".join(quote_ident(c) for c in columns)
+        skip_duplicates = "id" in columns
+        target = self.stage if skip_duplicates else self.table
+        sql = f"COPY {target} ({column_list}) FROM STDIN"
+        try:
+            with conn.cursor() as cur:
+                if skip_duplicates:
+                    # Temporal por conexión, se vacía en cada commit. Sin NOT NULL: las
+                    # columnas que no trae el lote (p. ej. un identity) las rellena el INSERT
+                    cur.execute(
+                        f"CREATE TEMP TABLE IF NOT EXISTS {self.stage} ON COMMIT DELETE ROWS "
+                        f"AS SELECT * FROM {self.table} WITH NO DATA"
+                    )
+                if self.driver_name == "psycopg":
+                    with cur.copy(sql) as copy:
+                        copy.write(data)
+                else:
+                    cur.copy_expert(sql, io.StringIO(data))
+                if skip_duplicates:
+                    cur.execute(
+                        f"INSERT INTO {self.table} ({column_list}) SELECT {column_list} FROM {self.stage} "
+                        f"ON CONFLICT ({self.conflict}) DO NOTHING"
+                    )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return len(data)
+
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-Configuración de Access Point (AP) + captura con tshark para laboratorio.
+Configuración de Access Point (AP) + captura con dumpcap/tshark para laboratorio.
 
 Qué hace:
 1) Detecta interfaz Wi-Fi (priorizando USB)
@@ -8,7 +8,14 @@ Qué hace:
 3) Configura IP estática en la interfaz AP
 4) Activa forwarding + NAT hacia la interfaz de salida
 5) Inicia/activa servicios (hostapd/dnsmasq)
-6) Lanza tshark en background para guardar PCAPs rotativos
+6) Lanza dumpcap (o tshark) en background para guardar PCAPs rotativos
+7) Con --archive-dir, lanza capture_archive.py: comprime cada fichero al
+   rotar, lo indexa por tiempo y limita el archivo a --archive-budget-gb
+
+Con --reconcile lee el estado actual una vez (ip -j addr, iptables-save,
+systemctl, sysctl, pgrep), aplica sólo las diferencias y mete todas las reglas
+que falten en un único iptables-restore --noflush. Relanzarlo con la misma
+configuración no toca nada: no reinicia hostapd ni desconecta clientes.
 
 Uso ejemplo:
 	sudo python3 setting-ap.py --ssid UBU-LAB-AP --passphrase 'ClaveSegura123'
@@ -19,14 +26,17 @@ Nota: diseñado para Debian/Ubuntu/Raspberry Pi OS en entorno controlado.
 from __future__ import annotations
 
 import argparse
+import concurrent.futures
+import ipaddress
+import json
 import os
 import shutil
 import subprocess
 import sys
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional, Set, Tuple
 
 
 HOSTAPD_CONF = Path("/etc/hostapd/hostapd.conf")
@@ -34,6 +44,11 @@ HOSTAPD_DEFAULT = Path("/etc/default/hostapd")
 DNSMASQ_AP_CONF = Path("/etc/dnsmasq.d/ap.conf")
 SYSCTL_AP_CONF = Path("/etc/sysctl.d/99-ap-forward.conf")
 DEFAULT_CAPTURE_DIR = Path("/home/ubu/Documentos/github/ubu-edge-ai-network-security-lab/pcaps")
+IP_FORWARD = Path("/proc/sys/net/ipv4/ip_forward")
+SERVICES = ["hostapd", "dnsmasq"]
+
+# Comandos (y su stdin) que se habrían ejecutado con --dry-run (para pruebas)
+DRY_RUN_LOG: List[Tuple[List[str], Optional[str]]] = []
 
 
 @dataclass
@@ -53,16 +68,24 @@ class APConfig:
 	capture_duration_sec: int
 	capture_filesize_kb: int
 	capture_files: int
+	capture_tool: str
+	archive_dir: Optional[Path]
+	archive_budget_gb: float
 	dry_run: bool
 	no_services: bool
 
 
-def run_cmd(cmd: List[str], dry_run: bool = False, check: bool = True) -> subprocess.CompletedProcess:
+def run_cmd(
+	cmd: List[str], dry_run: bool = False, check: bool = True, input_text: Optional[str] = None
+) -> subprocess.CompletedProcess:
 	pretty = " ".join(cmd)
 	print(f"$ {pretty}")
+	if input_text is not None:
+		print("\n".join(f"  {line}" for line in input_text.splitlines()))
 	if dry_run:
+		DRY_RUN_LOG.append((cmd, input_text))
 		return subprocess.CompletedProcess(cmd, 0, "", "")
-	return subprocess.run(cmd, check=check, text=True, capture_output=True)
+	return subprocess.run(cmd, check=check, text=True, capture_output=True, input=input_text)
 
 
 def require_root(dry_run: bool) -> None:
@@ -164,8 +187,8 @@ def backup_file(path: Path) -> None:
 		print(f"[INFO] Backup creado: {backup}")
 
 
-def write_hostapd(cfg: APConfig) -> None:
-	content = f"""interface={cfg.iface}
+def hostapd_conf(cfg: APConfig) -> str:
+	return f"""interface={cfg.iface}
 driver=nl80211
 ssid={cfg.ssid}
 hw_mode=g
@@ -181,6 +204,23 @@ rsn_pairwise=CCMP
 wpa_passphrase={cfg.passphrase}
 """
 
+
+def hostapd_default(text: str) -> str:
+	"""/etc/default/hostapd con DAEMON_CONF apuntando a HOSTAPD_CONF."""
+	line = f'DAEMON_CONF="{HOSTAPD_CONF}"'
+	lines = text.splitlines()
+	for i, l in enumerate(lines):
+		if l.strip().startswith("DAEMON_CONF="):
+			lines[i] = line
+			break
+	else:
+		lines.append(line)
+	return "\n".join(lines) + "\n"
+
+
+def write_hostapd(cfg: APConfig) -> None:
+	content = hostapd_conf(cfg)
+
 	if not cfg.dry_run:
 		backup_file(HOSTAPD_CONF)
 		HOSTAPD_CONF.parent.mkdir(parents=True, exist_ok=True)
@@ -190,31 +230,17 @@ wpa_passphrase={cfg.passphrase}
 		print(f"[DRY-RUN] Escribir {HOSTAPD_CONF}")
 
 	if HOSTAPD_DEFAULT.exists():
-		line = f'DAEMON_CONF="{HOSTAPD_CONF}"\n'
 		if not cfg.dry_run:
 			backup_file(HOSTAPD_DEFAULT)
 			text = HOSTAPD_DEFAULT.read_text(encoding="utf-8", errors="ignore")
-			lines = text.splitlines()
-			replaced = False
-			for i, l in enumerate(lines):
-				if l.strip().startswith("DAEMON_CONF="):
-					lines[i] = line.strip()
-					replaced = True
-					break
-			if not replaced:
-				lines.append(line.strip())
-			HOSTAPD_DEFAULT.write_text("\n".join(lines) + "\n", encoding="utf-8")
+			HOSTAPD_DEFAULT.write_text(hostapd_default(text), encoding="utf-8")
 			print(f"[OK] hostapd default: {HOSTAPD_DEFAULT}")
 		else:
 			print(f"[DRY-RUN] Actualizar {HOSTAPD_DEFAULT}")
 
 
-def write_dnsmasq(cfg: APConfig) -> None:
-	# Extrae red base del CIDR esperado (ej. 192.168.50.1/24 -> 192.168.50.0)
-	ip_base = cfg.ap_ip_cidr.split("/")[0].split(".")
-	network = f"{ip_base[0]}.{ip_base[1]}.{ip_base[2]}.0"
-
-	content = f"""interface={cfg.iface}
+def dnsmasq_conf(cfg: APConfig) -> str:
+	return f"""interface={cfg.iface}
 bind-interfaces
 domain-needed
 bogus-priv
@@ -224,6 +250,13 @@ dhcp-option=6,{cfg.ap_ip_cidr.split('/')[0]}
 address=/gw.local/{cfg.ap_ip_cidr.split('/')[0]}
 """
 
+
+def write_dnsmasq(cfg: APConfig) -> None:
+	# Extrae red base del CIDR esperado (ej. 192.168.50.1/24 -> 192.168.50.0)
+	ip_base = cfg.ap_ip_cidr.split("/")[0].split(".")
+	network = f"{ip_base[0]}.{ip_base[1]}.{ip_base[2]}.0"
+	content = dnsmasq_conf(cfg)
+
 	if not cfg.dry_run:
 		backup_file(DNSMASQ_AP_CONF)
 		DNSMASQ_AP_CONF.parent.mkdir(parents=True, exist_ok=True)
@@ -252,31 +285,34 @@ def enable_ip_forward(cfg: APConfig) -> None:
 
 def ensure_iptables_rule(base_cmd: List[str], add_cmd: List[str], dry_run: bool) -> None:
 	if dry_run:
-		print(f"$ {' '.join(add_cmd)}")
+		run_cmd(add_cmd, dry_run)
 		return
 	check = subprocess.run(base_cmd, text=True, capture_output=True)
 	if check.returncode != 0:
 		subprocess.run(add_cmd, check=True, text=True, capture_output=True)
 
 
-def configure_nat(cfg: APConfig) -> None:
-	ensure_iptables_rule(
-		["iptables", "-t", "nat", "-C", "POSTROUTING", "-o", cfg.uplink_iface, "-j", "MASQUERADE"],
-		["iptables", "-t", "nat", "-A", "POSTROUTING", "-o", cfg.uplink_iface, "-j", "MASQUERADE"],
-		cfg.dry_run,
-	)
+def nat_rules(cfg: APConfig) -> Dict[str, List[str]]:
+	"""Reglas de NAT/forward por tabla, tal como las imprime iptables-save."""
+	return {
+		"nat": [f"-A POSTROUTING -o {cfg.uplink_iface} -j MASQUERADE"],
+		"filter": [
+			f"-A FORWARD -i {cfg.uplink_iface} -o {cfg.iface} -m state --state RELATED,ESTABLISHED -j ACCEPT",
+			f"-A FORWARD -i {cfg.iface} -o {cfg.uplink_iface} -j ACCEPT",
+		],
+	}
 
-	ensure_iptables_rule(
-		["iptables", "-C", "FORWARD", "-i", cfg.uplink_iface, "-o", cfg.iface, "-m", "state", "--state", "RELATED,ESTABLISHED", "-j", "ACCEPT"],
-		["iptables", "-A", "FORWARD", "-i", cfg.uplink_iface, "-o", cfg.iface, "-m", "state", "--state", "RELATED,ESTABLISHED", "-j", "ACCEPT"],
-		cfg.dry_run,
-	)
 
-	ensure_iptables_rule(
-		["iptables", "-C", "FORWARD", "-i", cfg.iface, "-o", cfg.uplink_iface, "-j", "ACCEPT"],
-		["iptables", "-A", "FORWARD", "-i", cfg.iface, "-o", cfg.uplink_iface, "-j", "ACCEPT"],
-		cfg.dry_run,
-	)
+def configure_nat(cfg: APConfig) -> None:
+	for table, rules in nat_rules(cfg).items():
+		for rule in rules:
+			# "-A CHAIN ..." -> iptables -t TABLE -C CHAIN ... / -A CHAIN ...
+			args = rule.split()
+			ensure_iptables_rule(
+				["iptables", "-t", table, "-C"] + args[1:],
+				["iptables", "-t", table] + args,
+				cfg.dry_run,
+			)
 	print("[OK] NAT/forward configurado con iptables")
 
 
@@ -289,11 +325,12 @@ def start_services(cfg: APConfig) -> None:
 	run_cmd(["systemctl", "restart", "hostapd", "dnsmasq"], cfg.dry_run)
 
 
-def start_tshark_capture(cfg: APConfig) -> None:
+def start_capture(cfg: APConfig) -> None:
 	timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
 	pcap_file = cfg.capture_dir / f"{cfg.capture_prefix}-{cfg.iface}-{timestamp}.pcapng"
+	# dumpcap sólo escribe bloques pcapng (sin disección): es lo que usa tshark por debajo
 	base_cmd = [
-		"tshark",
+		cfg.capture_tool,
 		"-i",
 		cfg.iface,
 		"-w",
@@ -305,29 +342,238 @@ def start_tshark_capture(cfg: APConfig) -> None:
 		"-b",
 		f"files:{cfg.capture_files}",
 	]
+	if cfg.capture_tool == "dumpcap":
+		base_cmd.append("-q")
 	sudo_user = os.environ.get("SUDO_USER")
 	cmd = base_cmd
 	if not cfg.dry_run and os.geteuid() == 0 and sudo_user and sudo_user != "root":
 		cmd = ["sudo", "-u", sudo_user] + base_cmd
 
 	if cfg.dry_run:
-		print("$ " + " ".join(cmd))
+		run_cmd(cmd, dry_run=True)
 		return
 
 	cfg.capture_dir.mkdir(parents=True, exist_ok=True)
 	if sudo_user:
 		run_cmd(["chown", f"{sudo_user}:{sudo_user}", str(cfg.capture_dir)], dry_run=False, check=False)
 		run_cmd(["chmod", "775", str(cfg.capture_dir)], dry_run=False, check=False)
-	log_file = cfg.capture_dir / f"tshark-{cfg.iface}.log"
+	log_file = cfg.capture_dir / f"{cfg.capture_tool}-{cfg.iface}.log"
 	with log_file.open("ab") as log:
 		proc = subprocess.Popen(cmd, stdout=log, stderr=log, start_new_session=True)
-	print(f"[OK] tshark en background (PID {proc.pid})")
+	print(f"[OK] {cfg.capture_tool} en background (PID {proc.pid})")
 	print(f"[OK] PCAP base: {pcap_file}")
-	print(f"[OK] Log tshark: {log_file}")
+	print(f"[OK] Log {cfg.capture_tool}: {log_file}")
+
+
+def archiver_cmd(cfg: APConfig) -> List[str]:
+	assert cfg.archive_dir is not None
+	script = Path(__file__).resolve().parent / "capture_archive.py"
+	return [
+		sys.executable,
+		"-u",
+		str(script),
+		"--capture-dir",
+		str(cfg.capture_dir),
+		"--archive-dir",
+		str(cfg.archive_dir),
+		"--budget-gb",
+		f"{cfg.archive_budget_gb:g}",
+	]
+
+
+def start_archiver(cfg: APConfig) -> None:
+	if cfg.archive_dir is None:
+		return
+	cmd = archiver_cmd(cfg)
+	if cfg.dry_run:
+		run_cmd(cmd, dry_run=True)
+		return
+	cfg.archive_dir.mkdir(parents=True, exist_ok=True)
+	log_file = cfg.archive_dir / "capture_archive.log"
+	with log_file.open("ab") as log:
+		proc = subprocess.Popen(cmd, stdout=log, stderr=log, start_new_session=True)
+	print(f"[OK] Archivador en background (PID {proc.pid}): {cfg.archive_dir}, máx. {cfg.archive_budget_gb:g} GB")
+	print(f"[OK] Log archivador: {log_file}")
+
+
+@dataclass
+class HostState:
+	"""Estado actual del equipo, leído una sola vez al empezar."""
+
+	addrs: Set[str] = field(default_factory=set)
+	link_up: bool = False
+	iptables: Dict[str, Set[str]] = field(default_factory=dict)
+	ip_forward: bool = False
+	active: Dict[str, str] = field(default_factory=dict)
+	enabled: Dict[str, str] = field(default_factory=dict)
+	capture_running: bool = False
+	archiver_running: bool = False
+
+
+def read_cmd(cmd: List[str]) -> Optional[str]:
+	"""stdout de una lectura de estado; None si el comando no existe o falla."""
+	try:
+		proc = subprocess.run(cmd, text=True, capture_output=True, timeout=10)
+	except (OSError, subprocess.TimeoutExpired):
+		return None
+	return proc.stdout if proc.returncode == 0 or proc.stdout else None
+
+
+def parse_iptables_save(text: str) -> Dict[str, Set[str]]:
+	rules: Dict[str, Set[str]] = {}
+	table = ""
+	for line in text.splitlines():
+		if line.startswith("*"):
+			table = line[1:].strip()
+			rules.setdefault(table, set())
+		elif line.startswith("-A ") and table:
+			rules[table].add(" ".join(line.split()))
+	return rules
+
+
+def read_host_state(cfg: APConfig) -> HostState:
+	"""Lanza las lecturas en paralelo: ip, iptables-save, systemctl y pgrep."""
+	units = SERVICES
+	with concurrent.futures.ThreadPoolExecutor(max_workers=6) as pool:
+		addr = pool.submit(read_cmd, ["ip", "-j", "addr", "show", "dev", cfg.iface])
+		rules = pool.submit(read_cmd, ["iptables-save"])
+		active = pool.submit(read_cmd, ["systemctl", "is-active"] + units)
+		enabled = pool.submit(read_cmd, ["systemctl", "is-enabled"] + units)
+		capture = pool.submit(read_cmd, ["pgrep", "-f", f"{cfg.capture_tool} -i {cfg.iface} "])
+		archiver = pool.submit(read_cmd, ["pgrep", "-f", f"capture_archive.py --capture-dir {cfg.capture_dir} "])
+
+	state = HostState()
+	try:
+		links = json.loads(addr.result() or "[]")
+	except ValueError:
+		links = []
+	for link in links:
+		state.link_up = state.link_up or "UP" in link.get("flags", [])
+		for info in link.get("addr_info", []):
+			if info.get("family") == "inet":
+				state.addrs.add(f"{info['local']}/{info['prefixlen']}")
+	state.iptables = parse_iptables_save(rules.result() or "")
+	state.active = dict(zip(units, (active.result() or "").split()))
+	state.enabled = dict(zip(units, (enabled.result() or "").split()))
+	state.capture_running = bool((capture.result() or "").strip())
+	state.archiver_running = bool((archiver.result() or "").strip())
+	try:
+		state.ip_forward = IP_FORWARD.read_text().strip() == "1"
+	except OSError:
+		pass
+	return state
+
+
+def sync_file(path: Path, content: str, dry_run: bool) -> bool:
+	"""Escribe ``content`` sólo si difiere de lo que hay; devuelve si cambió."""
+	try:
+		current = path.read_text(encoding="utf-8", errors="ignore")
+	except OSError:
+		current = None
+	if current == content:
+		return False
+	if dry_run:
+		print(f"[DRY-RUN] Escribir {path}")
+		return True
+	backup_file(path)
+	path.parent.mkdir(parents=True, exist_ok=True)
+	path.write_text(content, encoding="utf-8")
+	print(f"[OK] Actualizado: {path}")
+	return True
+
+
+def reconcile_interface(cfg: APConfig, state: HostState) -> bool:
+	"""Devuelve si cambió la IP (dnsmasq con bind-interfaces debe reiniciarse)."""
+	if cfg.ap_ip_cidr in state.addrs and state.link_up:
+		print(f"[OK] {cfg.iface} ya tiene {cfg.ap_ip_cidr}")
+		return False
+	# Sólo se quitan las IPv4 que sobran; la del AP no se toca si ya estaba
+	commands = [f"addr del {a} dev {cfg.iface}" for a in sorted(state.addrs) if a != cfg.ap_ip_cidr]
+	if cfg.ap_ip_cidr not in state.addrs:
+		commands.append(f"addr replace {cfg.ap_ip_cidr} dev {cfg.iface}")
+	commands.append(f"link set {cfg.iface} up")
+	run_cmd(["ip", "-batch", "-"], cfg.dry_run, input_text="\n".join(commands) + "\n")
+	return cfg.ap_ip_cidr not in state.addrs
+
+
+def reconcile_forward(cfg: APConfig, state: HostState) -> None:
+	if not state.ip_forward:
+		run_cmd(["sysctl", "-w", "net.ipv4.ip_forward=1"], cfg.dry_run)
+	sync_file(SYSCTL_AP_CONF, "net.ipv4.ip_forward=1\n", cfg.dry_run)
+
+
+def reconcile_nat(cfg: APConfig, state: HostState) -> None:
+	"""Todas las reglas que faltan en un único iptables-restore (atómico por tabla)."""
+	missing = {
+		table: [r for r in wanted if r not in state.iptables.get(table, set())]
+		for table, wanted in nat_rules(cfg).items()
+	}
+	blocks = [f"*{table}\n" + "".join(r + "\n" for r in rules) + "COMMIT\n" for table, rules in missing.items() if rules]
+	if not blocks:
+		print("[OK] NAT/forward ya configurado")
+		return
+	run_cmd(["iptables-restore", "--noflush"], cfg.dry_run, input_text="".join(blocks))
+	print(f"[OK] NAT/forward: {sum(len(r) for r in missing.values())} reglas añadidas")
+
+
+def reconcile_services(cfg: APConfig, state: HostState, changed: Set[str]) -> None:
+	if cfg.no_services:
+		print("[INFO] Se omitió arranque de servicios (--no-services).")
+		return
+	if state.enabled.get("hostapd") == "masked":
+		run_cmd(["systemctl", "unmask", "hostapd"], cfg.dry_run)
+	to_enable = [u for u in SERVICES if state.enabled.get(u) != "enabled"]
+	if to_enable:
+		run_cmd(["systemctl", "enable"] + to_enable, cfg.dry_run)
+	restart = [u for u in SERVICES if u in changed or state.active.get(u) != "active"]
+	if restart:
+		run_cmd(["systemctl", "restart"] + restart, cfg.dry_run)
+	else:
+		print("[OK] hostapd y dnsmasq ya activos con esta configuración")
+
+
+def reconcile(cfg: APConfig) -> None:
+	"""Aplica sólo las diferencias entre el estado actual y ``cfg``."""
+	state = read_host_state(cfg)
+
+	changed: Set[str] = set()
+	if sync_file(HOSTAPD_CONF, hostapd_conf(cfg), cfg.dry_run):
+		changed.add("hostapd")
+	if HOSTAPD_DEFAULT.exists():
+		text = HOSTAPD_DEFAULT.read_text(encoding="utf-8", errors="ignore")
+		if sync_file(HOSTAPD_DEFAULT, hostapd_default(text), cfg.dry_run):
+			changed.add("hostapd")
+	if sync_file(DNSMASQ_AP_CONF, dnsmasq_conf(cfg), cfg.dry_run):
+		changed.add("dnsmasq")
+
+	# IP, forwarding y NAT no dependen entre sí
+	with concurrent.futures.ThreadPoolExecutor(max_workers=3) as pool:
+		iface_step = pool.submit(reconcile_interface, cfg, state)
+		steps = [pool.submit(reconcile_forward, cfg, state), pool.submit(reconcile_nat, cfg, state)]
+		if iface_step.result():
+			changed.add("dnsmasq")
+		for step in steps:
+			step.result()
+
+	# Servicios y captura necesitan la interfaz lista; la captura, además,
+	# espera a que hostapd haya dejado la interfaz en modo AP
+	reconcile_services(cfg, state, changed)
+	if state.capture_running:
+		print(f"[OK] {cfg.capture_tool} ya está capturando en {cfg.iface}")
+	if cfg.archive_dir is not None and state.archiver_running:
+		print(f"[OK] El archivador ya está en marcha sobre {cfg.capture_dir}")
+	with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+		steps = []
+		if not state.capture_running:
+			steps.append(pool.submit(start_capture, cfg))
+		if not state.archiver_running:
+			steps.append(pool.submit(start_archiver, cfg))
+		for step in steps:
+			step.result()
 
 
 def parse_args() -> argparse.Namespace:
-	parser = argparse.ArgumentParser(description="Configura un AP Wi-Fi USB y captura tráfico con tshark")
+	parser = argparse.ArgumentParser(description="Configura un AP Wi-Fi USB y captura tráfico con dumpcap/tshark")
 	parser.add_argument("--iface", help="Interfaz Wi-Fi para AP (auto si se omite)")
 	parser.add_argument("--uplink", help="Interfaz de salida a Internet (auto si se omite)")
 	parser.add_argument("--ssid", default="UBU-Edge-AI-Lab")
@@ -343,7 +589,28 @@ def parse_args() -> argparse.Namespace:
 	parser.add_argument("--capture-duration", type=int, default=300, help="Rotación por duración (s)")
 	parser.add_argument("--capture-filesize", type=int, default=102400, help="Rotación por tamaño (KB)")
 	parser.add_argument("--capture-files", type=int, default=20, help="Número de ficheros en anillo")
+	parser.add_argument(
+		"--capture-tool",
+		choices=["dumpcap", "tshark"],
+		default="dumpcap",
+		help="Captura del anillo: dumpcap (sin disección, menos CPU) o tshark",
+	)
+	parser.add_argument(
+		"--archive-dir",
+		help="Lanza capture_archive.py: comprime e indexa cada PCAP al rotar y lo mueve aquí",
+	)
+	parser.add_argument(
+		"--archive-budget-gb",
+		type=float,
+		default=20.0,
+		help="Espacio máximo del archivo comprimido (se borran los más antiguos)",
+	)
 	parser.add_argument("--no-services", action="store_true", help="No iniciar hostapd/dnsmasq")
+	parser.add_argument(
+		"--reconcile",
+		action="store_true",
+		help="Lee el estado actual y aplica sólo lo que falta (sin reiniciar servicios ni la interfaz si no cambian)",
+	)
 	parser.add_argument("--dry-run", action="store_true", help="Muestra comandos sin aplicar cambios")
 	return parser.parse_args()
 
@@ -355,6 +622,14 @@ def validate_args(args: argparse.Namespace) -> None:
 	if args.channel < 1 or args.channel > 165:
 		print("[ERROR] --channel fuera de rango válido (1-165).")
 		sys.exit(1)
+	try:
+		ipaddress.ip_interface(args.ap_ip)
+	except ValueError:
+		print("[ERROR] --ap-ip debe ser IP/CIDR (ej. 192.168.50.1/24).")
+		sys.exit(1)
+	if args.archive_budget_gb <= 0:
+		print("[ERROR] --archive-budget-gb debe ser > 0.")
+		sys.exit(1)
 
 
 def main() -> None:
@@ -362,7 +637,7 @@ def main() -> None:
 	validate_args(args)
 
 	require_root(args.dry_run)
-	require_binaries(["ip", "iw", "iptables", "systemctl", "hostapd", "dnsmasq", "tshark", "sysctl"], args.dry_run)
+	require_binaries(["ip", "iw", "iptables", "systemctl", "hostapd", "dnsmasq", args.capture_tool, "sysctl"], args.dry_run)
 
 	ap_iface = autodetect_ap_iface(args.iface)
 	uplink = autodetect_uplink_iface(args.uplink, ap_iface)
@@ -383,10 +658,21 @@ def main() -> None:
 		capture_duration_sec=args.capture_duration,
 		capture_filesize_kb=args.capture_filesize,
 		capture_files=args.capture_files,
+		capture_tool=args.capture_tool,
+		archive_dir=Path(args.archive_dir).expanduser().resolve() if args.archive_dir else None,
+		archive_budget_gb=args.archive_budget_gb,
 		dry_run=args.dry_run,
 		no_services=args.no_services,
 	)
 
+	if args.reconcile:
+		print("[INFO] Reconciliando configuración AP...")
+		reconcile(cfg)
+		print("\n[OK] Configuración reconciliada.")
+		print(f"[INFO] AP interface: {cfg.iface}")
+		print(f"[INFO] Uplink interface: {cfg.uplink_iface}")
+		return
+
 	print("[INFO] Iniciando configuración AP...")
 	write_hostapd(cfg)
 	write_dnsmasq(cfg)
@@ -394,7 +680,8 @@ def main() -> None:
 	enable_ip_forward(cfg)
 	configure_nat(cfg)
 	start_services(cfg)
-	start_tshark_capture(cfg)
+	start_capture(cfg)
+	start_archiver(cfg)
 
 	print("\n[OK] Configuración completada.")
 	print(f"[INFO] AP interface: {cfg.iface}")
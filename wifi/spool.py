@@ -0,0 +1,240 @@
+"""
+Spool local en disco para lotes pendientes de subir a Supabase.
+
+Formato:
+- Directorio con segmentos ``seg-<n>.open`` (el que se está escribiendo) y
+  ``seg-<n>.spool`` (sellados, listos para reenviar).
+- Cada segmento es una secuencia de registros: 4 bytes big-endian con la
+  longitud + lote JSON comprimido con zlib.
+
+Un segmento sólo se borra cuando todos sus lotes han recibido un 2xx. Si el
+proceso muere a mitad de un segmento, al reanudar se reenvía entero (puede
+duplicar filas del último segmento parcialmente enviado).
+
+Un lote rechazado de forma permanente (4xx salvo 408/429: esquema, tamaño...)
+no se reintenta: se aparta en ``bad-<segmento>`` con el mismo formato, para
+revisarlo a mano, y el drainer sigue con el resto.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+RECORD_HEADER = struct.Struct(">I")
+OPEN_SUFFIX = ".open"
+SEALED_SUFFIX = ".spool"
+REJECTED_PREFIX = "bad-"
+
+
+def read_segment(path: Path) -> Iterator[List[Dict[str, Any]]]:
+    """Itera los lotes de un segmento; ignora un último registro truncado."""
+    with path.open("rb") as fh:
+        while True:
+            header = fh.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            (length,) = RECORD_HEADER.unpack(header)
+            payload = fh.read(length)
+            if len(payload) < length:
+                print(f"[WARN] Segmento truncado, se ignora el final: {path}")
+                return
+            try:
+                yield json.loads(zlib.decompress(payload))
+            except (zlib.error, ValueError):
+                print(f"[WARN] Lote corrupto en {path}, se descarta el resto del segmento")
+                return
+
+
+def append_record(path: Path, rows: List[Dict[str, Any]]) -> None:
+    payload = zlib.compress(json.dumps(rows, separators=(",", ":")).encode("utf-8"), 1)
+    with path.open("ab") as fh:
+        fh.write(RECORD_HEADER.pack(len(payload)))
+        fh.write(payload)
+
+
+class Spool:
+    """Cola append-only en disco, segmentada y con tope de tamaño."""
+
+    def __init__(self, directory: Path, max_bytes: int, segment_bytes: int = 8 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._fh: Optional[Any] = None
+        self._open_path: Optional[Path] = None
+        self._open_since = 0.0
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        # Segmentos abiertos de una ejecución anterior: se sellan tal cual
+        for leftover in sorted(self.directory.glob(f"seg-*{OPEN_SUFFIX}")):
+            leftover.rename(leftover.with_suffix(SEALED_SUFFIX))
+        existing = [int(p.stem.split("-", 1)[1]) for p in self.sealed_segments()]
+        self._next_seq = max(existing, default=0) + 1
+
+    def sealed_segments(self) -> List[Path]:
+        return sorted(self.directory.glob(f"seg-*{SEALED_SUFFIX}"))
+
+    def size_bytes(self) -> int:
+        total = 0
+        for p in self.directory.glob("seg-*"):
+            try:
+                total += p.stat().st_size
+            except FileNotFoundError:
+                pass  # el drainer lo acaba de borrar
+        return total
+
+    def append(self, body: str) -> None:
+        """Añade un lote ya serializado como JSON (array de filas)."""
+        payload = zlib.compress(body.encode("utf-8"), 1)
+        with self._lock:
+            if self._fh is None:
+                self._open_path = self.directory / f"seg-{self._next_seq:012d}{OPEN_SUFFIX}"
+                self._next_seq += 1
+                self._fh = self._open_path.open("ab")
+                self._open_since = time.monotonic()
+            self._fh.write(RECORD_HEADER.pack(len(payload)))
+            self._fh.write(payload)
+            self._fh.flush()
+            if self._fh.tell() >= self.segment_bytes:
+                self._seal_locked()
+        self._enforce_cap()
+
+    def has_open_data(self) -> bool:
+        return self._fh is not None
+
+    def open_age(self) -> float:
+        return time.monotonic() - self._open_since if self._fh is not None else 0.0
+
+    def seal(self) -> None:
+        with self._lock:
+            self._seal_locked()
+
+    def _seal_locked(self) -> None:
+        if self._fh is None or self._open_path is None:
+            return
+        os.fsync(self._fh.fileno())
+        self._fh.close()
+        self._open_path.rename(self._open_path.with_suffix(SEALED_SUFFIX))
+        self._fh = None
+        self._open_path = None
+
+    def _enforce_cap(self) -> None:
+        # Sin conexión durante mucho tiempo: se sacrifican los datos más antiguos
+        while self.size_bytes() > self.max_bytes:
+            sealed = self.sealed_segments()
+            if not sealed:
+                return
+            oldest = sealed[0]
+            try:
+                size = oldest.stat().st_size
+                oldest.unlink()
+            except FileNotFoundError:
+                continue
+            print(f"[WARN] Spool lleno, descartado {oldest.name} ({size} bytes)")
+
+
+class SpoolDrainer:
+    """Hilo que reenvía los segmentos sellados con backoff exponencial."""
+
+    def __init__(
+        self,
+        spool: Spool,
+        send: Callable[[Any, List[Dict[str, Any]]], None],
+        make_client: Callable[[], Any],
+        should_stop: Callable[[], bool],
+        permanent: Callable[[BaseException], bool] = lambda exc: False,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        idle_seal_sec: float = 2.0,
+    ) -> None:
+        self.spool = spool
+        self._send = send
+        self._make_client = make_client
+        self._should_stop = should_stop
+        self._permanent = permanent
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.idle_seal_sec = idle_seal_sec
+        self.sent = 0
+        self.rejected = 0
+        self._wake = threading.Event()
+        self._draining = False
+        self._thread = threading.Thread(target=self._run, name="spool-drainer", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Pide vaciar el spool y espera a que termine (o a STOP)."""
+        self._draining = True
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        client = self._make_client()
+        try:
+            while not self._should_stop():
+                segments = self.spool.sealed_segments()
+                if not segments:
+                    if self.spool.has_open_data() and (self._draining or self.spool.open_age() >= self.idle_seal_sec):
+                        self.spool.seal()
+                        continue
+                    if self._draining and not self.spool.has_open_data():
+                        return
+                    self._wake.wait(0.5)
+                    self._wake.clear()
+                    continue
+                for segment in segments:
+                    if not self._drain_segment(client, segment):
+                        return
+        finally:
+            close = getattr(client, "close", None)
+            if close is not None:
+                close()
+
+    def _drain_segment(self, client: Any, segment: Path) -> bool:
+        try:
+            batches = list(read_segment(segment))
+        except FileNotFoundError:
+            return True  # descartado por el tope de tamaño
+        for rows in batches:
+            sent = self._send_with_retry(client, segment, rows)
+            if sent is None:
+                return False
+            if sent:
+                self.sent += len(rows)
+                print(f"[OK] Filas reenviadas desde spool: {self.sent}")
+        segment.unlink(missing_ok=True)
+        return True
+
+    def _send_with_retry(self, client: Any, segment: Path, rows: List[Dict[str, Any]]) -> Optional[bool]:
+        """True si el lote llegó, False si se apartó por rechazo, None si hay que parar."""
+        attempt = 0
+        while True:
+            if self._should_stop():
+                return None
+            try:
+                self._send(client, rows)
+                return True
+            except Exception as exc:
+                if self._permanent(exc):
+                    bad = segment.with_name(REJECTED_PREFIX + segment.name)
+                    append_record(bad, rows)
+                    self.rejected += len(rows)
+                    print(f"[ERROR] Lote de {len(rows)} filas rechazado ({exc}); apartado en {bad}")
+                    return False
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                delay *= 1 + random.random() * 0.1
+                attempt += 1
+                print(f"[WARN] Reintento {attempt} de {segment.name} en {delay:.1f}s: {exc}")
+                deadline = time.monotonic() + delay
+                while time.monotonic() < deadline and not self._should_stop():
+                    time.sleep(min(0.2, deadline - time.monotonic()))
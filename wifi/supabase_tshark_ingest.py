@@ -3,8 +3,12 @@
 Ingesta de tráfico de red hacia Supabase desde tshark.
 
 Modos:
-1) posterior: lee un .pcap/.pcapng (modo file)
+1) posterior: lee un .pcap/.pcapng o un .gz del archivo, entero o un rango --from/--to (modo file)
 2) tiempo real: escucha una interfaz en vivo (modo live)
+3) reenvío: sube lo pendiente en el spool local (modo replay)
+4) anillo: ingiere en paralelo los PCAPs rotados de un directorio (modo dir)
+5) seguimiento: lee el fichero que dumpcap está escribiendo (modo tail)
+6) importación: sube una exportación JSON de network_packets (modo import)
 
 Tabla destino esperada: public.network_packets
 Campos mínimos enviados:
@@ -13,21 +17,36 @@ Campos mínimos enviados:
 Variables requeridas:
 - SUPABASE_URL (ej: http://ubuserver:8000)
 - SUPABASE_API_KEY (anon o service role)
+- con --influx: INFLUX_URL, INFLUX_TOKEN, INFLUX_ORG, INFLUX_BUCKET
 """
 
 from __future__ import annotations
 
 import argparse
+import codecs
+import collections
+import concurrent.futures
+import dataclasses
 import datetime as dt
+import hashlib
+import ipaddress
+import itertools
 import json
+import math
 import os
+import queue
+import select
 import shutil
 import signal
+import socket
 import subprocess
 import sys
+import threading
+import time
+import uuid
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 try:
     import requests
@@ -35,8 +54,30 @@ except ImportError:
     print("[ERROR] Falta dependencia 'requests'. Instala con: pip install requests")
     sys.exit(1)
 
+import capture_archive
+import columnar
+import json_stream
+import pcap_reader
+import pcap_split
+from attack_chains import ChainIndex, row_epoch
+from capture_ring import DirectoryWatcher, RingTail, closed_ring_files, list_ring_files
+from collector_proto import CollectorClient, encode_block
+from dedup import RotatingBloom, packet_id
+from detection import TACTICS, Detector
+from embeddings import EmbeddingCache, build_embedder, text_content, vector_literal
+from enrichment import DEFAULT_LEASES, Enricher, LeaseTable, build_trie
+from flows import FlowTable
+from heavy_hitters import TopTalkers
+from influx_sink import InfluxWriter, WindowAggregator
+from ingest_metrics import MetricsServer, PeriodicReporter, Registry, StderrWatcher
+from pg_partitions import PartitionManager, add_partition_args, describe_error, epoch_range, validate_partition_args
+from pg_sink import PgCopyWriter, load_driver, primary_key
+from spool import Spool, SpoolDrainer
+
 
 STOP = False
+# Frames por tramo con --decode-jobs (del orden de segundos de tshark cada uno)
+SPLIT_CHUNK_FRAMES = 50_000
 
 
 def _handle_sigterm(sig: int, frame: Any) -> None:
@@ -49,6 +90,22 @@ signal.signal(signal.SIGINT, _handle_sigterm)
 signal.signal(signal.SIGTERM, _handle_sigterm)
 
 
+METRICS = Registry()
+LINES_READ = METRICS.counter("ingest_lines_read_total", "Líneas leídas de la salida de tshark")
+ROWS_DECODED = METRICS.counter("ingest_rows_decoded_total", "Filas decodificadas")
+ROWS_REJECTED = METRICS.counter("ingest_rows_rejected_total", "Líneas descartadas al decodificar (sin src/dst)")
+ROWS_FLAGGED = METRICS.counter("ingest_rows_flagged_total", "Filas marcadas por --detect", ("technique",))
+ROWS_DUPLICATE = METRICS.counter("ingest_rows_duplicate_total", "Filas descartadas por --dedup (ya enviadas)")
+PARSE_SECONDS = METRICS.histogram("ingest_parse_seconds", "Decodificación de un bloque de líneas")
+BUILD_SECONDS = METRICS.histogram("ingest_batch_build_seconds", "Serialización JSON de un lote", ("table",))
+HTTP_RESPONSES = METRICS.counter("ingest_http_responses_total", "Respuestas de PostgREST por código", ("table", "code"))
+SEND_SECONDS = METRICS.histogram("ingest_send_seconds", "Envío de un lote (POST, COPY o escritura)", ("uploader",))
+ROWS_SENT = METRICS.counter("ingest_rows_sent_total", "Filas confirmadas por el destino", ("uploader",))
+BYTES_SENT = METRICS.counter("ingest_bytes_sent_total", "Bytes enviados", ("uploader",))
+QUEUE_DEPTH = METRICS.gauge("ingest_queue_depth", "Lotes en cola esperando subida", ("uploader",))
+TSHARK_DROPPED = METRICS.gauge("ingest_tshark_dropped_packets", "Paquetes perdidos según tshark/dumpcap")
+
+
 @dataclass
 class IngestConfig:
     supabase_url: str
@@ -60,6 +117,85 @@ class IngestConfig:
     pcap: Optional[Path]
     limit: Optional[int]
     dry_run: bool
+    workers: int = 2
+    max_inflight: int = 4
+    spool_dir: Optional[Path] = None
+    spool_max_mb: int = 512
+    resume: bool = True
+    state_dir: Optional[Path] = None
+    capture_dir: Optional[Path] = None
+    jobs: int = 1
+    watch: bool = False
+    idle_close_sec: float = 120.0
+    tail_from: str = "current"
+    decode_jobs: int = 1
+    reader: str = "tshark"
+    protocol_from: str = "native"
+    decoder: str = "columnar"
+    flows: bool = False
+    flow_table: str = "network_flows"
+    flow_idle_timeout: float = 30.0
+    flow_active_timeout: float = 300.0
+    flow_max: int = 100_000
+    send_packets: bool = True
+    influx: bool = False
+    influx_windows: Tuple[int, ...] = (5, 30)
+    influx_lateness: float = 10.0
+    sensor_id: str = ""
+    embeddings: bool = False
+    embedding_table: str = "network_packet_embeddings"
+    embedder: str = "hashing"
+    embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"
+    embedding_cache: Optional[Path] = None
+    embedding_cache_size: int = 50_000
+    dedup: bool = False
+    dedup_file: Optional[Path] = None
+    dedup_capacity: int = 1_000_000
+    dedup_error: float = 0.001
+    dedup_window: int = 5_000_000
+    dedup_save: bool = True
+    detect: bool = False
+    detect_window: float = 60.0
+    detect_scan_ports: int = 100
+    detect_scan_hosts: int = 64
+    detect_exfil_mb: float = 20.0
+    detect_max_sources: int = 4096
+    top_talkers: bool = False
+    top_k: int = 10
+    top_interval: float = 60.0
+    top_table: str = "network_top_talkers"
+    top_file: Optional[Path] = None
+    chains: bool = False
+    chain_ttl: float = 3600.0
+    chain_max: int = 100_000
+    chain_table: str = "attack_chain_status"
+    chain_file: Optional[Path] = None
+    enrich: bool = False
+    dhcp_leases: Path = DEFAULT_LEASES
+    ap_ip: str = "192.168.50.1/24"
+    enrich_cache_size: int = 65536
+    sink: str = "supabase"
+    pg_dsn: Optional[str] = None
+    collector_addr: Tuple[str, int] = ("", 7400)
+    collector_token: str = ""
+    collector_window: int = 64
+    import_json: Optional[Path] = None
+    import_exclude: Tuple[str, ...] = ("idx",)
+    time_from: Optional[float] = None
+    time_to: Optional[float] = None
+    partition_by: Optional[str] = None
+    partition_premake: int = 2
+    partition_retention_days: float = 0.0
+    partition_retention_action: str = "detach"
+    # False en los procesos de --mode dir: el padre ya convirtió la tabla y lleva la retención
+    partition_bootstrap: bool = True
+    linger_ms: int = 0
+    adaptive_batch: bool = False
+    target_post_ms: float = 500.0
+    max_batch_bytes: int = 1024 * 1024
+    metrics_port: int = 0
+    metrics_host: str = "127.0.0.1"
+    stats_interval: float = 0.0
 
 
 def require_tshark() -> None:
@@ -122,7 +258,7 @@ def load_dotenv_if_exists() -> None:
         return
 
 
-def build_tshark_cmd(cfg: IngestConfig) -> List[str]:
+def build_tshark_cmd(cfg: IngestConfig, skip_frames: int = 0) -> List[str]:
     base = [
         "tshark",
         "-n",  # no DNS reverse
@@ -157,6 +293,10 @@ def build_tshark_cmd(cfg: IngestConfig) -> List[str]:
         "data.text",
         "-e",
         "frame.number",
+        "-e",
+        "tcp.flags",
+        "-e",
+        "dns.flags.rcode",
     ]
 
     if cfg.mode == "live":
@@ -168,10 +308,13 @@ def build_tshark_cmd(cfg: IngestConfig) -> List[str]:
     if not cfg.pcap:
         print("[ERROR] --pcap es requerido en modo file")
         sys.exit(1)
+    if skip_frames:
+        # Reanudación: tshark sigue leyendo el fichero, pero no emite ni se suben los frames ya confirmados
+        return base + ["-r", str(cfg.pcap), "-Y", f"frame.number > {skip_frames}"]
     return base + ["-r", str(cfg.pcap)]
 
 
-def epoch_to_iso8601(epoch_text: str) -> str:
+def epoch_to_iso8601(epoch_text: Union[str, float]) -> str:
     val = float(epoch_text)
     t = dt.datetime.fromtimestamp(val, tz=dt.timezone.utc)
     return t.isoformat()
@@ -196,12 +339,24 @@ def first_scalar(value: str) -> str:
     return v.split(",", 1)[0].strip()
 
 
+def parse_tcp_flags(value: str) -> Optional[int]:
+    v = first_scalar(value)
+    if not v:
+        return None
+    try:
+        return int(v, 16) if v.lower().startswith("0x") else int(v)
+    except ValueError:
+        return None
+
+
 def to_record(parts: List[str], source: str) -> Optional[Dict[str, Any]]:
-    # Esperamos 11 columnas según build_tshark_cmd
+    # Esperamos 11 columnas según build_tshark_cmd (+ tcp.flags y dns.flags.rcode, opcionales)
     if len(parts) < 11:
         return None
 
     ts, src_ip, dst_ip, tcp_sp, udp_sp, tcp_dp, udp_dp, proto, frame_len, data_text, frame_number = parts[:11]
+    tcp_flags = parse_tcp_flags(parts[11]) if len(parts) > 11 else None
+    rcode = first_scalar(parts[12]) if len(parts) > 12 else ""
 
     src_ip = first_scalar(src_ip)
     dst_ip = first_scalar(dst_ip)
@@ -217,30 +372,205 @@ def to_record(parts: List[str], source: str) -> Optional[Dict[str, Any]]:
     except Exception:
         timestamp = dt.datetime.now(tz=dt.timezone.utc).isoformat()
 
-    record = {
+    return build_record(
+        timestamp=timestamp,
+        src_ip=src_ip,
+        dst_ip=dst_ip,
+        src_port=choose_port(tcp_sp, udp_sp),
+        dst_port=choose_port(tcp_dp, udp_dp),
+        protocol=protocol,
+        payload=payload,
+        payload_size=payload_size,
+        source=source,
+        frame_number=int(frame_number) if frame_number.strip().isdigit() else None,
+        tcp_flags=tcp_flags,
+        dns_rcode=int(rcode) if rcode.isdigit() else None,
+    )
+
+
+def header_to_record(header: pcap_reader.PacketHeader, source: str) -> Dict[str, Any]:
+    """Misma fila que to_record, a partir del lector nativo."""
+    if header.epoch is not None:
+        timestamp = epoch_to_iso8601(header.epoch)
+    else:
+        timestamp = dt.datetime.now(tz=dt.timezone.utc).isoformat()
+    return build_record(
+        timestamp=timestamp,
+        src_ip=header.src_ip,
+        dst_ip=header.dst_ip,
+        src_port=header.src_port,
+        dst_port=header.dst_port,
+        protocol=(header.protocol or "UNKNOWN")[:20],
+        payload=None,
+        payload_size=header.frame_len,
+        source=source,
+        frame_number=header.frame_number,
+        tcp_flags=header.tcp_flags,
+        dns_rcode=header.dns_rcode,
+    )
+
+
+def build_record(
+    timestamp: str,
+    src_ip: str,
+    dst_ip: str,
+    src_port: Optional[int],
+    dst_port: Optional[int],
+    protocol: str,
+    payload: Optional[str],
+    payload_size: int,
+    source: str,
+    frame_number: Optional[int],
+    tcp_flags: Optional[int] = None,
+    dns_rcode: Optional[int] = None,
+) -> Dict[str, Any]:
+    return {
         "timestamp": timestamp,
         "src_ip": src_ip,
         "dst_ip": dst_ip,
-        "src_port": choose_port(tcp_sp, udp_sp),
-        "dst_port": choose_port(tcp_dp, udp_dp),
+        "src_port": src_port,
+        "dst_port": dst_port,
         "protocol": protocol,
         "payload": payload,
         "payload_size": payload_size,
         "metadata": {
             "source": source,
-            "frame_number": int(frame_number) if frame_number.strip().isdigit() else None,
+            "frame_number": frame_number,
+            "tcp_flags": tcp_flags,
+            "dns_rcode": dns_rcode,
         },
     }
-    return record
 
 
-def post_batch(cfg: IngestConfig, rows: List[Dict[str, Any]]) -> None:
-    if not rows:
+# Un lote es una lista de filas (to_record) o un ColumnBatch del decodificador columnar
+Batch = Union[List[Dict[str, Any]], columnar.ColumnBatch]
+
+
+def encode_batch(rows: Batch) -> str:
+    if isinstance(rows, columnar.ColumnBatch):
+        return rows.to_json()
+    if rows and isinstance(rows[0], json_stream.ExportRow):
+        return json_stream.encode_rows(rows)
+    return json.dumps(rows)
+
+
+def batch_packets(rows: Batch) -> Iterator[Tuple[float, str, Optional[int], str, Optional[int], str, int, Optional[int]]]:
+    """(epoch, src_ip, src_port, dst_ip, dst_port, protocol, size, tcp_flags) de cada fila."""
+    if isinstance(rows, columnar.ColumnBatch):
+        yield from rows.packets()
         return
+    for row in rows:
+        yield (
+            dt.datetime.fromisoformat(row["timestamp"]).timestamp(),
+            row["src_ip"],
+            row["src_port"],
+            row["dst_ip"],
+            row["dst_port"],
+            row["protocol"],
+            row["payload_size"],
+            row["metadata"].get("tcp_flags"),
+        )
+
+
+def batch_window_samples(rows: Batch) -> Iterator[Tuple[Any, ...]]:
+    """Argumentos de ``WindowAggregator.add`` para cada fila del lote."""
+    if isinstance(rows, columnar.ColumnBatch):
+        scores = rows.score if rows.score is not None else itertools.repeat(None)
+        flagged = (t is not None for t in rows.technique) if rows.technique is not None else itertools.repeat(False)
+        for (epoch, src_ip, src_port, dst_ip, dst_port, protocol, size, _), rcode, malicious, score in zip(
+            rows.packets(), rows.dns_rcode, flagged, scores,
+        ):
+            yield (
+                epoch, protocol, size, (src_ip, src_port), (dst_ip, dst_port),
+                malicious, rcode if rcode != columnar.NO_RCODE else None, score,
+            )
+        return
+    for row, (epoch, src_ip, src_port, dst_ip, dst_port, protocol, size, _) in zip(rows, batch_packets(rows)):
+        metadata = row["metadata"]
+        yield (
+            epoch, protocol, size, (src_ip, src_port), (dst_ip, dst_port),
+            bool(row.get("is_malicious")), metadata.get("dns_rcode"), metadata.get("anomaly_score"),
+        )
+
+
+def batch_texts(rows: Batch) -> List[str]:
+    """``text_content`` de cada fila (ver embeddings.text_content)."""
+    if isinstance(rows, columnar.ColumnBatch):
+        return [
+            text_content(protocol, src_ip, src_port, dst_ip, dst_port, size, tcp_flags, payload)
+            for (_, src_ip, src_port, dst_ip, dst_port, protocol, size, tcp_flags), payload
+            in zip(rows.packets(), rows.payload)
+        ]
+    return [
+        text_content(
+            row["protocol"], row["src_ip"], row["src_port"], row["dst_ip"], row["dst_port"],
+            row["payload_size"], row["metadata"].get("tcp_flags"), row["payload"],
+        )
+        for row in rows
+    ]
+
+
+def batch_payloads(rows: Batch) -> List[Optional[str]]:
+    if isinstance(rows, columnar.ColumnBatch):
+        return rows.payload
+    return [row["payload"] for row in rows]
+
+
+def batch_has_ids(rows: Batch) -> bool:
+    """True si las filas llevan ``id`` asignado en el cliente (--dedup, embeddings)."""
+    if isinstance(rows, columnar.ColumnBatch):
+        return rows.ids is not None
+    return bool(rows) and "id" in rows[0]
+
+
+def batch_last_frame(rows: Batch) -> Optional[int]:
+    if isinstance(rows, columnar.ColumnBatch):
+        return rows.last_frame()
+    return rows[-1]["metadata"].get("frame_number") if rows else None
+
+
+# Respuestas 4xx que sí tiene sentido reintentar (timeout del servidor, límite de peticiones)
+RETRYABLE_STATUS = (408, 429)
+
+
+class SupabaseError(RuntimeError):
+    """Respuesta no 2xx de PostgREST; ``status`` permite separar rechazos de caídas."""
+
+    def __init__(self, status: int) -> None:
+        super().__init__(f"Error insertando en Supabase (HTTP {status})")
+        self.status = status
 
+
+def is_permanent_error(exc: BaseException) -> bool:
+    """True si reenviar el mismo lote volverá a fallar (4xx salvo 408/429).
+
+    Los errores de conexión y los 5xx son transitorios.
+    """
+    status = getattr(exc, "status", None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in RETRYABLE_STATUS
+
+
+def post_batch(
+    cfg: IngestConfig,
+    rows: Batch,
+    session: Optional[requests.Session] = None,
+    on_conflict: Optional[str] = None,
+    resolution: str = "merge-duplicates",
+) -> int:
+    """POST a PostgREST; con ``on_conflict`` es un upsert sobre esa columna
+    (``resolution=ignore-duplicates`` deja la fila existente sin tocar).
+
+    Devuelve los bytes del cuerpo enviado (para ajustar el tamaño de lote).
+    """
+    if not rows:
+        return 0
+
+    started = time.perf_counter()
+    body = encode_batch(rows)
+    BUILD_SECONDS.observe(time.perf_counter() - started, cfg.table)
     if cfg.dry_run:
-        print(f"[DRY-RUN] Enviaría lote de {len(rows)} filas")
-        return
+        print(f"[DRY-RUN] Enviaría lote de {len(rows)} filas a {cfg.table}")
+        return len(body)
 
     url = f"{cfg.supabase_url.rstrip('/')}/rest/v1/{cfg.table}"
     headers = {
@@ -249,113 +579,2047 @@ def post_batch(cfg: IngestConfig, rows: List[Dict[str, Any]]) -> None:
         "Content-Type": "application/json",
         "Prefer": "return=minimal",
     }
+    params = None
+    if on_conflict:
+        params = {"on_conflict": on_conflict}
+        headers["Prefer"] = f"resolution={resolution},return=minimal"
 
-    resp = requests.post(url, headers=headers, data=json.dumps(rows), timeout=30)
+    http = session if session is not None else requests
+    try:
+        resp = http.post(url, params=params, headers=headers, data=body, timeout=30)
+    except Exception:
+        HTTP_RESPONSES.inc(1, cfg.table, "error")
+        raise
+    HTTP_RESPONSES.inc(1, cfg.table, str(resp.status_code))
     if resp.status_code >= 300:
         print(f"[ERROR] Supabase POST {resp.status_code}: {resp.text[:500]}")
-        raise RuntimeError("Error insertando en Supabase")
+        raise SupabaseError(resp.status_code)
+    return len(body)
 
 
-def stream_lines(proc: subprocess.Popen[str]) -> Iterable[str]:
-    assert proc.stdout is not None
-    while not STOP:
-        line = proc.stdout.readline()
-        if not line:
-            break
-        yield line
+_CONFLICTS: Dict[Tuple[str, str, str], str] = {}
+_CONFLICTS_LOCK = threading.Lock()
 
 
-def run_ingest(cfg: IngestConfig) -> None:
-    cmd = build_tshark_cmd(cfg)
+def rest_primary_key(cfg: IngestConfig) -> List[str]:
+    """Clave primaria de ``cfg.table`` según el OpenAPI de PostgREST (columnas marcadas ``<pk/>``)."""
+    resp = requests.get(
+        f"{cfg.supabase_url.rstrip('/')}/rest/v1/",
+        headers={
+            "apikey": cfg.supabase_api_key,
+            "Authorization": f"Bearer {cfg.supabase_api_key}",
+            "Accept": "application/openapi+json",
+        },
+        timeout=10,
+    )
+    if resp.status_code >= 300:
+        raise SupabaseError(resp.status_code)
+    columns = resp.json().get("definitions", {}).get(cfg.table, {}).get("properties", {})
+    return [name for name, spec in columns.items() if "<pk/>" in str(spec.get("description", ""))]
+
+
+def packet_conflict(cfg: IngestConfig) -> str:
+    """Columnas de ``on_conflict`` para paquetes: la clave primaria real de la tabla.
+
+    Particionada (pg_partitions.py) es ``(id, timestamp)``. Sin ``--partition-by``
+    se consulta una vez por proceso (catálogo con ``--sink postgres``, OpenAPI de
+    PostgREST si no), porque otro ingestor puede haber convertido ya la tabla.
+    """
+    if cfg.partition_by:
+        return "id,timestamp"  # build_partitions acaba de dejar esa clave
+    if cfg.dry_run:
+        return "id"
+    postgres = cfg.sink == "postgres" and cfg.pg_dsn is not None
+    key = (cfg.sink, (cfg.pg_dsn if postgres else cfg.supabase_url) or "", cfg.table)
+    with _CONFLICTS_LOCK:
+        conflict = _CONFLICTS.get(key)
+        if conflict is None:
+            conflict = "id"
+            try:
+                columns = primary_key(cfg.pg_dsn, cfg.table) if postgres else rest_primary_key(cfg)
+            except Exception as exc:
+                print(f"[WARN] No se pudo leer la clave primaria de {cfg.table} ({exc}); se usa on_conflict=id")
+            else:
+                if "id" in columns:
+                    conflict = ",".join(columns)
+                if conflict != "id":
+                    print(f"[INFO] {cfg.table} tiene clave primaria ({conflict}): se usa como on_conflict")
+            _CONFLICTS[key] = conflict
+    return conflict
+
+
+def post_packets(cfg: IngestConfig, rows: Batch, session: Optional[requests.Session] = None) -> int:
+    """POST de paquetes; con ``id`` del cliente reenviar un lote ya insertado
+    (reintento, spool, otra ejecución) no falla por clave duplicada."""
+    if batch_has_ids(rows):
+        return post_batch(cfg, rows, session=session, on_conflict=packet_conflict(cfg), resolution="ignore-duplicates")
+    return post_batch(cfg, rows, session=session)
+
+
+AckCallback = Optional[Callable[[], None]]
+
+
+class BatchSizer:
+    """Tamaño de lote (en filas) para el productor, ajustado con cada POST.
+
+    Con ``adaptive`` desactivado es siempre ``batch_size``. Activado, sigue un
+    esquema AIMD sobre la latencia media de los POST: crece un 25 % mientras
+    quede holgada respecto a ``target_sec`` y se reduce un 30 % si la supera;
+    además nunca pasa de ``max_bytes`` según los bytes por fila observados.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        adaptive: bool = False,
+        target_sec: float = 0.5,
+        max_bytes: int = 1024 * 1024,
+        min_size: int = 10,
+        max_size: int = 5000,
+    ) -> None:
+        self.size = batch_size
+        self.adaptive = adaptive
+        self.target_sec = target_sec
+        self.max_bytes = max_bytes
+        self.min_size = min(min_size, batch_size)
+        self.max_size = max(max_size, batch_size)
+        self._lock = threading.Lock()
+        self._latency: Optional[float] = None
+        self._row_bytes: Optional[float] = None
+
+    def observe(self, rows: int, sent_bytes: Optional[int], seconds: float) -> None:
+        if not self.adaptive or rows <= 0:
+            return
+        with self._lock:
+            self._latency = seconds if self._latency is None else 0.7 * self._latency + 0.3 * seconds
+            if sent_bytes:
+                per_row = sent_bytes / rows
+                self._row_bytes = per_row if self._row_bytes is None else 0.7 * self._row_bytes + 0.3 * per_row
+
+            size = self.size
+            if self._latency > self.target_sec:
+                size = int(size * 0.7)
+            elif self._latency < self.target_sec / 2:
+                size = int(size * 1.25) + 1
+            if self._row_bytes:
+                size = min(size, int(self.max_bytes / self._row_bytes))
+            self.size = max(self.min_size, min(self.max_size, size))
+
+
+class BatchUploader:
+    """Envía lotes en segundo plano con un pool de workers.
+
+    El bucle de tshark sólo encola lotes; cada worker reutiliza su propio
+    cliente (una requests.Session con keep-alive para Supabase). La cola está
+    acotada a ``max_inflight`` lotes: si el destino va lento, el parser se
+    frena en vez de acumular memoria sin límite.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[Any, Batch], Optional[int]],
+        make_client: Callable[[], Any],
+        workers: int,
+        max_inflight: int,
+        label: str = "Filas enviadas acumuladas",
+        observe: Optional[Callable[[int, Optional[int], float], None]] = None,
+        name: str = "packets",
+    ) -> None:
+        self.name = name
+        self._send = send
+        self._label = label
+        self._observe = observe
+        self._make_client = make_client
+        self._queue: "queue.Queue[Optional[Tuple[Batch, AckCallback]]]" = queue.Queue(maxsize=max_inflight)
+        self._lock = threading.Lock()
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self.sent = 0
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"uploader-{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        QUEUE_DEPTH.set_function(self._queue.qsize, name)
+        for t in self._threads:
+            t.start()
+
+    def _worker(self) -> None:
+        try:
+            client = self._make_client()
+        except Exception as exc:
+            with self._lock:
+                if self._error is None:
+                    self._error = exc
+            return
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                rows, on_done = item
+                if self._error is not None:
+                    continue  # ya hubo un fallo: se descarta para no bloquear al productor
+                try:
+                    started = time.monotonic()
+                    sent_bytes = self._send(client, rows)
+                    elapsed = time.monotonic() - started
+                    SEND_SECONDS.observe(elapsed, self.name)
+                    ROWS_SENT.inc(len(rows), self.name)
+                    if sent_bytes:
+                        BYTES_SENT.inc(sent_bytes, self.name)
+                    if self._observe is not None:
+                        self._observe(len(rows), sent_bytes, elapsed)
+                except Exception as exc:
+                    with self._lock:
+                        if self._error is None:
+                            self._error = exc
+                    continue
+                with self._lock:
+                    self.sent += len(rows)
+                    sent = self.sent
+                if on_done is not None:
+                    on_done()
+                print(f"[OK] {self._label}: {sent}")
+        finally:
+            close = getattr(client, "close", None)
+            if close is not None:
+                close()
+
+    def _put(self, item: Optional[Tuple[Batch, AckCallback]]) -> None:
+        while True:
+            if self._error is not None and item is not None:
+                raise self._error
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                if item is None and not any(t.is_alive() for t in self._threads):
+                    return  # sin workers (p. ej. falló la conexión) nadie vaciará la cola
+                continue
+
+    def submit(self, rows: Batch, on_done: AckCallback = None) -> None:
+        """Encola un lote; ``on_done`` se llama (desde un worker) tras el 2xx."""
+        if self._closed:
+            raise RuntimeError("BatchUploader ya cerrado")
+        if rows:
+            self._put((rows, on_done))
+
+    def close(self) -> None:
+        """Espera a que se vacíe la cola y relanza el primer error de los workers."""
+        if not self._closed:
+            self._closed = True
+            for _ in self._threads:
+                self._put(None)
+            for t in self._threads:
+                t.join()
+        if self._error is not None:
+            raise self._error
+
+
+def build_uploader(cfg: IngestConfig, sizer: Optional[BatchSizer] = None) -> BatchUploader:
+    return BatchUploader(
+        send=lambda session, rows: post_packets(cfg, rows, session=session),
+        make_client=requests.Session,
+        workers=cfg.workers,
+        max_inflight=cfg.max_inflight,
+        observe=sizer.observe if sizer is not None else None,
+    )
+
+
+class SpoolSink:
+    """Escribe cada lote primero en el spool local; un drainer lo sube después.
+
+    Así una caída de Supabase no detiene la captura: los lotes esperan en
+    disco y se reenvían con backoff exponencial cuando el servidor vuelve.
+    """
+
+    def __init__(self, cfg: IngestConfig) -> None:
+        assert cfg.spool_dir is not None
+        self.spool = Spool(cfg.spool_dir, max_bytes=cfg.spool_max_mb * 1024 * 1024)
+        self.drainer = SpoolDrainer(
+            self.spool,
+            send=lambda session, rows: post_packets(cfg, rows, session=session),
+            make_client=requests.Session,
+            should_stop=lambda: STOP,
+            permanent=is_permanent_error,
+        )
+        self.drainer.start()
+
+    def submit(self, rows: Batch, on_done: AckCallback = None) -> None:
+        if rows:
+            self.spool.append(encode_batch(rows))
+        # En disco ya es durable: cuenta como confirmado para el checkpoint
+        if on_done is not None:
+            on_done()
+
+    def close(self) -> None:
+        self.drainer.stop()
+        if self.drainer.rejected:
+            print(
+                f"[ERROR] {self.drainer.rejected} filas rechazadas por Supabase; "
+                f"apartadas en {self.spool.directory}/bad-*"
+            )
+        pending = self.spool.sealed_segments()
+        if pending:
+            print(
+                f"[WARN] Quedan {len(pending)} segmentos en {self.spool.directory}; "
+                f"reenvía con --mode replay --spool-dir {self.spool.directory}"
+            )
+        else:
+            try:
+                self.spool.directory.rmdir()
+            except OSError:
+                pass  # no vacío o ya borrado
+
+
+class NullSink:
+    """No envía nada (p. ej. --no-packets); confirma cada lote al instante."""
+
+    def submit(self, rows: Batch, on_done: AckCallback = None) -> None:
+        if on_done is not None:
+            on_done()
+
+    def close(self) -> None:
+        pass
+
+
+class CollectorSink:
+    """Envía los lotes en binario al collector central (collector.py).
+
+    El collector añade ``sensor_id``, agrupa lotes de varios sensores y los
+    escribe en Supabase; ``on_done`` se llama cuando confirma la escritura,
+    así que el checkpoint sigue avanzando sólo con datos ya en la BD.
+    """
+
+    def __init__(self, cfg: IngestConfig, sizer: Optional[BatchSizer] = None) -> None:
+        host, port = cfg.collector_addr
+        self.client = CollectorClient(
+            host,
+            port,
+            cfg.sensor_id,
+            token=cfg.collector_token,
+            window=cfg.collector_window,
+            should_stop=lambda: STOP,
+        )
+        self._observe = sizer.observe if sizer is not None else None
+        self.client.on_ack = self._acked
+        self.raw_bytes = 0
+
+    def _acked(self, rows: int, elapsed: float) -> None:
+        SEND_SECONDS.observe(elapsed, "packets")
+        ROWS_SENT.inc(rows, "packets")
+        if self._observe is not None:
+            self._observe(rows, None, elapsed)
+        print(f"[OK] Filas confirmadas por el collector: {self.client.acked_rows}")
+
+    def submit(self, rows: Batch, on_done: AckCallback = None) -> None:
+        if not rows:
+            if on_done is not None:
+                on_done()
+            return
+        block = encode_block(rows)
+        self.raw_bytes += len(block)
+        BYTES_SENT.inc(self.client.send(block, len(rows), on_done), "packets")
+
+    def close(self) -> None:
+        self.client.close()
+        if self.client.acked_rows:
+            print(
+                f"[INFO] Collector: {self.client.sent_bytes} bytes enviados ({self.client.codec}), "
+                f"{self.client.sent_bytes / self.client.acked_rows:.1f} B/fila, "
+                f"sin comprimir {self.raw_bytes} bytes"
+            )
+
+
+def build_pg_sink(cfg: IngestConfig, sizer: Optional[BatchSizer] = None) -> BatchUploader:
+    """COPY directo a Postgres: una conexión por worker, un lote por transacción."""
+    assert cfg.pg_dsn is not None
+    writer = PgCopyWriter(cfg.pg_dsn, cfg.table, conflict=packet_conflict(cfg).split(","))
+    return BatchUploader(
+        send=writer.copy,
+        make_client=writer.connect,
+        workers=cfg.workers,
+        max_inflight=cfg.max_inflight,
+        observe=sizer.observe if sizer is not None else None,
+    )
+
+
+def build_sink(cfg: IngestConfig, sizer: Optional[BatchSizer] = None) -> Any:
+    if not cfg.send_packets:
+        return NullSink()
+    if cfg.spool_dir is not None:
+        return SpoolSink(cfg)
+    if cfg.sink == "postgres" and not cfg.dry_run:
+        return build_pg_sink(cfg, sizer)
+    if cfg.sink == "collector" and not cfg.dry_run:
+        return CollectorSink(cfg, sizer)
+    return build_uploader(cfg, sizer)
+
+
+class DedupStage:
+    """Descarta los paquetes ya enviados (en esta u otras ejecuciones).
+
+    El ``id`` de cada fila pasa a ser ``dedup.packet_id``, determinista, así
+    que lo que el filtro de Bloom no reconozca (falso negativo tras rotar una
+    generación, fichero perdido) lo descarta el servidor por clave primaria.
+    Las claves entran en el filtro sólo cuando su lote está confirmado, y el
+    filtro se guarda al cerrar y cada ``save_interval`` segundos.
+    """
+
+    def __init__(self, cfg: IngestConfig, save_interval: float = 60.0) -> None:
+        self.path = cfg.dedup_file if cfg.dedup_save and not cfg.dry_run else None
+        if cfg.dedup_file is not None:
+            self.bloom = RotatingBloom.load(cfg.dedup_file, cfg.dedup_capacity, cfg.dedup_error, cfg.dedup_window)
+        else:
+            self.bloom = RotatingBloom(cfg.dedup_capacity, cfg.dedup_error, cfg.dedup_window)
+        self.save_interval = save_interval
+        self.dropped = 0
+        self._last_save = time.monotonic()
+
+    def process(self, batch: Batch) -> Batch:
+        keys = [
+            packet_id(epoch, src_ip, src_port, dst_ip, dst_port, size, payload)
+            for (epoch, src_ip, src_port, dst_ip, dst_port, _, size, _), payload
+            in zip(batch_packets(batch), batch_payloads(batch))
+        ]
+        seen: set = set()
+        keep: List[int] = []
+        for i, key in enumerate(keys):
+            if key not in seen and key not in self.bloom:
+                seen.add(key)
+                keep.append(i)
+        dropped = len(keys) - len(keep)
+        if dropped:
+            ROWS_DUPLICATE.inc(dropped)
+            self.dropped += dropped
+
+        if isinstance(batch, columnar.ColumnBatch):
+            if dropped:
+                batch = batch.take(keep)
+            batch.ids = [str(keys[i]) for i in keep]
+        else:
+            batch = [batch[i] for i in keep]
+            for row, i in zip(batch, keep):
+                row["id"] = str(keys[i])
+
+        if self.path is not None and time.monotonic() - self._last_save >= self.save_interval:
+            self._save()
+        return batch
+
+    def delivered(self, batch: Batch) -> AckCallback:
+        ids = batch.ids if isinstance(batch, columnar.ColumnBatch) else [row["id"] for row in batch]
+        keys = [uuid.UUID(row_id) for row_id in ids or ()]
+        return lambda: self.bloom.add_many(keys)
+
+    def _save(self) -> None:
+        assert self.path is not None
+        self.bloom.save(self.path)
+        self._last_save = time.monotonic()
+
+    def close(self) -> None:
+        if self.path is not None:
+            self._save()
+        print(f"[INFO] Duplicados descartados: {self.dropped} (filtro {self.bloom.nbytes() // 1024} KiB)")
+
+
+class EnrichmentStage:
+    """Añade a ``metadata`` el rol de cada extremo, MAC/hostname del lease DHCP vigente
+    y la dirección respecto al AP (ver enrichment.py).
+
+    El fichero de leases se comprueba como mucho una vez por ``check_interval``
+    y sólo se invalidan en la caché las IPs cuyo lease cambió.
+    """
+
+    def __init__(self, cfg: IngestConfig, check_interval: float = 2.0) -> None:
+        self.enricher = Enricher(LeaseTable(cfg.dhcp_leases), build_trie(cfg.ap_ip), cfg.enrich_cache_size)
+        self.enricher.refresh()
+        print(f"[INFO] Enriquecimiento: {len(self.enricher.leases.leases)} leases en {cfg.dhcp_leases}, AP {cfg.ap_ip}")
+        self.check_interval = check_interval
+        self._last_check = time.monotonic()
+
+    def process(self, batch: Batch) -> Batch:
+        if time.monotonic() - self._last_check >= self.check_interval:
+            self._last_check = time.monotonic()
+            changed = self.enricher.refresh()
+            if changed:
+                print(f"[INFO] Leases DHCP actualizados: {changed} IPs")
+
+        # Un dict por par (src, dst) y segundo del lote, compartido por sus
+        # filas: la caducidad de los leases va por segundos
+        fields = self.enricher.fields
+        per_pair: Dict[Tuple[str, str, Optional[int]], Dict[str, Any]] = {}
+        extra = []
+        if isinstance(batch, columnar.ColumnBatch):
+            pairs = zip(batch.src_ip, batch.dst_ip, map(math.ceil, batch.epoch))
+        else:
+            epochs = (row_epoch(row) for row in batch)
+            pairs = ((row["src_ip"], row["dst_ip"], None if e is None else math.ceil(e)) for row, e in zip(batch, epochs))
+        for pair in pairs:
+            item = per_pair.get(pair)
+            if item is None:
+                item = per_pair[pair] = fields(*pair)
+            extra.append(item)
+
+        if isinstance(batch, columnar.ColumnBatch):
+            batch.meta_extra = extra
+        else:
+            for row, item in zip(batch, extra):
+                row["metadata"].update(item)
+        return batch
+
+    def close(self) -> None:
+        total = self.enricher.hits + self.enricher.misses
+        if total:
+            print(f"[INFO] Caché de enriquecimiento: {self.enricher.hits}/{total} aciertos")
+
+
+class DetectionStage:
+    """Marca en el propio lote los escaneos y la exfiltración (ver detection.py).
+
+    Cada fila recibe ``metadata.anomaly_score`` (0..1) y, si alguna regla
+    salta, ``is_malicious``, ``mitre_technique_id`` y ``mitre_tactic``; todas
+    las filas llevan las columnas para que el lote tenga las mismas claves.
+    """
+
+    def __init__(self, cfg: IngestConfig) -> None:
+        self.detector = Detector(
+            window_sec=cfg.detect_window,
+            scan_ports=cfg.detect_scan_ports,
+            scan_hosts=cfg.detect_scan_hosts,
+            exfil_bytes=cfg.detect_exfil_mb * 1024 * 1024,
+            max_sources=cfg.detect_max_sources,
+        )
+
+    def process(self, batch: Batch) -> Batch:
+        verdicts = self.detector.observe(list(batch_packets(batch)))
+        for _, technique in verdicts:
+            if technique is not None:
+                ROWS_FLAGGED.inc(1, technique)
+        if isinstance(batch, columnar.ColumnBatch):
+            batch.set_detection([(score, technique, TACTICS.get(technique)) for score, technique in verdicts])
+            return batch
+        for row, (score, technique) in zip(batch, verdicts):
+            row["metadata"]["anomaly_score"] = score
+            row["is_malicious"] = technique is not None
+            row["mitre_technique_id"] = technique
+            row["mitre_tactic"] = TACTICS.get(technique) if technique else None
+        return batch
+
+    def close(self) -> None:
+        flagged = ", ".join(f"{t}={n}" for t, n in sorted(self.detector.flagged.items())) or "ninguna"
+        print(f"[INFO] Detección: filas marcadas {flagged}; {self.detector.evicted} orígenes expulsados por --detect-max-sources")
+
+
+class TopTalkersStage:
+    """Top-K por src_ip, dst_ip, dst_port y protocolo cada ``top_interval`` s.
+
+    Las filas van a ``top_table`` por PostgREST o, con ``top_file``, se añaden
+    como JSON por línea a un fichero local.
+    """
+
+    def __init__(self, cfg: IngestConfig) -> None:
+        self.talkers = TopTalkers(cfg.top_k, cfg.top_interval, columnar.IsoFormatter().format, cfg.sensor_id)
+        self.file = cfg.top_file
+        self.uploader: Optional[BatchUploader] = None
+        if self.file is None:
+            top_cfg = dataclasses.replace(cfg, table=cfg.top_table)
+            self.uploader = BatchUploader(
+                send=lambda session, rows: post_batch(top_cfg, rows, session=session),
+                make_client=requests.Session,
+                workers=1,
+                max_inflight=cfg.max_inflight,
+                label="Snapshots de top talkers enviados acumulados",
+                name="top_talkers",
+            )
+
+    def process(self, batch: Batch) -> Batch:
+        self.talkers.add_batch(batch_packets(batch))
+        self._emit(self.talkers.drain())
+        return batch
+
+    def _emit(self, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        if self.uploader is not None:
+            self.uploader.submit(rows)
+            return
+        assert self.file is not None
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        with self.file.open("a", encoding="utf-8") as fh:
+            fh.writelines(json.dumps(row) + "\n" for row in rows)
+
+    def close(self) -> None:
+        self.talkers.flush()
+        self._emit(self.talkers.drain())
+        if self.uploader is not None:
+            self.uploader.close()
+
+
+class AttackChainStage:
+    """Progreso de las cadenas de ataque según llegan las filas (ver attack_chains.py).
+
+    Sólo las filas con ``attack_chain_id`` (p. ej. ``--mode import`` de una
+    exportación etiquetada) cuentan. El último estado de cada cadena se
+    actualiza por upsert en ``chain_table`` o, con ``chain_file``, cada evento
+    se añade como JSON por línea a un fichero local.
+    """
+
+    def __init__(self, cfg: IngestConfig) -> None:
+        self.index = ChainIndex(cfg.chain_ttl, cfg.chain_max, columnar.IsoFormatter().format)
+        self.sensor_id = cfg.sensor_id
+        self.file = cfg.chain_file
+        self.uploader: Optional[BatchUploader] = None
+        if self.file is None:
+            chain_cfg = dataclasses.replace(cfg, table=cfg.chain_table)
+            self.uploader = BatchUploader(
+                send=lambda session, rows: post_batch(chain_cfg, rows, session=session, on_conflict="chain_id"),
+                make_client=requests.Session,
+                workers=1,
+                max_inflight=cfg.max_inflight,
+                label="Estados de cadenas de ataque enviados acumulados",
+                name="attack_chains",
+            )
+
+    def process(self, batch: Batch) -> Batch:
+        if isinstance(batch, columnar.ColumnBatch):
+            return batch  # la captura no trae columnas de cadenas
+        events = []
+        for row in batch:
+            events.extend(self.index.observe(row))
+        self._emit(events)
+        return batch
+
+    def _emit(self, events: List[Dict[str, Any]]) -> None:
+        if not events:
+            return
+        for event in events:
+            event["sensor_id"] = self.sensor_id
+            if event["status"] == "completed":
+                print(
+                    f"[INFO] Cadena completa {event['chain_id']} ({event['chain_name']}): "
+                    f"{event['attacker_ip']} -> {event['victim_ip']}, {event['total_steps']} pasos"
+                )
+        if self.uploader is not None:
+            # Un upsert no puede tocar la misma fila dos veces: sólo el último estado por cadena
+            latest = {event["chain_id"]: event for event in events}
+            self.uploader.submit(list(latest.values()))
+            return
+        assert self.file is not None
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        with self.file.open("a", encoding="utf-8") as fh:
+            fh.writelines(json.dumps(event) + "\n" for event in events)
+
+    def close(self) -> None:
+        index = self.index
+        print(
+            f"[INFO] Cadenas de ataque: {index.completed} completas, {index.expired} caducadas, "
+            f"{len(index.active())} en curso, {index.invalid} filas sin paso válido"
+        )
+        if self.uploader is not None:
+            self.uploader.close()
+
+
+class FlowStage:
+    """Agrega los paquetes de cada lote en flujos y sube los cerrados a ``flow_table``."""
+
+    def __init__(self, cfg: IngestConfig) -> None:
+        flow_cfg = dataclasses.replace(cfg, table=cfg.flow_table)
+        self.batch_size = cfg.batch_size
+        self.table = FlowTable(
+            idle_timeout=cfg.flow_idle_timeout,
+            active_timeout=cfg.flow_active_timeout,
+            max_flows=cfg.flow_max,
+            format_ts=columnar.IsoFormatter().format,
+            source=f"flows:{cfg.mode}:{cfg.iface or cfg.pcap}",
+        )
+        self.uploader = BatchUploader(
+            send=lambda session, rows: post_batch(flow_cfg, rows, session=session),
+            make_client=requests.Session,
+            workers=1,
+            max_inflight=cfg.max_inflight,
+            label="Flujos enviados acumulados",
+            name="flows",
+        )
+        self._pending: List[Dict[str, Any]] = []
+
+    def process(self, batch: Batch) -> Batch:
+        add = self.table.add
+        for packet in batch_packets(batch):
+            add(*packet)
+        self.table.expire()
+        self._queue(self.table.drain())
+        return batch
+
+    def _queue(self, flows: List[Dict[str, Any]], final: bool = False) -> None:
+        self._pending.extend(flows)
+        while len(self._pending) >= self.batch_size or (final and self._pending):
+            chunk, self._pending = self._pending[: self.batch_size], self._pending[self.batch_size:]
+            self.uploader.submit(chunk)
+
+    def close(self) -> None:
+        self.table.flush()
+        self._queue(self.table.drain(), final=True)
+        if self.table.evicted:
+            print(f"[WARN] {self.table.evicted} flujos expulsados por --flow-max")
+        self.uploader.close()
+
+
+class InfluxStage:
+    """Agrega ventanas ``net_window_metrics`` y las escribe en InfluxDB en segundo plano."""
+
+    def __init__(self, cfg: IngestConfig, max_lines: int = 5000, max_delay_sec: float = 5.0) -> None:
+        writer = InfluxWriter.from_env()
+        if writer is None and not cfg.dry_run:
+            raise RuntimeError("Define INFLUX_URL, INFLUX_TOKEN, INFLUX_ORG e INFLUX_BUCKET para --influx")
+        self.aggregator = WindowAggregator(
+            widths=cfg.influx_windows,
+            allowed_lateness=cfg.influx_lateness,
+            sensor_id=cfg.sensor_id,
+            iface=cfg.iface or (cfg.pcap.name if cfg.pcap else "-"),
+        )
+
+        def send(session: Any, lines: List[str]) -> None:
+            if writer is None:
+                print(f"[DRY-RUN] Enviaría {len(lines)} puntos a InfluxDB")
+                return
+            writer.write(session, lines)
+
+        self.uploader = BatchUploader(
+            send=send,
+            make_client=requests.Session,
+            workers=1,
+            max_inflight=cfg.max_inflight,
+            label="Puntos InfluxDB enviados acumulados",
+            name="influx",
+        )
+        self.max_lines = max_lines
+        self.max_delay_sec = max_delay_sec
+        self._pending: List[str] = []
+        self._last_submit = time.monotonic()
+
+    def process(self, batch: Batch) -> Batch:
+        add = self.aggregator.add
+        for sample in batch_window_samples(batch):
+            add(*sample)
+        self._pending.extend(self.aggregator.close_ready())
+        # Una escritura cada pocos segundos (o al llenar el lote), no una por ventana
+        if self._pending and (
+            len(self._pending) >= self.max_lines or time.monotonic() - self._last_submit >= self.max_delay_sec
+        ):
+            self._submit()
+        return batch
+
+    def _submit(self) -> None:
+        while self._pending:
+            chunk, self._pending = self._pending[: self.max_lines], self._pending[self.max_lines:]
+            self.uploader.submit(chunk)
+        self._last_submit = time.monotonic()
+
+    def close(self) -> None:
+        self._pending.extend(self.aggregator.flush())
+        self._submit()
+        if self.aggregator.late:
+            print(f"[WARN] {self.aggregator.late} muestras tardías descartadas (--influx-lateness)")
+        self.uploader.close()
+
+
+class EmbeddingStage:
+    """Pasos 4-5 del pipeline: ``text_content`` -> embedding -> upsert en ``embedding_table``.
+
+    Cada paquete recibe un ``id`` generado en el cliente para poder enlazar
+    ``packet_id`` sin leer la respuesta del INSERT. Los embeddings de un lote
+    se calculan y suben cuando ese lote de paquetes ya está confirmado (la FK
+    exige que exista la fila en ``network_packets``), en un worker aparte, con
+    caché por hash del texto para no recalcular el tráfico repetido.
+    """
+
+    def __init__(self, cfg: IngestConfig) -> None:
+        self.embedder = build_embedder(cfg.embedder, cfg.embedding_model)
+        self.model: str = self.embedder.name  # type: ignore[attr-defined]
+        self.cache = EmbeddingCache(cfg.embedding_cache_size, cfg.embedding_cache)
+        embed_cfg = dataclasses.replace(cfg, table=cfg.embedding_table)
+        self.uploader = BatchUploader(
+            send=lambda session, items: self._embed_and_upsert(embed_cfg, session, items),
+            make_client=requests.Session,
+            workers=1,
+            max_inflight=cfg.max_inflight,
+            label="Embeddings enviados acumulados",
+            name="embeddings",
+        )
+
+    def process(self, batch: Batch) -> Batch:
+        if batch_has_ids(batch):
+            return batch  # ya los puso --dedup
+        ids = [str(uuid.uuid4()) for _ in range(len(batch))]
+        if isinstance(batch, columnar.ColumnBatch):
+            batch.ids = ids
+        else:
+            for row, row_id in zip(batch, ids):
+                row["id"] = row_id
+        return batch
+
+    def delivered(self, batch: Batch) -> AckCallback:
+        ids = batch.ids if isinstance(batch, columnar.ColumnBatch) else [row["id"] for row in batch]
+        items = list(zip(ids, batch_texts(batch)))
+
+        def _ack() -> None:
+            try:
+                self.uploader.submit(items)
+            except Exception:
+                pass  # el worker de embeddings ya falló; close() relanza el error
+
+        return _ack
+
+    def _embed_and_upsert(self, cfg: IngestConfig, session: Any, items: List[Tuple[str, str]]) -> None:
+        keys = [EmbeddingCache.key(self.model, text) for _, text in items]
+        vectors = self.cache.get_many(list(set(keys)))
+        missing: Dict[str, str] = {}
+        for key, (_, text) in zip(keys, items):
+            if key not in vectors:
+                missing[key] = text
+        if missing:
+            computed = dict(zip(missing, self.embedder.embed(list(missing.values()))))  # type: ignore[attr-defined]
+            self.cache.put_many(computed)
+            vectors.update(computed)
+
+        literals: Dict[str, str] = {}
+        rows = []
+        for key, (row_id, text) in zip(keys, items):
+            literal = literals.get(key)
+            if literal is None:
+                literal = literals[key] = vector_literal(vectors[key])
+            rows.append({
+                "packet_id": row_id,
+                "embedding": literal,
+                "text_content": text,
+                "metadata": {"model": self.model, "content_hash": key},
+            })
+        post_batch(cfg, rows, session=session, on_conflict="packet_id")
+
+    def close(self) -> None:
+        try:
+            self.uploader.close()
+        finally:
+            total = self.cache.hits + self.cache.misses
+            if total:
+                print(f"[INFO] Caché de embeddings: {self.cache.hits}/{total} aciertos")
+            self.cache.close()
+
+
+def batch_epoch_range(batch: Batch) -> Optional[Tuple[float, float]]:
+    if isinstance(batch, columnar.ColumnBatch):
+        return epoch_range(batch.epoch)
+    return epoch_range(row_epoch(row) for row in batch)
+
+
+def build_partitions(cfg: IngestConfig) -> PartitionManager:
+    """Convierte la tabla si hace falta y deja creadas las particiones actuales.
+
+    Con ``partition_bootstrap`` desactivado sólo carga las particiones: la
+    conversión (DDL con lock exclusivo) la hace un único proceso.
+    """
+    assert cfg.partition_by is not None and cfg.pg_dsn is not None
+    try:
+        manager = PartitionManager(
+            cfg.pg_dsn,
+            cfg.table,
+            interval=cfg.partition_by,
+            premake=cfg.partition_premake,
+            retention_days=cfg.partition_retention_days if cfg.partition_bootstrap else 0.0,
+            retention_action=cfg.partition_retention_action,
+        )
+    except RuntimeError as exc:
+        print(f"[ERROR] Particionado de {cfg.table}: {exc}")
+        sys.exit(1)
+    try:
+        if cfg.partition_bootstrap:
+            manager.bootstrap()
+            manager.maintain()
+        else:
+            manager.attach()
+    except manager.errors as exc:
+        print(f"[ERROR] Particionado de {cfg.table}: {describe_error(exc)}")
+        manager.close()
+        sys.exit(1)
+    return manager
+
+
+class PartitionStage:
+    """Crea las particiones que cubren cada lote antes de enviarlo (``--partition-by``).
+
+    El caso normal (lote dentro de particiones ya conocidas) no toca la BD;
+    la retención se revisa cada pocos minutos.
+    """
+
+    def __init__(self, cfg: IngestConfig) -> None:
+        self.manager = build_partitions(cfg)
+
+    def process(self, batch: Batch) -> Batch:
+        span = batch_epoch_range(batch)
+        if span is not None:
+            self.manager.ensure(*span)
+        if self.manager.maintain_due():
+            self.manager.maintain()
+        return batch
+
+    def close(self) -> None:
+        if self.manager.created or self.manager.removed:
+            print(f"[INFO] Particiones: {self.manager.created} creadas, {self.manager.removed} retiradas")
+        self.manager.close()
+
+
+def build_stages(cfg: IngestConfig) -> List[Any]:
+    stages: List[Any] = []
+    if cfg.dedup:
+        # Primero: las demás etapas sólo ven paquetes nuevos y reutilizan su id
+        stages.append(DedupStage(cfg))
+    if cfg.enrich:
+        stages.append(EnrichmentStage(cfg))
+    if cfg.detect:
+        stages.append(DetectionStage(cfg))
+    if cfg.top_talkers:
+        stages.append(TopTalkersStage(cfg))
+    if cfg.chains:
+        stages.append(AttackChainStage(cfg))
+    if cfg.flows:
+        stages.append(FlowStage(cfg))
+    if cfg.influx:
+        stages.append(InfluxStage(cfg))
+    if cfg.embeddings:
+        stages.append(EmbeddingStage(cfg))
+    if cfg.partition_by and cfg.send_packets:
+        if cfg.dry_run:
+            print("[INFO] --dry-run: no se crean particiones")
+        else:
+            # Último: ve el lote definitivo, justo antes del sink
+            stages.append(PartitionStage(cfg))
+    return stages
+
+
+def chain_acks(callbacks: List[AckCallback]) -> AckCallback:
+    callbacks = [cb for cb in callbacks if cb is not None]
+    if not callbacks:
+        return None
+    if len(callbacks) == 1:
+        return callbacks[0]
+
+    def _ack() -> None:
+        for cb in callbacks:
+            cb()  # type: ignore[misc]
+
+    return _ack
+
+
+def close_all(objs: List[Any]) -> None:
+    """Cierra todos (etapas y sinks) aunque alguno falle; relanza el primer error."""
+    error: Optional[BaseException] = None
+    for obj in objs:
+        try:
+            obj.close()
+        except Exception as exc:
+            if error is None:
+                error = exc
+    if error is not None:
+        raise error
+
+
+def pcap_fingerprint(path: Path, head_bytes: int = 1024 * 1024) -> Dict[str, Any]:
+    """Identifica un pcap por tamaño + hash de la cabecera (no depende de mtime)."""
+    h = hashlib.sha1()
+    with path.open("rb") as fh:
+        h.update(fh.read(head_bytes))
+    return {"size": path.stat().st_size, "head_sha1": h.hexdigest()}
+
+
+class FrameCheckpoint:
+    """Último ``frame.number`` confirmado de un pcap, persistido en JSON.
+
+    Los lotes pueden confirmarse fuera de orden (varios workers), así que sólo
+    se avanza hasta el último lote contiguo confirmado.
+    """
+
+    def __init__(self, pcap: Path, state_dir: Optional[Path]) -> None:
+        directory = state_dir or pcap.parent
+        self.path = directory / f"{pcap.name}.ckpt.json"
+        self._pcap = pcap
+        self.fingerprint = pcap_fingerprint(pcap)
+        self.last_frame = 0
+        self.complete = False
+        self._lock = threading.Lock()
+        self._next_seq = 0
+        self._confirm_seq = 0
+        self._pending: Dict[int, int] = {}
+        self._acked: set = set()
+        self._dirty = False
+        self._last_save = 0.0
+
+    def load(self, growing: bool = False) -> int:
+        """Devuelve el último frame confirmado (0 si no hay checkpoint válido).
+
+        Con ``growing`` (fichero que se sigue escribiendo) basta con que el pcap
+        actual empiece por los mismos bytes que cuando se guardó el checkpoint.
+        """
+        if not self.path.exists():
+            return 0
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            print(f"[WARN] Checkpoint ilegible, se ignora: {self.path}")
+            return 0
+        saved = data.get("fingerprint") or {}
+        if growing and saved.get("size", -1) <= self.fingerprint["size"]:
+            head = pcap_fingerprint(self._pcap, head_bytes=min(saved["size"], 1024 * 1024))
+            self.fingerprint = saved if head["head_sha1"] == saved.get("head_sha1") else self.fingerprint
+        if saved != self.fingerprint:
+            print(f"[WARN] El pcap cambió desde el checkpoint, se empieza de cero: {self.path}")
+            return 0
+        self.last_frame = int(data.get("last_frame") or 0)
+        self.complete = bool(data.get("complete"))
+        return self.last_frame
+
+    def track(self, last_frame: Optional[int]) -> Callable[[], None]:
+        """Registra un lote enviado; devuelve el callback a llamar cuando se confirme."""
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._pending[seq] = last_frame or 0
+
+        def _ack() -> None:
+            with self._lock:
+                self._acked.add(seq)
+                while self._confirm_seq in self._acked:
+                    self._acked.discard(self._confirm_seq)
+                    frame = self._pending.pop(self._confirm_seq)
+                    self.last_frame = max(self.last_frame, frame)
+                    self._confirm_seq += 1
+                    self._dirty = True
+
+        return _ack
+
+    @property
+    def settled(self) -> bool:
+        """True si todos los lotes registrados están confirmados."""
+        with self._lock:
+            return self._confirm_seq == self._next_seq
+
+    def refresh_fingerprint(self) -> None:
+        """Recalcula la huella (el fichero dejó de crecer)."""
+        self.fingerprint = pcap_fingerprint(self._pcap)
+
+    def save(self, complete: bool = False, force: bool = False) -> None:
+        with self._lock:
+            if not (force or complete):
+                # Como mucho una escritura por segundo durante la ingesta
+                if not self._dirty or time.monotonic() - self._last_save < 1.0:
+                    return
+            self._dirty = False
+            self._last_save = time.monotonic()
+            self.complete = complete
+            data = {
+                "pcap": self.path.name[: -len(".ckpt.json")],
+                "fingerprint": self.fingerprint,
+                "last_frame": self.last_frame,
+                "complete": complete,
+                "updated_at": dt.datetime.now(tz=dt.timezone.utc).isoformat(),
+            }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+class PipeLines:
+    """Lee líneas de la salida de tshark sin bloquear más de ``timeout``.
+
+    ``readline()`` se queda bloqueado mientras no llegue tráfico; aquí se usa
+    select + os.read por bloques para poder vaciar un lote por tiempo.
+    """
+
+    def __init__(self, stream: Any) -> None:
+        self._fd = stream.fileno()
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._partial = ""
+        self.eof = False
+
+    def read(self, timeout: Optional[float]) -> List[str]:
+        """Líneas completas disponibles ([] si vence ``timeout`` sin datos)."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        chunk = os.read(self._fd, 1 << 16)
+        if not chunk:
+            self.eof = True
+            tail = self._partial + self._decoder.decode(b"", final=True)
+            self._partial = ""
+            return [tail] if tail else []
+        lines = (self._partial + self._decoder.decode(chunk)).split("\n")
+        self._partial = lines.pop()
+        return lines
+
+
+class StdinFeeder:
+    """Escribe ``blocks`` en el stdin de tshark desde un hilo y lo cierra al acabar.
+
+    Si tshark sale antes (parada, ``--limit``) se deja de escribir; un error
+    leyendo los bloques (p. ej. un .gz corrupto) se relanza en ``join``.
+    """
+
+    def __init__(self, pipe: Any, blocks: Iterable[bytes]) -> None:
+        self._pipe = pipe
+        self._blocks = blocks
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name="tshark-stdin", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            for block in self._blocks:
+                if STOP:
+                    break
+                self._pipe.write(block)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as exc:
+            self._error = exc
+        finally:
+            try:
+                self._pipe.close()
+            except OSError:
+                pass
+
+    def join(self, raise_error: bool = True) -> None:
+        self._thread.join()
+        if raise_error and self._error is not None:
+            raise self._error
+
+
+def decode_block(cfg: IngestConfig, lines: List[str], source: str, formatter: columnar.IsoFormatter) -> Batch:
+    if cfg.decoder == "columnar":
+        return columnar.decode_lines(lines, source, formatter)
+    rows = (to_record(line.rstrip("\n").split("\t"), source=source) for line in lines)
+    return [row for row in rows if row]
+
+
+def tshark_batches(
+    cfg: IngestConfig, skip_frames: int, sizer: BatchSizer, stdin: Optional[Iterable[bytes]] = None
+) -> Iterator[Batch]:
+    """Lotes desde tshark; al cerrar el generador se recoge el proceso.
+
+    Un lote se emite al llegar a ``sizer.size`` líneas o, con ``linger_ms``,
+    cuando la línea más antigua pendiente lleva ese tiempo esperando (aunque
+    no llegue tráfico nuevo). Con ``stdin`` tshark lee el pcap de esos bloques
+    (``-r -``) en lugar de ``cfg.pcap``.
+    """
+    cmd = build_tshark_cmd(cfg, skip_frames=skip_frames)
+    if stdin is not None:
+        cmd[cmd.index("-r") + 1] = "-"
     print("$ " + " ".join(cmd))
 
     proc = subprocess.Popen(
         cmd,
+        stdin=subprocess.PIPE if stdin is not None else None,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1,
+        bufsize=0,
     )
+    assert proc.stdout is not None
+    stderr = StderrWatcher(proc.stderr, on_dropped=TSHARK_DROPPED.set)
+    feeder = StdinFeeder(proc.stdin, stdin) if stdin is not None else None
 
     source = f"tshark:{cfg.mode}:{cfg.iface or cfg.pcap}"
-    sent = 0
+    formatter = columnar.IsoFormatter()
+
+    def decode(lines: List[str]) -> Batch:
+        started = time.perf_counter()
+        batch = decode_block(cfg, lines, source, formatter)
+        PARSE_SECONDS.observe(time.perf_counter() - started)
+        ROWS_DECODED.inc(len(batch))
+        ROWS_REJECTED.inc(len(lines) - len(batch))
+        return batch
+
+    reader = PipeLines(proc.stdout)
+    linger = cfg.linger_ms / 1000.0
+    deadline = 0.0
+    block: List[str] = []
+    try:
+        while not STOP and not reader.eof:
+            # Despierta al menos cada 0.5 s para atender STOP
+            timeout = 0.5
+            if block and linger:
+                timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+            lines = reader.read(timeout)
+            if lines:
+                LINES_READ.inc(len(lines))
+                if not block:
+                    deadline = time.monotonic() + linger
+                block.extend(lines)
+
+            size = sizer.size
+            while len(block) >= size:
+                batch = decode(block[:size])
+                block = block[size:]
+                if batch:
+                    yield batch
+            if block and linger and time.monotonic() >= deadline:
+                batch = decode(block)
+                block = []
+                if batch:
+                    yield batch
+        if block:
+            batch = decode(block)
+            if batch:
+                yield batch
+        if feeder is not None:
+            feeder.join()
+    finally:
+        if proc.poll() is None:
+            proc.terminate()
+        try:
+            proc.wait(timeout=3)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        if feeder is not None:
+            feeder.join(raise_error=False)
+        stderr.join()
+
+        if stderr.tail:
+            # Tshark suele escribir mensajes informativos en stderr
+            tail = "\n".join(stderr.tail)
+            print(f"[INFO] tshark stderr (últimas líneas):\n{tail}")
+        if stderr.dropped:
+            print(f"[WARN] tshark informó de {stderr.dropped} paquetes perdidos")
+
+
+def shift_frames(batch: Batch, offset: int) -> None:
+    if isinstance(batch, columnar.ColumnBatch):
+        batch.shift_frames(offset)
+        return
+    for row in batch:
+        if row["metadata"]["frame_number"] is not None:
+            row["metadata"]["frame_number"] += offset
+
+
+def _decode_chunk(cfg: IngestConfig, chunk: pcap_split.Chunk) -> List[str]:
+    """Salida de tshark para un tramo del pcap, pasado por stdin."""
+    cmd = [arg for arg in build_tshark_cmd(cfg) if arg != "-l"]
+    cmd[cmd.index("-r") + 1] = "-"
+    data = pcap_split.read_chunk(cfg.pcap, chunk)
+    proc = subprocess.run(cmd, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"tshark falló en el tramo desde el frame {chunk.frame_offset + 1}: {proc.stderr.decode(errors='replace')[-300:]}")
+    return proc.stdout.decode("utf-8", errors="replace").splitlines(keepends=True)
+
+
+def split_tshark_batches(cfg: IngestConfig, skip_frames: int, sizer: BatchSizer) -> Iterator[Batch]:
+    """Como ``tshark_batches`` pero con ``--decode-jobs`` tshark en paralelo sobre tramos del pcap.
+
+    Los tramos se consumen en orden (como mucho ``2 * decode_jobs`` decodificados
+    por delante) y a cada lote se le suma el desplazamiento de frames de su
+    tramo, así que ``frame_number`` y el checkpoint quedan igual que en serie.
+    """
+    assert cfg.pcap is not None
+    chunks = pcap_split.plan_chunks(cfg.pcap, SPLIT_CHUNK_FRAMES, min_chunks=cfg.decode_jobs, start_after=skip_frames)
+    if chunks is None:
+        print(f"[WARN] {cfg.pcap.name} no se puede dividir en tramos; se decodifica con un solo tshark")
+        yield from tshark_batches(cfg, skip_frames, sizer)
+        return
+    print(f"[INFO] {cfg.pcap.name}: {len(chunks)} tramos con {cfg.decode_jobs} tshark en paralelo")
+
+    source = f"tshark:{cfg.mode}:{cfg.pcap}"
+    formatter = columnar.IsoFormatter()
+    window = 2 * cfg.decode_jobs
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=cfg.decode_jobs, thread_name_prefix="tshark-split")
+    pending: Deque[Tuple[pcap_split.Chunk, concurrent.futures.Future]] = collections.deque()
+    todo = iter(chunks)
+    try:
+        while not STOP:
+            for chunk in itertools.islice(todo, window - len(pending)):
+                pending.append((chunk, pool.submit(_decode_chunk, cfg, chunk)))
+            if not pending:
+                break
+            chunk, future = pending.popleft()
+            lines = future.result()
+            LINES_READ.inc(len(lines))
+            for start in range(0, len(lines), sizer.size):
+                block = lines[start:start + sizer.size]
+                started = time.perf_counter()
+                batch = decode_block(cfg, block, source, formatter)
+                shift_frames(batch, chunk.frame_offset)
+                PARSE_SECONDS.observe(time.perf_counter() - started)
+                ROWS_DECODED.inc(len(batch))
+                ROWS_REJECTED.inc(len(block) - len(batch))
+                if batch:
+                    yield batch
+                if STOP:
+                    return
+    finally:
+        for _, future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+
+def native_batches(cfg: IngestConfig, skip_frames: int, sizer: BatchSizer) -> Iterator[Batch]:
+    """Lotes desde el lector nativo de pcap (sin disección de tshark)."""
+    assert cfg.pcap is not None
+    print(f"[INFO] Lector nativo: {cfg.pcap}")
+    source = f"native:{cfg.mode}:{cfg.pcap}"
+    headers = pcap_reader.iter_headers(cfg.pcap, start_after=skip_frames)
+    if cfg.protocol_from == "tshark":
+        headers = pcap_reader.with_tshark_protocols(headers, cfg.pcap, start_after=skip_frames)
     batch: List[Dict[str, Any]] = []
+    for header in headers:
+        if STOP:
+            return
+        batch.append(header_to_record(header, source))
+        if len(batch) >= sizer.size:
+            ROWS_DECODED.inc(len(batch))
+            yield batch
+            batch = []
+    if batch:
+        ROWS_DECODED.inc(len(batch))
+        yield batch
+
+
+def submit_batch(batch: Batch, stages: List[Any], sink: Any, checkpoint: Optional[FrameCheckpoint]) -> None:
+    # Antes de las etapas: --dedup puede quitar filas (incluida la última)
+    last_frame = batch_last_frame(batch)
+    for stage in stages:
+        batch = stage.process(batch)
+
+    # Qué hacer cuando el lote quede confirmado: checkpoint y etapas que dependen de ello
+    acks: List[AckCallback] = [checkpoint.track(last_frame)] if checkpoint else []
+    for stage in stages:
+        delivered = getattr(stage, "delivered", None)
+        if delivered is not None:
+            acks.append(delivered(batch))
+    on_done = chain_acks(acks)
+    if not batch and on_done is not None:
+        on_done()  # todo eran duplicados: nada que enviar, pero el frame cuenta
+        return
+    sink.submit(batch, on_done)
+
 
+def open_pcap_range(cfg: IngestConfig) -> Optional[capture_archive.RangeStream]:
+    """Tramo ``--from/--to`` del pcap (o archivo .gz), leído vía su índice."""
+    assert cfg.pcap is not None
     try:
-        for line in stream_lines(proc):
-            parts = line.rstrip("\n").split("\t")
-            row = to_record(parts, source=source)
-            if not row:
-                continue
-            batch.append(row)
+        stream = capture_archive.open_range(cfg.pcap, cfg.time_from, cfg.time_to)
+    except (OSError, ValueError) as exc:
+        print(f"[ERROR] No se pudo leer {cfg.pcap.name}: {exc}")
+        sys.exit(1)
+    if stream is None:
+        print(
+            f"[INFO] {cfg.pcap.name}: ningún frame entre {capture_archive.format_time(cfg.time_from)} "
+            f"y {capture_archive.format_time(cfg.time_to)}"
+        )
+        return None
+    print(f"[INFO] {cfg.pcap.name}: tramo desde el frame {stream.frame_offset + 1}")
+    return stream
 
-            if cfg.limit and (sent + len(batch)) >= cfg.limit:
-                # ajusta al límite exacto
-                keep = cfg.limit - sent
-                batch = batch[:keep]
 
-            if len(batch) >= cfg.batch_size or (cfg.limit and (sent + len(batch)) >= cfg.limit):
-                post_batch(cfg, batch)
-                sent += len(batch)
-                print(f"[OK] Filas enviadas acumuladas: {sent}")
+def range_batches(cfg: IngestConfig, stream: capture_archive.RangeStream, sizer: BatchSizer) -> Iterator[Batch]:
+    """Lotes del tramo ``stream``, decodificado según ``--reader`` sin copia en disco."""
+    if cfg.reader == "tshark":
+        yield from tshark_batches(cfg, 0, sizer, stdin=stream)
+        return
+    source = f"native:{cfg.mode}:{cfg.pcap}"
+    decoder = pcap_reader.PcapStream()
+    batch: List[Dict[str, Any]] = []
+    for block in stream:
+        for header in decoder.feed(block):
+            batch.append(header_to_record(header, source))
+            if len(batch) >= sizer.size:
+                ROWS_DECODED.inc(len(batch))
+                yield batch
                 batch = []
+        if STOP:
+            return
+    if batch:
+        ROWS_DECODED.inc(len(batch))
+        yield batch
+
+
+def shifted_batches(batches: Iterator[Batch], offset: int) -> Iterator[Batch]:
+    try:
+        for batch in batches:
+            shift_frames(batch, offset)
+            yield batch
+    finally:
+        batches.close()
 
-            if cfg.limit and sent >= cfg.limit:
+
+def run_ingest(cfg: IngestConfig) -> None:
+    stream: Optional[capture_archive.RangeStream] = None
+    if cfg.mode == "file" and cfg.pcap and (
+        cfg.time_from is not None or cfg.time_to is not None or cfg.pcap.name.endswith(capture_archive.ARCHIVE_SUFFIX)
+    ):
+        # El tramo se decodifica en flujo con los frame_number del original; un
+        # rango es una consulta puntual, así que no lleva checkpoint
+        stream = open_pcap_range(cfg)
+        if stream is None:
+            return
+
+    checkpoint: Optional[FrameCheckpoint] = None
+    skip_frames = 0
+    if cfg.mode == "file" and cfg.pcap and cfg.resume and not cfg.dry_run and stream is None:
+        checkpoint = FrameCheckpoint(cfg.pcap, cfg.state_dir)
+        skip_frames = checkpoint.load()
+        if checkpoint.complete:
+            print(f"[OK] {cfg.pcap.name} ya estaba ingerido completo ({checkpoint.path})")
+            return
+        if skip_frames:
+            print(f"[INFO] Reanudando {cfg.pcap.name} tras el frame {skip_frames}")
+
+    sizer = BatchSizer(
+        cfg.batch_size,
+        adaptive=cfg.adaptive_batch,
+        target_sec=cfg.target_post_ms / 1000.0,
+        max_bytes=cfg.max_batch_bytes,
+    )
+    if stream is not None:
+        batches = shifted_batches(range_batches(cfg, stream, sizer), stream.frame_offset)
+    elif cfg.reader == "native":
+        batches = native_batches(cfg, skip_frames, sizer)
+    elif cfg.decode_jobs > 1 and cfg.mode == "file":
+        batches = split_tshark_batches(cfg, skip_frames, sizer)
+    else:
+        batches = tshark_batches(cfg, skip_frames, sizer)
+
+    sink = build_sink(cfg, sizer)
+    stages = build_stages(cfg)
+    queued = 0
+
+    try:
+        for batch in batches:
+            if cfg.limit and (queued + len(batch)) >= cfg.limit:
+                # ajusta al límite exacto
+                batch = batch[: cfg.limit - queued]
+
+            submit_batch(batch, stages, sink, checkpoint)
+            queued += len(batch)
+            if checkpoint:
+                checkpoint.save()
+
+            if cfg.limit and queued >= cfg.limit:
                 break
 
-        if batch:
-            post_batch(cfg, batch)
-            sent += len(batch)
-            print(f"[OK] Filas enviadas acumuladas: {sent}")
+    finally:
+        batches.close()
+
+        # Espera a los lotes en vuelo (sus confirmaciones alimentan etapas como
+        # embeddings) y luego vacía las etapas; relanza el error si algún POST falló
+        try:
+            close_all([sink] + stages)
+        finally:
+            if checkpoint:
+                checkpoint.save(force=True)
+
+    if checkpoint and not STOP and not (cfg.limit and queued >= cfg.limit):
+        checkpoint.save(complete=True)
+        print(f"[OK] Checkpoint: {cfg.pcap.name} completo ({checkpoint.path})")
+    if stream is not None and stream.frames:
+        print(
+            f"[INFO] {cfg.pcap.name}: frames {stream.frame_offset + 1}-{stream.frame_offset + stream.frames} "
+            f"({stream.read_bytes} bytes leídos del disco)"
+        )
+    print("[OK] Ingesta finalizada")
+
+
+def run_tail(cfg: IngestConfig) -> None:
+    """Sigue el anillo de dumpcap (``RingTail``) y sube lo que se va escribiendo.
+
+    Cada fichero lleva su checkpoint como en modo file: al rotar, cuando todos
+    sus lotes están confirmados, se marca completo (``--mode dir`` ya no lo
+    repite). Al relanzar se continúa en el fichero más reciente tras el último
+    frame confirmado.
+    """
+    assert cfg.capture_dir is not None
+    resume = cfg.resume and not cfg.dry_run
+    ring = list_ring_files(cfg.capture_dir)
+    start = ring[-1].path if ring else None
+    checkpoint: Optional[FrameCheckpoint] = None
+    start_after = 0
+    if start is not None and resume:
+        checkpoint = FrameCheckpoint(start, cfg.state_dir)
+        start_after = checkpoint.load(growing=True)
+        if start_after:
+            print(f"[INFO] Reanudando {start.name} tras el frame {start_after}")
+    tail = RingTail(cfg.capture_dir, start=start, start_after=start_after, from_end=cfg.tail_from == "end" and not start_after)
+
+    sizer = BatchSizer(
+        cfg.batch_size,
+        adaptive=cfg.adaptive_batch,
+        target_sec=cfg.target_post_ms / 1000.0,
+        max_bytes=cfg.max_batch_bytes,
+    )
+    sink = build_sink(cfg, sizer)
+    stages = build_stages(cfg)
+    linger = cfg.linger_ms / 1000.0
+    current: Optional[Path] = start
+    rotated: List[FrameCheckpoint] = []
+    batch: List[Dict[str, Any]] = []
+    first_at = 0.0
+    queued = 0
+
+    def flush() -> None:
+        nonlocal batch, queued
+        if cfg.limit:
+            batch = batch[: cfg.limit - queued]
+        ROWS_DECODED.inc(len(batch))
+        submit_batch(batch, stages, sink, checkpoint)
+        queued += len(batch)
+        batch = []
+
+    def finish_rotated(final: bool = False) -> None:
+        for ckpt in list(rotated):
+            if ckpt.settled or final:
+                ckpt.save(complete=ckpt.settled, force=True)
+                rotated.remove(ckpt)
 
+    try:
+        while not STOP and not (cfg.limit and queued >= cfg.limit):
+            timeout = 0.5
+            if batch and linger:
+                timeout = max(0.0, min(timeout, first_at + linger - time.monotonic()))
+            path, headers = tail.read(timeout)
+
+            if path is not None and path != current:
+                # Rotación: lo pendiente es del fichero anterior
+                if batch:
+                    flush()
+                if checkpoint is not None:
+                    try:
+                        checkpoint.refresh_fingerprint()
+                        rotated.append(checkpoint)
+                    except FileNotFoundError:
+                        pass  # el anillo ya lo borró
+                current = path
+                checkpoint = FrameCheckpoint(path, cfg.state_dir) if resume else None
+
+            source = f"native:tail:{current}"
+            for header in headers:
+                if not batch:
+                    first_at = time.monotonic()
+                batch.append(header_to_record(header, source))
+                if len(batch) >= sizer.size or (cfg.limit and queued + len(batch) >= cfg.limit):
+                    flush()
+            if batch and (not linger or time.monotonic() - first_at >= linger):
+                flush()
+
+            finish_rotated()
+            if checkpoint is not None:
+                checkpoint.save()
+        if batch and not (cfg.limit and queued >= cfg.limit):
+            flush()
     finally:
-        if STOP and proc.poll() is None:
-            proc.terminate()
+        tail.close()
         try:
-            _, stderr = proc.communicate(timeout=3)
-        except subprocess.TimeoutExpired:
-            proc.kill()
-            _, stderr = proc.communicate()
+            close_all([sink] + stages)
+        finally:
+            finish_rotated(final=True)
+            if checkpoint is not None:
+                checkpoint.save(force=True)
+    print(f"[OK] Modo tail finalizado: {queued} filas")
 
-        if stderr:
-            # Tshark suele escribir mensajes informativos en stderr
-            tail = "\n".join(stderr.splitlines()[-5:])
-            if tail.strip():
-                print(f"[INFO] tshark stderr (últimas líneas):\n{tail}")
 
-    print("[OK] Ingesta finalizada")
+def _ingest_file_job(cfg: IngestConfig) -> None:
+    # Punto de entrada de cada proceso del pool (debe ser picklable)
+    run_ingest(cfg)
+
+
+def run_dir(cfg: IngestConfig) -> None:
+    """Ingiere los ficheros cerrados del anillo con un pool de procesos.
+
+    Cada fichero es una ingesta ``--mode file`` independiente (un tshark por
+    proceso) y conserva su checkpoint, así que relanzar el modo dir sólo
+    procesa lo pendiente. Con ``--watch`` se queda esperando rotaciones.
+    """
+    assert cfg.capture_dir is not None
+    watcher = DirectoryWatcher(cfg.capture_dir) if cfg.watch else None
+    scheduled: set = set()
+    failed = 0
+    pending: Dict[concurrent.futures.Future, Path] = {}
+    if cfg.dedup and cfg.jobs > 1:
+        # Varios procesos no pueden reescribir el mismo filtro: se usa sólo para leer
+        print("[INFO] --dedup con --jobs > 1: el filtro no se actualiza; los repetidos los descarta el servidor")
+        cfg = dataclasses.replace(cfg, dedup_save=False)
+
+    partitions: Optional[PartitionManager] = None
+    if cfg.partition_by and cfg.send_packets and not cfg.dry_run:
+        # La conversión se hace aquí, una vez; los procesos del pool sólo crean particiones
+        partitions = build_partitions(cfg)
+        cfg = dataclasses.replace(cfg, partition_bootstrap=False)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=cfg.jobs) as pool:
+        try:
+            while not STOP:
+                if partitions is not None and partitions.maintain_due():
+                    try:
+                        partitions.maintain()
+                    except partitions.errors as exc:
+                        print(f"[WARN] Mantenimiento de particiones: {describe_error(exc)}")
+                for ring_file in closed_ring_files(cfg.capture_dir, cfg.idle_close_sec):
+                    if ring_file.path in scheduled:
+                        continue
+                    scheduled.add(ring_file.path)
+                    file_cfg = dataclasses.replace(cfg, mode="file", pcap=ring_file.path)
+                    if cfg.spool_dir is not None:
+                        # Un spool por fichero: varios procesos no comparten segmentos
+                        file_cfg.spool_dir = cfg.spool_dir / ring_file.path.stem
+                    pending[pool.submit(_ingest_file_job, file_cfg)] = ring_file.path
+
+                if not pending and watcher is None:
+                    break
+
+                done, _ = concurrent.futures.wait(
+                    list(pending), timeout=0 if watcher else None,
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                for fut in done:
+                    path = pending.pop(fut)
+                    try:
+                        fut.result()
+                    except Exception as exc:
+                        failed += 1
+                        print(f"[ERROR] Falló la ingesta de {path.name}: {exc}")
+
+                if watcher is not None and not done:
+                    watcher.wait(1.0)
+        finally:
+            if watcher is not None:
+                watcher.close()
+            if partitions is not None:
+                partitions.close()
+            # Ctrl-C también llega a los hijos: terminan su fichero y guardan checkpoint
+            for fut in concurrent.futures.as_completed(list(pending)):
+                path = pending.pop(fut)
+                try:
+                    fut.result()
+                except Exception as exc:
+                    failed += 1
+                    print(f"[ERROR] Falló la ingesta de {path.name}: {exc}")
+
+    print(f"[OK] Modo dir finalizado: {len(scheduled)} ficheros, {failed} con error")
+    if failed:
+        sys.exit(1)
+
+
+def run_import(cfg: IngestConfig) -> None:
+    """Sube una exportación JSON (p. ej. ``network_packets_rows.json``) fila a fila.
+
+    El fichero se lee en streaming y los lotes pasan por el mismo destino y
+    etapas que la captura; con el ``id`` de la exportación reimportar el mismo
+    fichero no duplica filas.
+    """
+    assert cfg.import_json is not None
+    sizer = BatchSizer(
+        cfg.batch_size,
+        adaptive=cfg.adaptive_batch,
+        target_sec=cfg.target_post_ms / 1000.0,
+        max_bytes=cfg.max_batch_bytes,
+    )
+    rows = json_stream.iter_export(cfg.import_json, cfg.import_exclude)
+    sink = build_sink(cfg, sizer)
+    stages = build_stages(cfg)
+    queued = 0
+    try:
+        batch: List[Dict[str, Any]] = []
+        for row in rows:
+            if STOP:
+                break
+            batch.append(row)
+            if len(batch) >= sizer.size:
+                submit_batch(batch, stages, sink, None)
+                queued += len(batch)
+                batch = []
+            if cfg.limit and queued + len(batch) >= cfg.limit:
+                break
+        if batch and not STOP:
+            submit_batch(batch, stages, sink, None)
+            queued += len(batch)
+    except (ValueError, UnicodeDecodeError) as exc:
+        print(f"[ERROR] Exportación inválida tras {queued} filas: {exc}")
+        sys.exit(1)
+    finally:
+        rows.close()
+        close_all([sink] + stages)
+    print(f"[OK] Importación finalizada: {queued} filas de {cfg.import_json.name}")
+
+
+def run_replay(cfg: IngestConfig) -> None:
+    assert cfg.spool_dir is not None
+    # El modo dir deja un spool por fichero en subdirectorios
+    directories = [cfg.spool_dir] + sorted(p for p in cfg.spool_dir.iterdir() if p.is_dir())
+    for directory in directories:
+        if STOP:
+            break
+        if not any(directory.glob("seg-*")):
+            continue
+        sink = SpoolSink(dataclasses.replace(cfg, spool_dir=directory))
+        print(f"[INFO] Reenviando spool {directory} ({sink.spool.size_bytes()} bytes)")
+        sink.close()
+    print("[OK] Reenvío finalizado")
+
+
+def _ms(seconds: Optional[float]) -> str:
+    return f"{seconds * 1000:.0f}ms" if seconds is not None else "-"
+
+
+def stats_summary() -> str:
+    """Resumen de una línea para --stats-interval."""
+    return (
+        f"[STATS] lineas={LINES_READ.total():.0f} filas={ROWS_DECODED.total():.0f} "
+        f"descartadas={ROWS_REJECTED.total():.0f} enviadas={ROWS_SENT.value('packets'):.0f} "
+        f"MB={BYTES_SENT.total() / 1e6:.1f} envio_p50={_ms(SEND_SECONDS.quantile(0.5, 'packets'))} "
+        f"envio_p95={_ms(SEND_SECONDS.quantile(0.95, 'packets'))} cola={QUEUE_DEPTH.total():.0f} "
+        f"perdidos_tshark={TSHARK_DROPPED.total():.0f}"
+    )
+
+
+def start_telemetry(cfg: IngestConfig) -> List[Any]:
+    """Arranca /metrics y el resumen periódico si se pidieron; devuelve lo que hay que cerrar."""
+    running: List[Any] = []
+    if cfg.metrics_port:
+        server = MetricsServer(METRICS, cfg.metrics_port, cfg.metrics_host)
+        print(f"[INFO] Métricas en http://{cfg.metrics_host}:{server.port}/metrics")
+        running.append(server)
+    if cfg.stats_interval > 0:
+        running.append(PeriodicReporter(stats_summary, cfg.stats_interval))
+    return running
 
 
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser(description="Ingesta tshark -> Supabase (network_packets)")
-    p.add_argument("--mode", choices=["file", "live"], required=True)
+    p.add_argument("--mode", choices=["file", "live", "replay", "dir", "tail", "import"], required=True)
     p.add_argument("--iface", help="Interfaz para modo live (ej: wlx90de8047828f)")
-    p.add_argument("--pcap", help="Archivo pcap para modo file")
+    p.add_argument("--pcap", help="Archivo pcap (o .gz de capture_archive.py) para modo file")
+    p.add_argument("--from", dest="time_from", help="Modo file: sólo frames desde esta hora (epoch o ISO, sin zona = local)")
+    p.add_argument("--to", dest="time_to", help="Modo file: sólo frames hasta esta hora (epoch o ISO, sin zona = local)")
+    p.add_argument("--import-json", help="Exportación JSON de network_packets para modo import")
+    p.add_argument(
+        "--import-exclude",
+        default="idx",
+        help="Columnas de la exportación que no se envían, separadas por comas (las genera la BD)",
+    )
+    p.add_argument(
+        "--reader",
+        choices=["tshark", "native"],
+        default="tshark",
+        help="Modos file/dir: 'native' lee el pcap con mmap sin disección de tshark (mucho más rápido)",
+    )
+    p.add_argument(
+        "--protocol-from",
+        choices=["native", "tshark"],
+        default="native",
+        help="Con --reader native: protocolo de transporte o columna de protocolo de tshark",
+    )
+    p.add_argument(
+        "--decoder",
+        choices=["columnar", "row"],
+        default="columnar",
+        help="Decodificación de las líneas de tshark: por bloques en columnas o fila a fila (to_record)",
+    )
+    p.add_argument(
+        "--decode-jobs",
+        type=int,
+        default=1,
+        help="Modos file/dir con tshark: divide cada pcap en tramos y los decodifica con N tshark en paralelo",
+    )
+    p.add_argument("--capture-dir", help="Directorio del anillo de PCAPs para los modos dir y tail")
+    p.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Modo dir: ficheros en paralelo (un tshark cada uno)")
+    p.add_argument("--watch", action="store_true", help="Modo dir: sigue esperando nuevas rotaciones")
+    p.add_argument("--idle-close-sec", type=float, default=120.0, help="Modo dir: el fichero más reciente se da por cerrado tras N s sin cambios")
+    p.add_argument(
+        "--tail-from",
+        choices=["current", "end"],
+        default="current",
+        help="Modo tail sin checkpoint: desde el principio del fichero en curso o sólo lo nuevo",
+    )
     p.add_argument("--table", default="network_packets")
+    p.add_argument(
+        "--sink",
+        choices=["supabase", "postgres", "collector"],
+        default="supabase",
+        help="Destino de network_packets: PostgREST (JSON), COPY directo a Postgres (--pg-dsn) o el collector central (--collector)",
+    )
+    p.add_argument(
+        "--pg-dsn",
+        default=os.getenv("PG_DSN"),
+        help="DSN de Postgres para --sink postgres y --partition-by (o variable PG_DSN)",
+    )
+    add_partition_args(p)
+    p.add_argument(
+        "--collector",
+        default=os.getenv("COLLECTOR_ADDR"),
+        help="host:puerto del collector para --sink collector (o variable COLLECTOR_ADDR; token en COLLECTOR_TOKEN)",
+    )
+    p.add_argument("--collector-window", type=int, default=64, help="Lotes sin confirmar por el collector antes de frenar")
     p.add_argument("--batch-size", type=int, default=200)
+    p.add_argument(
+        "--linger-ms",
+        type=int,
+        help="Envía el lote pendiente tras N ms aunque no esté lleno (por defecto 1000 en live y tail, desactivado en file)",
+    )
+    p.add_argument("--adaptive-batch", action="store_true", help="Ajusta el tamaño de lote según la latencia de los POST")
+    p.add_argument("--target-post-ms", type=float, default=500.0, help="Con --adaptive-batch: latencia objetivo por POST")
+    p.add_argument("--max-batch-bytes", type=int, default=1024 * 1024, help="Con --adaptive-batch: tamaño máximo del cuerpo JSON")
+    p.add_argument("--workers", type=int, default=2, help="Workers de subida en paralelo (cada uno con su sesión HTTP)")
+    p.add_argument("--max-inflight", type=int, default=4, help="Lotes máximos en cola esperando subida")
+    p.add_argument("--flows", action="store_true", help="Agrega paquetes en flujos bidireccionales y los sube a --flow-table")
+    p.add_argument("--flow-table", default="network_flows")
+    p.add_argument("--flow-idle-timeout", type=float, default=30.0, help="Segundos sin paquetes para cerrar un flujo")
+    p.add_argument("--flow-active-timeout", type=float, default=300.0, help="Duración máxima de un flujo antes de emitirlo")
+    p.add_argument("--flow-max", type=int, default=100_000, help="Flujos máximos en memoria (expulsa el menos reciente)")
+    p.add_argument("--no-packets", action="store_true", help="No sube filas a network_packets (p. ej. sólo flujos)")
+    p.add_argument("--influx", action="store_true", help="Escribe métricas por ventana (net_window_metrics) en InfluxDB (INFLUX_URL/TOKEN/ORG/BUCKET)")
+    p.add_argument("--influx-windows", default="5,30", help="Anchos de ventana en segundos, separados por coma")
+    p.add_argument("--influx-lateness", type=float, default=10.0, help="Segundos de retraso tolerados antes de cerrar una ventana")
+    p.add_argument("--sensor-id", default=socket.gethostname(), help="Tag sensor_id de las métricas")
+    p.add_argument("--embeddings", action="store_true", help="Genera embeddings de cada paquete y los sube a --embedding-table")
+    p.add_argument("--embedding-table", default="network_packet_embeddings")
+    p.add_argument(
+        "--embedder",
+        choices=["hashing", "sentence-transformers"],
+        default="hashing",
+        help="'hashing' no necesita dependencias; 'sentence-transformers' usa --embedding-model en CPU",
+    )
+    p.add_argument("--embedding-model", default="sentence-transformers/all-MiniLM-L6-v2")
+    p.add_argument("--embedding-cache", help="Caché SQLite de embeddings en disco (persistente entre ejecuciones)")
+    p.add_argument("--embedding-cache-size", type=int, default=50_000, help="Embeddings máximos en la caché en memoria")
+    p.add_argument("--dedup", action="store_true", help="Descarta paquetes ya enviados en otras ejecuciones (filtro de Bloom + id determinista)")
+    p.add_argument("--dedup-file", help="Filtro de duplicados persistente (por defecto <state-dir>/dedup.bloom o ./ingest-dedup.bloom)")
+    p.add_argument("--dedup-capacity", type=int, default=1_000_000, help="Paquetes del primer tramo del filtro (crece al llenarse)")
+    p.add_argument("--dedup-error", type=float, default=0.001, help="Tasa de falsos positivos objetivo del filtro")
+    p.add_argument("--dedup-window", type=int, default=5_000_000, help="Paquetes por generación; se recuerdan las dos últimas")
+    p.add_argument("--enrich", action="store_true", help="Añade a metadata MAC/hostname (leases DHCP), rol de cada IP y dirección")
+    p.add_argument("--dhcp-leases", default=str(DEFAULT_LEASES), help="Fichero de leases de dnsmasq para --enrich")
+    p.add_argument("--ap-ip", default="192.168.50.1/24", help="IP/CIDR del AP (la de setting-ap.py) para --enrich")
+    p.add_argument("--enrich-cache-size", type=int, default=65536, help="IPs en la caché LRU de --enrich")
+    p.add_argument("--detect", action="store_true", help="Marca escaneos (T1046/T1018) y exfiltración (T1041) en las filas")
+    p.add_argument("--detect-window", type=float, default=60.0, help="Con --detect: ventana deslizante en segundos")
+    p.add_argument("--detect-scan-ports", type=int, default=100, help="Puertos destino distintos por origen y ventana para T1046")
+    p.add_argument("--detect-scan-hosts", type=int, default=64, help="Hosts internos distintos por origen y ventana para T1018")
+    p.add_argument("--detect-exfil-mb", type=float, default=20.0, help="MB de un host interno a un destino público por ventana para T1041")
+    p.add_argument("--detect-max-sources", type=int, default=4096, help="Orígenes vigilados a la vez (~1.3 KB cada uno)")
+    p.add_argument("--top-talkers", action="store_true", help="Top-K por src/dst/puerto/protocolo cada --top-interval s (memoria fija)")
+    p.add_argument("--top-k", type=int, default=10)
+    p.add_argument("--top-interval", type=float, default=60.0, help="Con --top-talkers: segundos por snapshot (tiempo de los paquetes)")
+    p.add_argument("--top-table", default="network_top_talkers")
+    p.add_argument("--top-file", help="Con --top-talkers: escribe los snapshots en este JSONL en vez de en --top-table")
+    p.add_argument("--chains", action="store_true", help="Sigue en vivo el progreso de las cadenas de ataque (filas con attack_chain_id)")
+    p.add_argument("--chain-ttl", type=float, default=3600.0, help="Con --chains: segundos sin paquetes para dar por caducada una cadena incompleta")
+    p.add_argument("--chain-max", type=int, default=100_000, help="Con --chains: cadenas vigiladas a la vez")
+    p.add_argument("--chain-table", default="attack_chain_status")
+    p.add_argument("--chain-file", help="Con --chains: escribe los eventos en este JSONL en vez de en --chain-table")
+    p.add_argument("--spool-dir", help="Spool local: los lotes se guardan en disco y se suben en segundo plano")
+    p.add_argument("--spool-max-mb", type=int, default=512, help="Tamaño máximo del spool (descarta lo más antiguo)")
+    p.add_argument("--no-resume", action="store_true", help="Modo file: ignora y no escribe checkpoints")
+    p.add_argument("--state-dir", help="Directorio para checkpoints (por defecto, junto al pcap)")
+    p.add_argument("--metrics-port", type=int, default=0, help="Expone métricas Prometheus en http://HOST:PORT/metrics")
+    p.add_argument("--metrics-host", default="127.0.0.1")
+    p.add_argument("--stats-interval", type=float, default=0.0, help="Imprime un resumen de métricas cada N segundos")
     p.add_argument("--limit", type=int, help="Máximo de filas a enviar (útil para pruebas)")
     p.add_argument("--dry-run", action="store_true")
     return p.parse_args()
 
 
 def build_config(args: argparse.Namespace) -> IngestConfig:
-    supabase_url = os.getenv("SUPABASE_URL")
-    supabase_key = os.getenv("SUPABASE_API_KEY")
-
-    if not supabase_url or not supabase_key:
+    supabase_url = os.getenv("SUPABASE_URL") or ""
+    supabase_key = os.getenv("SUPABASE_API_KEY") or ""
+
+    # Con --no-packets o --sink postgres/collector, y sin --flows/--embeddings, no se habla con PostgREST
+    packets_via_rest = not args.no_packets and args.sink == "supabase"
+    top_via_rest = args.top_talkers and not args.top_file
+    chains_via_rest = args.chains and not args.chain_file
+    uses_supabase = (
+        args.mode == "replay" or packets_via_rest or args.flows or args.embeddings or top_via_rest or chains_via_rest
+    )
+    if uses_supabase and (not supabase_url or not supabase_key):
         print("[ERROR] Define SUPABASE_URL y SUPABASE_API_KEY en el entorno")
         sys.exit(1)
 
+    try:
+        influx_windows = tuple(int(w) for w in args.influx_windows.split(",") if w.strip())
+    except ValueError:
+        influx_windows = ()
+    if args.influx:
+        if not influx_windows or min(influx_windows) < 1:
+            print("[ERROR] --influx-windows debe ser una lista de segundos >= 1 (ej: 5,30)")
+            sys.exit(1)
+        if not args.dry_run and InfluxWriter.from_env() is None:
+            print("[ERROR] Define INFLUX_URL, INFLUX_TOKEN, INFLUX_ORG e INFLUX_BUCKET en el entorno")
+            sys.exit(1)
+
     pcap = Path(args.pcap).expanduser().resolve() if args.pcap else None
     if args.mode == "file":
         if not pcap or not pcap.exists():
             print("[ERROR] --pcap no existe o no fue indicado")
             sys.exit(1)
+        if pcap.name.endswith(capture_archive.ARCHIVE_SUFFIX) and capture_archive.load_index(pcap) is None:
+            print(f"[ERROR] {pcap.name} no tiene índice {capture_archive.index_path(pcap).name} (lo genera capture_archive.py)")
+            sys.exit(1)
+
+    time_from = time_to = None
+    if args.time_from or args.time_to:
+        if args.mode != "file":
+            print("[ERROR] --from/--to sólo aplican a --mode file")
+            sys.exit(1)
+        try:
+            time_from = capture_archive.parse_time(args.time_from) if args.time_from else None
+            time_to = capture_archive.parse_time(args.time_to) if args.time_to else None
+        except ValueError as exc:
+            print(f"[ERROR] --from/--to: {exc}")
+            sys.exit(1)
+        if time_from is not None and time_to is not None and time_from > time_to:
+            print("[ERROR] --from debe ser anterior a --to")
+            sys.exit(1)
+    ranged = time_from is not None or time_to is not None or bool(pcap and pcap.name.endswith(capture_archive.ARCHIVE_SUFFIX))
+    if args.mode == "file" and ranged and args.reader == "native" and args.protocol_from == "tshark":
+        # El tramo se lee en flujo: no hay fichero que pasar al segundo tshark
+        print("[ERROR] --protocol-from tshark no aplica a --from/--to ni a archivos .gz (usa --reader tshark)")
+        sys.exit(1)
+
+    import_json = Path(args.import_json).expanduser().resolve() if args.import_json else None
+    if args.mode == "import":
+        if not import_json or not import_json.is_file():
+            print("[ERROR] --import-json no existe o no fue indicado (requerido en modo import)")
+            sys.exit(1)
+        if args.dedup or args.detect:
+            # La exportación ya trae id y etiquetas: se subirían con otros valores
+            print("[ERROR] --dedup y --detect no aplican a --mode import")
+            sys.exit(1)
+
+    capture_dir = Path(args.capture_dir).expanduser().resolve() if args.capture_dir else None
+    if args.mode in ("dir", "tail"):
+        if not capture_dir or not capture_dir.is_dir():
+            print("[ERROR] --capture-dir no existe o no fue indicado")
+            sys.exit(1)
+        if args.jobs < 1:
+            print("[ERROR] --jobs debe ser >= 1")
+            sys.exit(1)
+
+    spool_dir = Path(args.spool_dir).expanduser().resolve() if args.spool_dir else None
+    if args.mode == "replay" and (spool_dir is None or not spool_dir.is_dir()):
+        print("[ERROR] --spool-dir no existe o no fue indicado (requerido en modo replay)")
+        sys.exit(1)
+
+    if args.reader == "native" and args.mode == "live":
+        print("[ERROR] --reader native sólo aplica a los modos file y dir")
+        sys.exit(1)
+
+    if args.decode_jobs < 1:
+        print("[ERROR] --decode-jobs debe ser >= 1")
+        sys.exit(1)
+    if args.decode_jobs > 1 and (args.mode not in ("file", "dir") or args.reader != "tshark"):
+        print("[ERROR] --decode-jobs sólo aplica a los modos file y dir con --reader tshark")
+        sys.exit(1)
+
+    if args.mode == "tail" and args.protocol_from == "tshark":
+        # El modo tail siempre usa el lector nativo: tshark no sigue un fichero que crece
+        print("[ERROR] --protocol-from tshark no aplica a --mode tail")
+        sys.exit(1)
+
+    validate_partition_args(args)
+    if args.partition_by and args.sink == "collector":
+        print("[ERROR] Con --sink collector las particiones las gestiona collector.py (--partition-by allí)")
+        sys.exit(1)
+
+    if args.sink == "postgres":
+        if not args.pg_dsn:
+            print("[ERROR] --sink postgres requiere --pg-dsn o la variable PG_DSN")
+            sys.exit(1)
+        if args.spool_dir or args.mode == "replay":
+            print("[ERROR] --spool-dir y --mode replay sólo aplican a --sink supabase")
+            sys.exit(1)
+        if not args.dry_run:
+            try:
+                load_driver()
+            except RuntimeError as exc:
+                print(f"[ERROR] {exc}")
+                sys.exit(1)
+
+    collector_addr = ("", 7400)
+    if args.sink == "collector":
+        host, _, port = (args.collector or "").rpartition(":")
+        if not host or not port.isdigit():
+            print("[ERROR] --sink collector requiere --collector host:puerto o la variable COLLECTOR_ADDR")
+            sys.exit(1)
+        collector_addr = (host.strip("[]"), int(port))
+        if args.spool_dir or args.mode == "replay":
+            print("[ERROR] --spool-dir y --mode replay sólo aplican a --sink supabase")
+            sys.exit(1)
+        if args.collector_window < 1:
+            print("[ERROR] --collector-window debe ser >= 1")
+            sys.exit(1)
+
+    if args.embeddings and (args.spool_dir or args.no_packets):
+        # packet_id es FK: el paquete debe estar en la BD antes que su embedding
+        print("[ERROR] --embeddings no es compatible con --spool-dir ni con --no-packets")
+        sys.exit(1)
+
+    if args.flow_max < 1:
+        print("[ERROR] --flow-max debe ser >= 1")
+        sys.exit(1)
+
+    if args.detect and (
+        args.detect_window <= 0 or args.detect_scan_ports < 1 or args.detect_scan_hosts < 1
+        or args.detect_exfil_mb <= 0 or args.detect_max_sources < 1
+    ):
+        print("[ERROR] --detect-window y --detect-exfil-mb deben ser > 0; umbrales y --detect-max-sources >= 1")
+        sys.exit(1)
+
+    if args.enrich:
+        try:
+            ipaddress.ip_interface(args.ap_ip)
+        except ValueError:
+            print(f"[ERROR] --ap-ip no es una IP/CIDR válida: {args.ap_ip}")
+            sys.exit(1)
+        if args.enrich_cache_size < 1:
+            print("[ERROR] --enrich-cache-size debe ser >= 1")
+            sys.exit(1)
+
+    if args.top_talkers and (args.top_k < 1 or args.top_interval <= 0):
+        print("[ERROR] --top-k debe ser >= 1 y --top-interval > 0")
+        sys.exit(1)
+    if args.chains and (args.chain_ttl <= 0 or args.chain_max < 1):
+        print("[ERROR] --chain-ttl debe ser > 0 y --chain-max >= 1")
+        sys.exit(1)
+
+    state_dir = Path(args.state_dir).expanduser().resolve() if args.state_dir else None
+    dedup_file = None
+    if args.dedup:
+        if args.mode == "replay":
+            # El spool ya guarda los id; el reenvío usa ignore-duplicates sin más
+            print("[ERROR] --dedup no aplica a --mode replay")
+            sys.exit(1)
+        if args.dedup_capacity < 1 or args.dedup_window < args.dedup_capacity or not 0 < args.dedup_error < 1:
+            print("[ERROR] --dedup-capacity >= 1, --dedup-window >= --dedup-capacity y 0 < --dedup-error < 1")
+            sys.exit(1)
+        if args.dedup_file:
+            dedup_file = Path(args.dedup_file).expanduser().resolve()
+        else:
+            dedup_file = (state_dir or Path.cwd()) / ("dedup.bloom" if state_dir else "ingest-dedup.bloom")
+
+    linger_ms = args.linger_ms if args.linger_ms is not None else (1000 if args.mode in ("live", "tail") else 0)
+    if linger_ms < 0 or args.target_post_ms <= 0 or args.max_batch_bytes < 1:
+        print("[ERROR] --linger-ms debe ser >= 0; --target-post-ms y --max-batch-bytes > 0")
+        sys.exit(1)
+
+    if args.mode == "dir" and (args.metrics_port or args.stats_interval):
+        # Cada fichero se ingiere en otro proceso, con sus propios contadores
+        print("[ERROR] --metrics-port y --stats-interval no aplican a --mode dir")
+        sys.exit(1)
 
     if args.batch_size < 1:
         print("[ERROR] --batch-size debe ser >= 1")
         sys.exit(1)
 
+    if args.workers < 1 or args.max_inflight < 1:
+        print("[ERROR] --workers y --max-inflight deben ser >= 1")
+        sys.exit(1)
+
     return IngestConfig(
         supabase_url=supabase_url,
         supabase_api_key=supabase_key,
@@ -366,15 +2630,112 @@ def build_config(args: argparse.Namespace) -> IngestConfig:
         pcap=pcap,
         limit=args.limit,
         dry_run=args.dry_run,
+        workers=args.workers,
+        max_inflight=args.max_inflight,
+        spool_dir=spool_dir,
+        spool_max_mb=args.spool_max_mb,
+        resume=not args.no_resume,
+        state_dir=state_dir,
+        capture_dir=capture_dir,
+        jobs=args.jobs,
+        watch=args.watch,
+        idle_close_sec=args.idle_close_sec,
+        tail_from=args.tail_from,
+        decode_jobs=args.decode_jobs,
+        reader=args.reader,
+        protocol_from=args.protocol_from,
+        decoder=args.decoder,
+        flows=args.flows,
+        flow_table=args.flow_table,
+        flow_idle_timeout=args.flow_idle_timeout,
+        flow_active_timeout=args.flow_active_timeout,
+        flow_max=args.flow_max,
+        send_packets=not args.no_packets,
+        influx=args.influx,
+        influx_windows=influx_windows,
+        influx_lateness=args.influx_lateness,
+        sensor_id=args.sensor_id,
+        embeddings=args.embeddings,
+        embedding_table=args.embedding_table,
+        embedder=args.embedder,
+        embedding_model=args.embedding_model,
+        embedding_cache=Path(args.embedding_cache).expanduser().resolve() if args.embedding_cache else None,
+        embedding_cache_size=args.embedding_cache_size,
+        dedup=args.dedup,
+        dedup_file=dedup_file,
+        dedup_capacity=args.dedup_capacity,
+        dedup_error=args.dedup_error,
+        dedup_window=args.dedup_window,
+        detect=args.detect,
+        detect_window=args.detect_window,
+        detect_scan_ports=args.detect_scan_ports,
+        detect_scan_hosts=args.detect_scan_hosts,
+        detect_exfil_mb=args.detect_exfil_mb,
+        detect_max_sources=args.detect_max_sources,
+        top_talkers=args.top_talkers,
+        top_k=args.top_k,
+        top_interval=args.top_interval,
+        top_table=args.top_table,
+        top_file=Path(args.top_file).expanduser().resolve() if args.top_file else None,
+        chains=args.chains,
+        chain_ttl=args.chain_ttl,
+        chain_max=args.chain_max,
+        chain_table=args.chain_table,
+        chain_file=Path(args.chain_file).expanduser().resolve() if args.chain_file else None,
+        enrich=args.enrich,
+        dhcp_leases=Path(args.dhcp_leases).expanduser(),
+        ap_ip=args.ap_ip,
+        enrich_cache_size=args.enrich_cache_size,
+        sink=args.sink,
+        pg_dsn=args.pg_dsn,
+        collector_addr=collector_addr,
+        collector_token=os.getenv("COLLECTOR_TOKEN") or "",
+        collector_window=args.collector_window,
+        import_json=import_json,
+        import_exclude=tuple(c.strip() for c in args.import_exclude.split(",") if c.strip()),
+        time_from=time_from,
+        time_to=time_to,
+        partition_by=args.partition_by,
+        partition_premake=args.partition_premake,
+        partition_retention_days=args.partition_retention_days,
+        partition_retention_action=args.partition_retention_action,
+        linger_ms=linger_ms,
+        adaptive_batch=args.adaptive_batch,
+        target_post_ms=args.target_post_ms,
+        max_batch_bytes=args.max_batch_bytes,
+        metrics_port=args.metrics_port,
+        metrics_host=args.metrics_host,
+        stats_interval=args.stats_interval,
     )
 
 
 def main() -> None:
     load_dotenv_if_exists()
     args = parse_args()
-    require_tshark()
     cfg = build_config(args)
-    run_ingest(cfg)
+    if cfg.mode == "dir":
+        if cfg.reader == "tshark" or cfg.protocol_from == "tshark":
+            require_tshark()
+        run_dir(cfg)
+        return
+    if cfg.mode not in ("replay", "tail", "import") and (cfg.reader == "tshark" or cfg.protocol_from == "tshark"):
+        require_tshark()
+
+    telemetry = start_telemetry(cfg)
+    try:
+        if cfg.mode == "replay":
+            run_replay(cfg)
+        elif cfg.mode == "import":
+            run_import(cfg)
+        elif cfg.mode == "tail":
+            run_tail(cfg)
+        else:
+            run_ingest(cfg)
+    finally:
+        for item in telemetry:
+            item.close()
+        if cfg.stats_interval > 0:
+            print(stats_summary())
 
 
 if __name__ == "__main__":